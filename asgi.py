@@ -0,0 +1,438 @@
+import re
+import asyncio
+import json
+import time
+import jwt
+from datetime import date
+from functools import wraps
+from urllib.parse import parse_qsl
+from dotenv import load_dotenv
+from asgiref.wsgi import WsgiToAsgi
+from marshmallow.exceptions import ValidationError
+from psycopg2 import errorcodes
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError, DataError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+from werkzeug.http import parse_etags, quote_etag
+
+# uvicorn doesnt load .env like the flask command does
+load_dotenv()
+
+from main import create_app
+from models.product import Product, product_schema, products_schema, catalogue_schema
+from models.order import Order, ArchivedOrder, OrderSchema, order_schema, orders_schema, product_key
+from models.user import User
+from controllers.order_controller import BULK_REQUIRED, STREAM_HEARTBEAT, order_etag, sse
+from utils.pagination import page_args, page_query, page_result, merge_pages
+from utils.loading import PRODUCT_GRAPH, CATALOGUE_GRAPH, ORDER_GRAPH, load_options
+from utils.comments import latest_comments_arg, latest_comments
+from utils.identity import admin_cache, cached_admin
+from utils.pool import engine_options
+from utils.capacity import reserve_order
+from utils.order_events import get_broker, queue_order_event
+from utils.tokens import revocation_list
+from utils.rate_limit import IP_BLUEPRINTS, RATE_LIMIT_URL, find_limit, take_token, forwarded_address
+from utils.response_cache import RESPONSE_CACHE_URL, get_backend, response_entry
+from utils.instrumentation import async_request, RequestStats, record_request
+
+
+# Async serving mode, run with: uvicorn asgi:app
+# The product and order read endpoints, order creation and the order stream are handled here with an async engine (asyncpg),
+# so a worker can wait on the database for many clients at once instead of one thread per request.
+# Every other route is handed to the Flask app, which runs in a thread pool.
+
+flask_app = create_app()
+flask_asgi = WsgiToAsgi(flask_app)
+JWT_SECRET_KEY = flask_app.config['JWT_SECRET_KEY']
+
+
+def async_url(url):
+    # postgresql:// or postgresql+psycopg2:// urls are changed to use the asyncpg driver
+    return 'postgresql+asyncpg://' + url.split('://', 1)[1]
+
+
+def async_engine_options():
+    # The same pool settings as create_app, async engines use their own queue pool class
+    options = engine_options()
+    if options['poolclass'] is not NullPool:
+        del options['poolclass']
+    return options
+
+
+engine = create_async_engine(async_url(flask_app.config['SQLALCHEMY_DATABASE_URI']), **async_engine_options())
+# Objects are kept loaded after commit so they can be dumped without another (async) query
+Session = async_sessionmaker(engine, expire_on_commit = False)
+
+
+class Unauthorised(Exception):
+    # Returned the same way flask_jwt_extended returns web token errors, as {'msg': ...}
+    def __init__(self, message, status = 401):
+        self.message = message
+        self.status = status
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        # The same as Flask's request.full_path, which the response cache keys entries by
+        self.full_path = f"{scope['path']}?{scope['query_string'].decode('latin-1')}"
+        self.args = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        self.client = scope.get('client')
+        self.body = body
+
+    def get_json(self):
+        try:
+            return json.loads(self.body or b'null')
+        except ValueError:
+            raise ValidationError('The request body must be JSON.')
+
+    def token_claims(self):
+        # Decodes the web token and checks it hasnt expired, the revocation list is checked by jwt_claims
+        header = self.headers.get('authorization', '')
+        if not header.startswith('Bearer '):
+            raise Unauthorised('Missing Authorization Header')
+        try:
+            claims = jwt.decode(header[len('Bearer '):], JWT_SECRET_KEY, algorithms = ['HS256'])
+        except jwt.ExpiredSignatureError:
+            raise Unauthorised('Token has expired')
+        except jwt.PyJWTError as err:
+            raise Unauthorised(str(err), 422)
+        if claims.get('type') != 'access':
+            raise Unauthorised('Only non-refresh tokens are allowed', 422)
+        return claims
+
+    async def jwt_claims(self, session):
+        # Checks the web token the same way @jwt_required() does and returns its claims
+        claims = self.token_claims()
+        # The same revocation list as the Flask apps blocklist check, new revocations are loaded on the sync session underneath
+        if revocation_list.due():
+            await session.run_sync(lambda sync_session: revocation_list.sync(sync_session.connection()))
+        if revocation_list.is_revoked(claims):
+            raise Unauthorised('Token has been revoked')
+        return claims
+
+    def rate_limit_client(self, scope):
+        # Same as utils.rate_limit.client_key, the IP address for the auth routes, otherwise the user in the web token
+        # (an invalid token is rejected here like verify_jwt_in_request(optional = True) rejects it)
+        if scope.split('.')[0] not in IP_BLUEPRINTS and 'authorization' in self.headers:
+            return f'user:{self.token_claims()["sub"]}'
+        # The same address ProxyFix gives the Flask app when it is behind TRUSTED_PROXIES proxies
+        address = forwarded_address(self.headers.get('x-forwarded-for'), self.client[0] if self.client else None, flask_app.config['TRUSTED_PROXIES'])
+        return f'ip:{address}'
+
+
+async def check_rate_limit(request, endpoint):
+    # The same limits and buckets the Flask app checks its routes against, returns the 429 response or None
+    if not flask_app.config['RATE_LIMIT_ENABLED']:
+        return None
+    scope, limit = find_limit(endpoint)
+    if limit is None:
+        return None
+    client = request.rate_limit_client(scope)
+    if RATE_LIMIT_URL:
+        # The Redis call is made in a thread so it doesnt hold up the event loop
+        return await asyncio.to_thread(take_token, scope, limit, client)
+    return take_token(scope, limit, client)
+
+
+async def in_thread(function, *args):
+    # Calls to Redis are made in a thread so they dont hold up the event loop, the in-process cache is called directly
+    if RESPONSE_CACHE_URL:
+        return await asyncio.to_thread(function, *args)
+    return function(*args)
+
+
+def cached(handler):
+    # Same as utils.response_cache.cached_response, with the same keys and bodies so entries are shared with the Flask app
+    @wraps(handler)
+    async def wrapper(request, session, *args):
+        backend = get_backend()
+        version = await in_thread(backend.get_version)
+        key = f'catalogue:{version}:{request.full_path}'
+        entry = await in_thread(backend.get, key)
+        if entry is None:
+            response = await handler(request, session, *args)
+            # Only successful responses are cached, errors such as a 404 are returned as they are
+            if response[1] != 200:
+                return response
+            entry = response_entry(flask_app.json.encode(response[0]))
+            await in_thread(backend.set, key, *entry)
+        etag, body = entry
+        headers = {'ETag': quote_etag(etag)}
+        # A 304 Not Modified if the etag matches the If-None-Match header, like make_conditional
+        if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+            return b'', 304, headers
+        return body, 200, headers
+    return wrapper
+
+
+async def authorise_as_admin(session, claims):
+    # Same as utils.identity.lookup_admin, the claim or cache entry worked out last wins, otherwise the users table is queried
+    user_id = int(claims['sub'])
+    is_admin = cached_admin(user_id, claims)
+    if is_admin is not None:
+        return is_admin
+    is_admin = bool(await session.scalar(select(User.is_admin).filter_by(id = user_id)))
+    admin_cache.set(user_id, (is_admin, time.time()))
+    return is_admin
+
+
+async def read_page(session, qry, projected):
+    if projected:
+        rows = [row._asdict() for row in await session.execute(qry)]
+        return rows, [row['id'] for row in rows]
+    rows = (await session.scalars(qry)).all()
+    return rows, [row.id for row in rows]
+
+
+async def paginate(session, request, model, schema, *criteria, graph = None, archive = None):
+    # Async version of utils.pagination.paginate using the same query and page building
+    limit, after, fields = page_args(schema, request.args)
+    qry, projected = page_query(model, limit, after, fields, criteria, graph)
+    rows, ids = await read_page(session, qry, projected)
+    if archive is not None:
+        archive_model, archive_criteria = archive
+        qry, projected = page_query(archive_model, limit, after, fields, archive_criteria, graph)
+        rows, ids = merge_pages((rows, ids), await read_page(session, qry, projected))
+    return page_result(rows, ids, schema, limit, fields)
+
+
+def include_archived(request):
+    # Same as utils.archive.include_archived
+    return request.args.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+
+@cached
+async def get_products(request, session):
+    count = latest_comments_arg(request.args)
+    if count is None:
+        return await paginate(session, request, Product, products_schema, graph = PRODUCT_GRAPH), 200
+    # Same as the Flask route, each product is listed with only its newest count comments read with one query for the page
+    page = await paginate(session, request, Product, catalogue_schema, graph = CATALOGUE_GRAPH)
+    comments = await session.run_sync(latest_comments, [product['id'] for product in page['data']], count)
+    for product in page['data']:
+        product['latest_comments'] = comments.get(product['id'], [])
+    return page, 200
+
+
+@cached
+async def get_one_product(request, session, id):
+    qry = select(Product).where(Product.id == id).options(*load_options(PRODUCT_GRAPH))
+    product = await session.scalar(qry)
+    if product:
+        return product_schema.dump(product), 200
+    return {'error': f'Product with id {id} not found.'}, 404
+
+
+async def get_orders(request, session):
+    claims = await request.jwt_claims(session)
+    if await authorise_as_admin(session, claims):
+        archive = (ArchivedOrder, []) if include_archived(request) else None
+        return await paginate(session, request, Order, orders_schema, graph = ORDER_GRAPH, archive = archive), 200
+    archive = (ArchivedOrder, [ArchivedOrder.user_id == int(claims['sub'])]) if include_archived(request) else None
+    return await paginate(session, request, Order, orders_schema, Order.user_id == int(claims['sub']), graph = ORDER_GRAPH, archive = archive), 200
+
+
+async def get_one_order(request, session, id):
+    claims = await request.jwt_claims(session)
+    is_admin = await authorise_as_admin(session, claims)
+    order = await session.scalar(select(Order).where(Order.id == id))
+    if not order and include_archived(request):
+        order = await session.scalar(select(ArchivedOrder).where(ArchivedOrder.id == id))
+    if not order:
+        return {'error': f'Order with id {id} not found.'}, 404
+    if is_admin or str(order.user_id) == claims['sub']:
+        # The same ETag as the Flask route, parsed back in If-Match when editing the order
+        return order_schema.dump(order), 200, {'ETag': order_etag(order)}
+    return {'error': 'Only the user this order belongs to can veiw it.'}, 401
+
+
+async def create_order(request, session):
+    claims = await request.jwt_claims(session)
+    body = request.get_json()
+    # The product is loaded here and parsed to the order schema so its validation doesnt query it with the sync session
+    key = product_key(body.get('product_id')) if isinstance(body, dict) else None
+    product = await session.get(Product, key) if key is not None else None
+    body_data = OrderSchema(context = {'products': {product.id: product} if product else {}}).load(body)
+    missing = [field for field in BULK_REQUIRED if body_data.get(field) is None]
+    if missing:
+        return {'error': f'{missing[0]} is required to order a product.'}, 409
+    # The capacity check runs on the sync session underneath, holding the days lock until the commit below
+    await session.run_sync(reserve_order, body_data['product'], body_data.get('quantity'), body_data['delivery_pup_date'])
+    order = Order(
+        date_ordered = date.today(),
+        user_id = int(claims['sub']),
+        product_id = body_data['product'].id,
+        quantity = body_data.get('quantity'),
+        status = 'In-queue',
+        description = body_data.get('description'),
+        delivery_pup_date = body_data.get('delivery_pup_date')
+    )
+    session.add(order)
+    try:
+        # The order is flushed to get its id so the event for /orders/stream can be queued, it is sent when the session commits
+        await session.flush()
+        order_data = order_schema.dump(order)
+        queue_order_event(session.sync_session, 'created', order_data)
+        await session.commit()
+    # Same as the Flask route, asyncpg errors carry the same SQLSTATE codes as psycopg2 ones
+    except IntegrityError as err:
+        await session.rollback()
+        if err.orig.pgcode == errorcodes.NOT_NULL_VIOLATION:
+            return {'error': f'{err.orig.__cause__.column_name} is required to order a product.'}, 409
+        raise
+    except DataError as err:
+        await session.rollback()
+        if err.orig.pgcode == errorcodes.INVALID_TEXT_REPRESENTATION:
+            return {'error': 'Please enter product_id as a number.'}, 409
+        raise
+    return order_data, 201
+
+
+async def token_valid(claims):
+    # Same check as the Flask stream makes each time it wakes up, the token hasnt expired or been revoked since the stream opened
+    if time.time() >= claims['exp']:
+        return False
+    if revocation_list.due():
+        async with Session() as session:
+            await session.run_sync(lambda sync_session: revocation_list.sync(sync_session.connection()))
+    return not revocation_list.is_revoked(claims)
+
+
+async def stream_orders(request, session):
+    # Same as the Flask route, the events are waited for on the event loop so an open stream doesnt hold a thread
+    claims = await request.jwt_claims(session)
+    is_admin = await authorise_as_admin(session, claims)
+    user_id = int(claims['sub'])
+    broker = get_broker()
+    broker.start()
+    after, missed = broker.resume(request.headers.get('last-event-id'))
+
+    async def generate():
+        nonlocal after
+        if missed:
+            yield 'event: reset\ndata: {}\n\n'
+        while True:
+            if not await token_valid(claims):
+                yield 'event: expired\ndata: {}\n\n'
+                return
+            events = await broker.wait_async(after, min(STREAM_HEARTBEAT, max(claims['exp'] - time.time(), 0)))
+            if not events:
+                yield ': keep-alive\n\n'
+            for seq, order_event in events:
+                after = seq
+                if order_event['type'] == 'reset':
+                    yield 'event: reset\ndata: {}\n\n'
+                elif is_admin or order_event['user_id'] == user_id:
+                    yield sse(order_event)
+
+    return generate(), 200, {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+# The routes handled in async mode with the endpoint name of the same Flask route (for its rate limit),
+# anything else goes to the Flask app
+ROUTES = [
+    ('GET', re.compile(r'^/products/$'), get_products, 'products.get_products'),
+    ('GET', re.compile(r'^/products/(\d+)$'), get_one_product, 'products.get_one_product'),
+    ('GET', re.compile(r'^/orders/$'), get_orders, 'orders.get_orders'),
+    ('GET', re.compile(r'^/orders/stream$'), stream_orders, 'orders.stream_orders'),
+    ('GET', re.compile(r'^/orders/(\d+)$'), get_one_order, 'orders.get_one_order'),
+    ('POST', re.compile(r'^/orders/$'), create_order, 'orders.create_order'),
+]
+
+# The url rule of each Flask route (e.g. /orders/<int:id>), the metrics and access log count requests by it
+RULES = {endpoint: next(flask_app.url_map.iter_rules(endpoint)).rule for method, pattern, handler, endpoint in ROUTES}
+
+
+async def read_body(receive):
+    body = b''
+    more = True
+    while more:
+        message = await receive()
+        body += message.get('body', b'')
+        more = message.get('more_body', False)
+    return body
+
+
+async def send_json(send, payload, status, headers = None):
+    # Handlers return (payload, status) or (payload, status, headers) like Flask views,
+    # payloads are encoded the same way as the Flask app, cached responses are already bytes
+    body = payload if isinstance(payload, bytes) else flask_app.json.encode(payload)
+    extra = [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in (headers or {}).items()]
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + extra,
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def send_stream(receive, send, events, status, headers):
+    # Sends each Server-Sent Event as it is generated, the session the stream was opened with has been closed by now
+    extra = [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in headers.items()]
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/event-stream; charset=utf-8')] + extra,
+    })
+    # The server doesnt raise when sending to a client that has gone away, so the stream is stopped once it says so
+    # (checked each time the stream sends something, at least every STREAM_HEARTBEAT seconds)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        async for event in events:
+            if disconnected.done():
+                return
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        await events.aclose()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http':
+        for method, pattern, handler, endpoint in ROUTES:
+            match = pattern.match(scope['path'])
+            if match and scope['method'] == method:
+                request = Request(scope, await read_body(receive))
+                # Counted the same as Flask requests, the SQL run for this request is added to it by utils.instrumentation
+                stats = RequestStats(request.headers.get('x-request-id'), RULES[endpoint])
+                token = async_request.set(stats)
+                try:
+                    async with Session() as session:
+                        try:
+                            response = await check_rate_limit(request, endpoint) \
+                                or await handler(request, session, *(int(value) for value in match.groups()))
+                        except ValidationError as err:
+                            response = {'error': err.messages}, 400
+                        except Unauthorised as err:
+                            response = {'msg': err.message}, err.status
+                finally:
+                    async_request.reset(token)
+                payload, status, *headers = response
+                headers = {**(headers[0] if headers else {}), **record_request(stats, request.method, request.full_path.rstrip('?'), status)}
+                if hasattr(payload, '__aiter__'):
+                    return await send_stream(receive, send, payload, status, headers)
+                return await send_json(send, payload, status, headers)
+    await flask_asgi(scope, receive, send)
@@ -0,0 +1,222 @@
+import json
+import time
+import random
+import itertools
+import subprocess
+import urllib.request
+import urllib.error
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from utils.sql_counter import count_queries
+
+
+# The logins used by the benchmark, created by flask db seed
+ADMIN_LOGIN = {'email': 'admin@mail.com', 'password': 'password123'}
+USER_LOGIN = {'email': 'janedoe@mail.com', 'password': 'jane123'}
+
+
+class TestClientTarget:
+    # Sends requests through the Flask test client inside this process, SQL statements are counted directly
+    name = 'test-client'
+
+    def __init__(self, app):
+        self.app = app
+        # Every benchmark request comes from the same address and users so the rate limits are turned off
+        app.config['RATE_LIMIT_ENABLED'] = False
+        self.client = app.test_client()
+
+    def request(self, method, path, body = None, token = None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        with self.app.app_context(), count_queries() as statements:
+            response = self.client.open(path, method = method, json = body, headers = headers)
+        return response.status_code, response.get_json(silent = True), len(statements)
+
+
+class HttpTarget:
+    # Sends requests to a real server process, SQL statements are read from the X-SQL-Statements header if it is sent
+    # the server needs to be run with RATE_LIMIT_ENABLED=false, the benchmark logs in and orders far faster than the limits allow
+    def __init__(self, base_url):
+        self.name = base_url
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body = None, token = None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data = data, method = method)
+        req.add_header('Content-Type', 'application/json')
+        if token:
+            req.add_header('Authorization', f'Bearer {token}')
+        try:
+            with urllib.request.urlopen(req) as response:
+                status, raw, headers = response.status, response.read(), response.headers
+        except urllib.error.HTTPError as err:
+            status, raw, headers = err.code, err.read(), err.headers
+        try:
+            payload = json.loads(raw)
+        except ValueError:
+            payload = None
+        statements = headers.get('X-SQL-Statements')
+        return status, payload, int(statements) if statements is not None else None
+
+
+class Recorder:
+    # Times each request and keeps the latency, status and SQL statement count under the scenario name
+    def __init__(self, target):
+        self.target = target
+        self.samples = {}
+
+    def call(self, name, method, path, body = None, token = None):
+        started = time.perf_counter()
+        status, payload, statements = self.target.request(method, path, body, token)
+        latency = time.perf_counter() - started
+        self.samples.setdefault(name, []).append((latency, status, statements))
+        return status, payload
+
+
+def login(recorder, credentials):
+    status, payload = recorder.call('login', 'POST', '/auth/login', credentials)
+    # The benchmark logs in far more often than the login rate limit allows
+    if status == 429:
+        raise RuntimeError('The server rate limited the benchmark, run it with RATE_LIMIT_ENABLED=false to benchmark it.')
+    if status != 200:
+        raise RuntimeError(f'Could not log in as {credentials["email"]}, run flask db seed first.')
+    return payload['token']
+
+
+def scenario_login(recorder, state):
+    login(recorder, USER_LOGIN)
+
+
+# Numbers added to the query string of the product requests that should miss the response cache,
+# the cache keys responses by their path and query string so every number is a new entry
+cache_busters = itertools.count()
+
+
+def scenario_products(recorder, state):
+    # product_list and product_get time the endpoints themselves, each request has a query string no other request has used
+    # so it misses the response cache, the _cached ones ask for the same page every time and time cache hits
+    bust = f'{state["run_id"]}-{next(cache_busters)}'
+    recorder.call('product_list', 'GET', f'/products/?bench={bust}')
+    recorder.call('product_get', 'GET', f'/products/{state["product_id"]}?bench={bust}')
+    recorder.call('product_list_cached', 'GET', '/products/')
+    recorder.call('product_get_cached', 'GET', f'/products/{state["product_id"]}')
+
+
+def scenario_orders(recorder, state):
+    # A full order life cycle, create then read, edit and delete it, plus the order listings
+    # Spread over days well after the orders seed-scale generates so the kitchen capacity of a day isnt used up
+    delivery = (date.today() + timedelta(days = random.randint(30, 395))).strftime('%d/%m/%Y')
+    status, payload = recorder.call('order_create', 'POST', '/orders/', {
+        'product_id': state['product_id'],
+        'quantity': 1,
+        'description': 'Benchmark order',
+        'delivery_pup_date': delivery
+    }, state['user_token'])
+    recorder.call('order_list', 'GET', '/orders/', token = state['user_token'])
+    recorder.call('order_list_admin', 'GET', '/orders/', token = state['admin_token'])
+    if status == 201:
+        order_id = payload['id']
+        recorder.call('order_get', 'GET', f'/orders/{order_id}', token = state['user_token'])
+        recorder.call('order_edit', 'PATCH', f'/orders/{order_id}', {'description': 'Edited benchmark order'}, state['user_token'])
+        recorder.call('order_delete', 'DELETE', f'/orders/{order_id}', token = state['user_token'])
+
+
+SCENARIOS = {
+    'login': scenario_login,
+    'products': scenario_products,
+    'orders': scenario_orders,
+}
+
+
+def percentile(values, percent):
+    # Nearest rank percentile of the sorted values
+    index = max(int(round(percent / 100 * len(values))) - 1, 0)
+    return values[index]
+
+
+def summarise(samples, elapsed):
+    results = {}
+    for name, rows in sorted(samples.items()):
+        latencies = sorted(latency for latency, status, statements in rows)
+        counts = [statements for latency, status, statements in rows if statements is not None]
+        results[name] = {
+            'requests': len(rows),
+            # Requests rejected by the rate limiter are counted on their own so they arent mistaken for failures of the endpoint
+            'errors': sum(1 for latency, status, statements in rows if status >= 400 and status != 429),
+            'rate_limited': sum(1 for latency, status, statements in rows if status == 429),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'requests_per_sec': round(len(rows) / elapsed, 1) if elapsed else None,
+            'sql_per_request': round(sum(counts) / len(counts), 2) if counts else None,
+        }
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text = True, stderr = subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(target, scenarios, iterations = 100, warmup = 10, concurrency = 1):
+    # Runs each scenario warmup times without recording, then iterations times spread over concurrency threads
+    setup = Recorder(target)
+    state = {'admin_token': login(setup, ADMIN_LOGIN), 'user_token': login(setup, USER_LOGIN)}
+    # Kept in the cache busting query strings so a second run against the same server doesnt hit the first runs entries
+    state['run_id'] = random.getrandbits(32)
+    status, payload = setup.call('setup', 'GET', '/products/?limit=1&fields=id')
+    state['product_id'] = payload['data'][0]['id']
+
+    results = {}
+    for name in scenarios:
+        scenario = SCENARIOS[name]
+        for i in range(warmup):
+            scenario(Recorder(target), state)
+        recorder = Recorder(target)
+        started = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers = concurrency) as pool:
+                list(pool.map(lambda i: scenario(recorder, state), range(iterations)))
+        else:
+            for i in range(iterations):
+                scenario(recorder, state)
+        results.update(summarise(recorder.samples, time.perf_counter() - started))
+    return {
+        'commit': git_commit(),
+        'target': target.name,
+        'iterations': iterations,
+        'concurrency': concurrency,
+        'results': results,
+    }
+
+
+def compare(report, baseline, threshold = 0.2):
+    # Returns the endpoints that got slower at p95 by more than the threshold or run more SQL statements than the baseline
+    regressions = []
+    for name, current in report['results'].items():
+        previous = baseline['results'].get(name)
+        if not previous:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(f'{name}: p95 {previous["p95_ms"]}ms -> {current["p95_ms"]}ms')
+        if current['sql_per_request'] is not None and previous['sql_per_request'] is not None \
+                and current['sql_per_request'] > previous['sql_per_request']:
+            regressions.append(f'{name}: SQL statements per request {previous["sql_per_request"]} -> {current["sql_per_request"]}')
+    return regressions
+
+
+def rate_limit_warning(report):
+    # Returns a warning if any requests got a 429, their latencies are of the rate limiter rather than the endpoint
+    limited = sum(row.get('rate_limited', 0) for row in report['results'].values())
+    if limited:
+        return f'{limited} requests to {report["target"]} were rate limited (429), run the server with RATE_LIMIT_ENABLED=false to benchmark it.'
+    return None
+
+
+def format_report(report):
+    lines = [f'{"endpoint":<20} {"reqs":>6} {"errors":>6} {"429s":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"req/s":>8} {"sql/req":>8}']
+    for name, row in report['results'].items():
+        sql = row['sql_per_request'] if row['sql_per_request'] is not None else '-'
+        lines.append(f'{name:<20} {row["requests"]:>6} {row["errors"]:>6} {row["rate_limited"]:>6} {row["p50_ms"]:>8} {row["p95_ms"]:>8} {row["p99_ms"]:>8} {row["requests_per_sec"]:>8} {sql:>8}')
+    return '\n'.join(lines)
@@ -1,10 +1,12 @@
-from init import db, bcrypt
+from init import db
 from flask import Blueprint, request
-from flask_jwt_extended import create_access_token
+from flask_jwt_extended import get_jwt, jwt_required
 from models.user import User, user_schema
+from utils.identity import authorise_as_admin
+from utils.tokens import login_tokens, refresh_tokens, revoke_token, revoke_family, revoke_user
+from utils.passwords import hash_password, check_password, needs_rehash
 from sqlalchemy.exc import IntegrityError
 from psycopg2 import errorcodes
-from datetime import timedelta
 
 
 auth_bp = Blueprint('auth', __name__, url_prefix = '/auth')
@@ -20,9 +22,9 @@ def auth_register():
         user.last_name = body_data.get('last_name')
         user.address = body_data.get('address')
         user.email = body_data.get('email')
-        # Hashes the users password to be stored in the database as a hash
+        # Hashes the users password to be stored in the database as a hash, on the password hashing pool
         if body_data.get('password'):
-            user.password = bcrypt.generate_password_hash(body_data.get('password')).decode('utf-8')
+            user.password = hash_password(body_data.get('password'))
         # Adds this user to the session
         db.session.add(user)
         # Commits user that was added to the database
@@ -48,12 +50,62 @@ def auth_login():
     # If the query of the DB doesnt match a valid user email then return email error message
     # If the valid email matches but the password hash doesnt return password error message
     if user:
-        if bcrypt.check_password_hash(user.password, body_data.get('password')):
-            token = create_access_token(identity=str(user.id), expires_delta=timedelta(days=7))
-            return {'email': user.email, 'token': token}
+        if check_password(user.password, body_data.get('password')):
+            # If the password was hashed with a different cost to the current BCRYPT_LOG_ROUNDS it is hashed again
+            if needs_rehash(user.password):
+                user.password = hash_password(body_data.get('password'))
+            # the users admin status is signed into the short lived access token so admin checks dont need to query the database,
+            # the refresh token is used with /auth/refresh to get a new one before it expires
+            tokens = login_tokens(db.session, user)
+            db.session.commit()
+            return {'email': user.email, **tokens}
         else:
             return {'error': "password was incorrect, please try again"}, 401
     else:
         return {'error': "email does not exist, please try again"}, 401
-    
-    
\ No newline at end of file
+
+
+@auth_bp.route('/refresh', methods = ['POST'])
+@jwt_required(refresh = True)
+def auth_refresh():
+    claims = get_jwt()
+    # The user is read again so a change to their admin status is in the new access token
+    user = db.session.get(User, int(claims['sub']))
+    if not user:
+        return {'error': "user no longer exists, please log in again"}, 401
+    # Each refresh token can only be used once, its family moves on to the new refresh token as it is issued
+    tokens = refresh_tokens(db.session, user, claims)
+    if tokens is None:
+        # It was already used by another request, so someone else has a copy and every token of this login is revoked
+        db.session.rollback()
+        revoke_family(db.session, claims['fam'])
+        db.session.commit()
+        return {'msg': 'Token has been revoked'}, 401
+    db.session.commit()
+    return {'email': user.email, **tokens}
+
+
+@auth_bp.route('/logout', methods = ['POST'])
+@jwt_required(verify_type = False)
+def auth_logout():
+    # Revokes the access and refresh tokens of this login, with either of them
+    claims = get_jwt()
+    if claims.get('fam'):
+        revoke_family(db.session, claims['fam'])
+    else:
+        revoke_token(db.session, claims)
+    db.session.commit()
+    return {'message': 'Logged out successfully.'}, 200
+
+
+@auth_bp.route('/revoke/<int:user_id>', methods = ['POST'])
+@jwt_required()
+def auth_revoke(user_id):
+    # Admins can revoke every token a user has been issued, e.g. to lock out a stolen account until they log in again
+    if not authorise_as_admin():
+        return {'error': 'Only admins can revoke another users tokens.'}, 403
+    if not db.session.get(User, user_id):
+        return {'error': f'User with id {user_id} not found.'}, 404
+    revoke_user(db.session, user_id)
+    db.session.commit()
+    return {'message': f'Every token of user {user_id} has been revoked.'}, 200
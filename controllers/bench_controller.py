@@ -0,0 +1,110 @@
+import json
+import time
+import click
+from flask import Blueprint, current_app
+from marshmallow import Schema
+from init import db
+from benchmarks.runner import SCENARIOS, TestClientTarget, HttpTarget, run, compare, format_report, rate_limit_warning
+from models.product import Product, products_schema
+from models.comment import Comment, comments_schema
+from models.order import Order, orders_schema
+
+
+bench_commands = Blueprint('bench', __name__)
+
+
+def run_report(target, scenarios, iterations, warmup, concurrency):
+    # Runs the benchmark, a server that rate limits its logins stops it and any other 429s are warned about
+    try:
+        report = run(target, scenarios, iterations, warmup, concurrency)
+    except RuntimeError as err:
+        raise click.ClickException(str(err))
+    warning = rate_limit_warning(report)
+    if warning:
+        click.echo(f'Warning: {warning}', err = True)
+    return report
+
+
+@bench_commands.cli.command('run')
+@click.option('--target', default = 'test-client', help = 'test-client to run in this process, or the url of a running server e.g. http://localhost:5001')
+@click.option('--scenario', 'scenarios', multiple = True, type = click.Choice(list(SCENARIOS)), help = 'Scenarios to run, all of them by default.')
+@click.option('--iterations', default = 100, help = 'Times each scenario is run.')
+@click.option('--warmup', default = 10, help = 'Times each scenario is run before timing starts.')
+@click.option('--concurrency', default = 1, help = 'Threads sending requests at once, only for a server target.')
+@click.option('--save', type = click.Path(), help = 'Save the results as JSON, e.g. as a baseline.')
+@click.option('--compare', 'baseline_path', type = click.Path(exists = True), help = 'Baseline JSON to compare the results to.')
+@click.option('--threshold', default = 0.2, help = 'How much slower p95 can be than the baseline before it is a regression.')
+def run_bench(target, scenarios, iterations, warmup, concurrency, save, baseline_path, threshold):
+    # Runs the benchmark scenarios against the app and reports the latency, throughput and SQL statements per endpoint
+    # run flask db seed (and flask db seed-scale for realistic volumes) first, and a server target with RATE_LIMIT_ENABLED=false
+    if target == 'test-client':
+        # The SQL statement counter is shared by the whole process so the test client sends one request at a time
+        if concurrency != 1:
+            raise click.ClickException('--concurrency only works with a server target.')
+        bench_target = TestClientTarget(current_app._get_current_object())
+    else:
+        bench_target = HttpTarget(target)
+    report = run_report(bench_target, scenarios or list(SCENARIOS), iterations, warmup, concurrency)
+    print(format_report(report))
+    if save:
+        with open(save, 'w') as file:
+            json.dump(report, file, indent = 2)
+        print(f'Results saved to {save}')
+    if baseline_path:
+        with open(baseline_path) as file:
+            regressions = compare(report, json.load(file), threshold)
+        if regressions:
+            raise click.ClickException('Regressions compared to the baseline:\n' + '\n'.join(regressions))
+        print('No regressions compared to the baseline')
+
+
+@bench_commands.cli.command('modes')
+@click.option('--wsgi', 'wsgi_url', required = True, help = 'Url of the app served by a WSGI server, e.g. gunicorn -w 4 "main:create_app()"')
+@click.option('--asgi', 'asgi_url', required = True, help = 'Url of the app served in async mode, e.g. uvicorn asgi:app')
+@click.option('--iterations', default = 200, help = 'Times each scenario is run.')
+@click.option('--warmup', default = 10, help = 'Times each scenario is run before timing starts.')
+@click.option('--concurrency', default = 50, help = 'Clients sending requests at once.')
+def compare_modes(wsgi_url, asgi_url, iterations, warmup, concurrency):
+    # Runs the product and order scenarios against both serving modes with the same load and prints them side by side
+    # Both servers need to be run with RATE_LIMIT_ENABLED=false
+    reports = {
+        'wsgi': run_report(HttpTarget(wsgi_url), ['products', 'orders'], iterations, warmup, concurrency),
+        'asgi': run_report(HttpTarget(asgi_url), ['products', 'orders'], iterations, warmup, concurrency),
+    }
+    print(f'{"endpoint":<20} {"wsgi p95":>9} {"asgi p95":>9} {"wsgi req/s":>11} {"asgi req/s":>11}')
+    for name, wsgi in reports['wsgi']['results'].items():
+        asgi = reports['asgi']['results'].get(name)
+        if asgi:
+            print(f'{name:<20} {wsgi["p95_ms"]:>9} {asgi["p95_ms"]:>9} {wsgi["requests_per_sec"]:>11} {asgi["requests_per_sec"]:>11}')
+
+
+@bench_commands.cli.command('serializers')
+@click.option('--iterations', default = 20, help = 'Times each schema dumps every row when timing.')
+def bench_serializers(iterations):
+    # Checks the compiled dump of each schema gives exactly the same output (values and key order) as marshmallow
+    # for every row in the database, then times both, run flask db seed (or seed-scale) first
+    checks = [
+        ('products', Product, products_schema),
+        ('comments', Comment, comments_schema),
+        ('orders', Order, orders_schema),
+    ]
+    mismatches = []
+    print(f'{"schema":<10} {"rows":>6} {"marshmallow ms":>15} {"compiled ms":>12} {"speedup":>8}')
+    for name, model, schema in checks:
+        rows = db.session.scalars(db.select(model).order_by(model.id)).all()
+        expected = Schema.dump(schema, rows)
+        dumped = schema.dump(rows)
+        # json.dumps keeps the key order so this compares it as well as the values
+        if json.dumps(dumped, default = str) != json.dumps(expected, default = str):
+            mismatches.append(name)
+        timings = []
+        for dump in (lambda: Schema.dump(schema, rows), lambda: schema.dump(rows)):
+            started = time.perf_counter()
+            for i in range(iterations):
+                dump()
+            timings.append((time.perf_counter() - started) * 1000 / iterations)
+        speedup = timings[0] / timings[1] if timings[1] else 0
+        print(f'{name:<10} {len(rows):>6} {timings[0]:>15.2f} {timings[1]:>12.2f} {speedup:>7.1f}x')
+    if mismatches:
+        raise click.ClickException('The compiled dump doesnt match marshmallow for: ' + ', '.join(mismatches))
+    print('The compiled dumps match marshmallow')
@@ -0,0 +1,59 @@
+from flask import Blueprint, request
+from init import db
+from flask_jwt_extended import jwt_required
+from datetime import date, timedelta
+from marshmallow.exceptions import ValidationError
+from models.product import Product
+from models.order import LocalDate
+from models.capacity import CapacityDay, capacity_day_schema
+from utils.capacity import availability, order_weight
+from utils.identity import authorise_as_admin
+from utils.routing import read_only
+
+
+capacity_bp = Blueprint('capacity', __name__)
+
+# Default number of days shown by GET /orders/availability and the most that can be asked for at once
+AVAILABILITY_DAYS = 30
+MAX_AVAILABILITY_DAYS = 366
+
+
+@capacity_bp.route('/availability')
+# Only reads from the database so can be sent to a read replica
+@read_only
+def get_availability():
+    # Shows how much of each days capacity is booked between from and to (DD/MM/YYYY, today to 30 days from now by default)
+    # if a product_id is parsed each day also shows if that product can be ordered for then
+    start = LocalDate().deserialize(request.args['from']) if request.args.get('from') else date.today()
+    end = LocalDate().deserialize(request.args['to']) if request.args.get('to') else start + timedelta(days = AVAILABILITY_DAYS - 1)
+    if end < start:
+        raise ValidationError('to cannot be before from.')
+    if (end - start).days >= MAX_AVAILABILITY_DAYS:
+        raise ValidationError(f'A maximum of {MAX_AVAILABILITY_DAYS} days can be shown at once.')
+    if request.args.get('product_id'):
+        product = db.session.scalar(db.select(Product).filter_by(id = request.args.get('product_id', type = int)))
+        if not product:
+            return {'error': f'Product not found with id:{request.args.get("product_id")}.'}, 404
+        # Orders of the product cant be due before it has been prepared
+        earliest = date.today() + timedelta(days = product.prep_days + 1)
+        days = availability(db.session, start, end, order_weight(product.prep_days, 1), earliest)
+        return {'product_id': product.id, 'days': days}
+    return {'days': availability(db.session, start, end)}
+
+
+@capacity_bp.route('/capacity', methods = ['PUT'])
+# JSON Web Token required from login to use this method
+@jwt_required()
+def set_capacity():
+    # Only an admin can change the capacity of a day, e.g. setting it to 0 closes the kitchen that day
+    if not authorise_as_admin():
+        return {'error': 'Not authorised to change capacity'}, 401
+    body_data = capacity_day_schema.load(request.get_json())
+    capacity_day = db.session.get(CapacityDay, body_data['day'])
+    if capacity_day:
+        capacity_day.capacity = body_data['capacity']
+    else:
+        capacity_day = CapacityDay(day = body_data['day'], capacity = body_data['capacity'])
+        db.session.add(capacity_day)
+    db.session.commit()
+    return capacity_day_schema.dump(capacity_day)
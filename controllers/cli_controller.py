@@ -1,14 +1,36 @@
+import os
+import click
+import random
 from init import db, bcrypt
-from flask import Blueprint
+from flask import Blueprint, current_app
+from concurrent.futures import ProcessPoolExecutor
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import insert
 from models.user import User
 from models.product import Product
 from models.comment import Comment
 from models.order import Order
+from models.order import VALID_STATUSES
 from datetime import date, timedelta
+from utils.response_cache import invalidate_catalogue
+from utils.product_stats import refresh_product_stats
+from utils.importer import IMPORT_KINDS, LegacyImport
+from utils.archive import ARCHIVE_AFTER_DAYS, archive_orders
 
 
 db_commands = Blueprint('db',  __name__)
 
+# Folder holding the alembic environment and the revisions in migrations/versions
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+def alembic_config():
+    # Alembic is configured here instead of an alembic.ini so the migrations run through the flask db commands
+    config = Config()
+    config.set_main_option('script_location', MIGRATIONS_DIR)
+    return config
+
 
 @db_commands.cli.command('drop')
 def drop_db():
@@ -20,8 +42,69 @@ def drop_db():
 def create_db():
     # Creates all tables in the database
     db.create_all()
+    # The tables are created from the models which already have every migration applied
+    # so the database is marked as being at the latest revision
+    command.stamp(alembic_config(), 'head')
     print('Tables Created')
 
+@db_commands.cli.command('upgrade')
+@click.argument('revision', default = 'head')
+def upgrade_db(revision):
+    # Applies the migrations in migrations/versions up to the revision (the latest by default)
+    command.upgrade(alembic_config(), revision)
+    print(f'Database upgraded to {revision}')
+
+@db_commands.cli.command('downgrade')
+@click.argument('revision', default = '-1')
+def downgrade_db(revision):
+    # Reverts migrations back to the revision (the previous one by default)
+    command.downgrade(alembic_config(), revision)
+    print(f'Database downgraded to {revision}')
+
+@db_commands.cli.command('current')
+def current_db():
+    # Shows the revision the database is currently at
+    command.current(alembic_config())
+
+@db_commands.cli.command('revision')
+@click.option('-m', '--message', required = True)
+@click.option('--autogenerate', is_flag = True)
+def revision_db(message, autogenerate):
+    # Creates a new migration in migrations/versions, --autogenerate compares the models to the database
+    command.revision(alembic_config(), message = message, autogenerate = autogenerate)
+
+# The queries run by the order listings, relationship loading and cascade deletes, with the index each should use
+HOT_QUERIES = [
+    ("SELECT * FROM orders WHERE user_id = 1 ORDER BY date_ordered", 'ix_orders_user_id_date_ordered'),
+    ("SELECT * FROM orders WHERE product_id IN (1, 2)", 'ix_orders_product_id'),
+    ("SELECT * FROM orders WHERE status = 'In-queue'", 'ix_orders_status'),
+    ("SELECT * FROM orders WHERE delivery_pup_date BETWEEN '2030-01-01' AND '2030-01-31'", 'ix_orders_delivery_pup_date'),
+    ("SELECT * FROM comments WHERE product_id IN (1, 2)", 'ix_comments_product_id_id'),
+    ("SELECT * FROM comments WHERE product_id = 1 AND id < 100 ORDER BY id DESC LIMIT 21", 'ix_comments_product_id_id'),
+    ("SELECT * FROM comments WHERE user_id = 1", 'ix_comments_user_id'),
+]
+
+def explain_plan(connection, sql):
+    # Returns the postgres EXPLAIN plan of the query as text, used by flask db explain and tests/test_explain.py
+    # sequential scans are turned off for the check as small tables would always be scanned instead
+    connection.execute(db.text('SET LOCAL enable_seqscan = off'))
+    return '\n'.join(row[0] for row in connection.execute(db.text(f'EXPLAIN {sql}')))
+
+@db_commands.cli.command('explain')
+def explain_db():
+    # Runs EXPLAIN on each hot query and checks the plan uses its index
+    failed = False
+    with db.engine.connect() as connection:
+        for sql, index in HOT_QUERIES:
+            plan = explain_plan(connection, sql)
+            used = index in plan
+            failed = failed or not used
+            print(f"{'OK  ' if used else 'FAIL'} {index}: {sql}")
+            if not used:
+                print(plan)
+    if failed:
+        raise click.ClickException('Some hot queries are not using their index, run flask db upgrade.')
+
 @db_commands.cli.command('seed')
 def seed_db():
     users = [
@@ -149,4 +232,148 @@ def seed_db():
     # Seeds all of the database entries 
     db.session.commit()
 
-    print("Tables Seeded")
\ No newline at end of file
+    print("Tables Seeded")
+
+
+@db_commands.cli.command('refresh-stats')
+def refresh_stats_db():
+    # Rebuilds the product_stats table from the orders and comments tables
+    # e.g. if rows were changed directly in the database instead of through the API
+    refresh_product_stats(db.session)
+    db.session.commit()
+    invalidate_catalogue()
+    print('Product stats refreshed')
+
+
+@db_commands.cli.command('archive-orders')
+@click.option('--days', default = ARCHIVE_AFTER_DAYS, help = 'Completed orders placed more than this many days ago are archived.')
+@click.option('--batch-size', default = 5000, help = 'Orders moved per transaction.')
+def archive_orders_db(days, batch_size):
+    # Moves old completed orders from the orders table to orders_archive, the order endpoints only read the archive
+    # when asked to with include_archived=true, e.g. run it every night from cron
+    moved = archive_orders(db.session, date.today() - timedelta(days = days), batch_size)
+    # Products are dumped with their orders so the cached catalogue is cleared
+    invalidate_catalogue()
+    print(f'{moved} orders archived')
+
+
+# Order descriptions picked from at random by seed-scale
+SCALE_DESCRIPTIONS = [
+    '2 tiered, chocolate mud, with white icing.',
+    'Red velvet with cream cheese frosting.',
+    'Vanilla sponge with strawberries and cream.',
+    'Assorted fillings, half caramel and half lemon.',
+    'Gluten free carrot cake with walnuts.',
+]
+# Password every generated user logs in with
+SCALE_PASSWORD = 'bench123'
+
+@db_commands.cli.command('seed-scale')
+@click.option('--users', default = 1000, help = 'Number of users to generate.')
+@click.option('--orders', default = 10000, help = 'Number of orders to generate.')
+@click.option('--comments', default = 1000, help = 'Number of comments to generate.')
+@click.option('--seed', default = 0, help = 'Random seed so the same data is generated each time.')
+@click.option('--batch-size', default = 5000, help = 'Rows inserted per statement.')
+def seed_scale_db(users, orders, comments, seed, batch_size):
+    # Bulk inserts large numbers of users, orders and comments on top of flask db seed for benchmarking
+    rng = random.Random(seed)
+    products = db.session.execute(db.select(Product.id, Product.prep_days)).all()
+    if not products:
+        raise click.ClickException('No products found, run flask db seed first.')
+    # Every generated user shares one hash so seeding isnt held up by bcrypt
+    password = bcrypt.generate_password_hash(SCALE_PASSWORD).decode('utf-8')
+    # Starts numbering the emails after the highest user id so seed-scale can be run more than once
+    first = (db.session.scalar(db.select(db.func.max(User.id))) or 0) + 1
+
+    def insert_batches(model, rows):
+        # Sends the rows to the database batch_size at a time with one multi-row INSERT each
+        batch = []
+        for count, row in enumerate(rows, 1):
+            batch.append(row)
+            if len(batch) == batch_size:
+                db.session.execute(insert(model), batch)
+                batch = []
+                print(f'{model.__tablename__}: {count} inserted')
+        if batch:
+            db.session.execute(insert(model), batch)
+        print(f'{model.__tablename__}: done')
+
+    insert_batches(User, (
+        dict(
+            first_name = 'Bench',
+            last_name = f'User-{first + i}',
+            address = f'{first + i} Bench Street, Vic, 3999',
+            email = f'bench{first + i}@mail.com',
+            password = password,
+            is_admin = False
+        ) for i in range(users)
+    ))
+    user_ids = db.session.scalars(db.select(User.id).where(User.id >= first)).all()
+    if not user_ids and (orders or comments):
+        raise click.ClickException('At least one user is needed to place orders and comments.')
+
+    def random_order():
+        product_id, prep_days = rng.choice(products)
+        # Orders placed over the last year, ready at least prep days + 1 after they were ordered
+        date_ordered = date.today() - timedelta(days = rng.randint(0, 365))
+        delivery_pup_date = date_ordered + timedelta(days = prep_days + 1 + rng.randint(0, 14))
+        # Orders due in the past have been completed, upcoming orders are in the queue or being prepared
+        if delivery_pup_date < date.today():
+            status = VALID_STATUSES[2]
+        else:
+            status = rng.choice(VALID_STATUSES[:2])
+        return dict(
+            date_ordered = date_ordered,
+            quantity = 1,
+            status = status,
+            description = rng.choice(SCALE_DESCRIPTIONS),
+            delivery_pup_date = delivery_pup_date,
+            user_id = rng.choice(user_ids),
+            product_id = product_id
+        )
+
+    insert_batches(Order, (random_order() for i in range(orders)))
+    insert_batches(Comment, (
+        dict(
+            message = rng.choice(SCALE_DESCRIPTIONS),
+            user_id = rng.choice(user_ids),
+            product_id = rng.choice(products)[0]
+        ) for i in range(comments)
+    ))
+    # The rows were inserted without the session tracking them so the product stats are rebuilt
+    # and the cached catalogue is cleared here
+    refresh_product_stats(db.session)
+    db.session.commit()
+    invalidate_catalogue()
+    print(f'Seeded {users} users, {orders} orders and {comments} comments, users log in with password {SCALE_PASSWORD}')
+
+
+@db_commands.cli.command('import')
+@click.option('--users', type = click.Path(exists = True, dir_okay = False), help = 'CSV or NDJSON file of users.')
+@click.option('--products', type = click.Path(exists = True, dir_okay = False), help = 'CSV or NDJSON file of products.')
+@click.option('--orders', type = click.Path(exists = True, dir_okay = False), help = 'CSV or NDJSON file of orders.')
+@click.option('--comments', type = click.Path(exists = True, dir_okay = False), help = 'CSV or NDJSON file of comments.')
+@click.option('--batch-size', default = 5000, help = 'Rows loaded and committed at a time.')
+@click.option('--workers', default = os.cpu_count() or 1, help = 'Processes hashing passwords in parallel, 0 hashes them one at a time.')
+def import_db(users, products, orders, comments, batch_size, workers):
+    # Imports users, products, orders and comments from the old system, files ending in .csv are read as CSV with a header
+    # line and anything else as NDJSON, rows have the same fields as the models and an id from the old system that
+    # the rows of the later files point at with user_id and product_id. Running it again carries on from the last batch
+    files = {'users': users, 'products': products, 'orders': orders, 'comments': comments}
+    if not any(files.values()):
+        raise click.ClickException('Give at least one file to import, e.g. flask db import --users users.csv')
+    executor = ProcessPoolExecutor(max_workers = workers) if workers else None
+    try:
+        legacy_import = LegacyImport(db.session, batch_size, executor, current_app.config['BCRYPT_LOG_ROUNDS'])
+        for kind in IMPORT_KINDS:
+            if files[kind]:
+                legacy_import.run(kind, files[kind])
+    finally:
+        if executor:
+            executor.shutdown()
+    # The rows were loaded without the session tracking them so the product stats are rebuilt
+    # and the cached catalogue is cleared here
+    refresh_product_stats(db.session)
+    db.session.commit()
+    invalidate_catalogue()
+    print(f'Import finished, {legacy_import.errors} rows skipped')
@@ -2,13 +2,23 @@ from flask import Blueprint, request
 from init import db
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.product import Product 
-from models.comment import Comment, comment_schema
-from models.user import User
+from models.comment import Comment, comment_schema, product_comments_schema
+from utils.identity import authorise_as_admin
+from utils.pagination import paginate
+from utils.loading import COMMENT_GRAPH, PRODUCT_COMMENTS_GRAPH, load_options
+from utils.response_cache import cached_response
+from utils.routing import read_only
 
 
 comments_bp = Blueprint('comments', __name__, url_prefix = '/<int:product_id>/comments')
 
 
+def load_comment(comment_id):
+    # Reads the comment with everything comment_schema dumps eager loaded, instead of lazy loading it one row at a time
+    qry = db.select(Comment).where(Comment.id == comment_id).options(*load_options(COMMENT_GRAPH))
+    return db.session.scalar(qry)
+
+
 @comments_bp.route('/', methods = ['POST'])
 # JSON Web Token required from login to use this method
 @jwt_required()
@@ -28,16 +38,31 @@ def create_comment(product_id):
             product = product
         )
         db.session.add(comment)
+        # The new comments id is read before the commit expires it, so it doesnt need another query
+        db.session.flush()
+        comment_id = comment.id
         # Commit the added comment to the database
         db.session.commit()
-        # Return the contents 
-        return comment_schema.dump(comment), 201
+        # Return the contents, read back with the user, product and its stats and orders the schema dumps in one go
+        return comment_schema.dump(load_comment(comment_id)), 201
     # If the product id is not found in the database an error message will be returned
     else:
         return {'error': f'Product not found with id {product_id}.'}, 404
-        
 
-# No GET method for comments, all comments will exist and be related to products, so any GET product will display comments 
+
+@comments_bp.route('/')
+# The response is cached with an ETag and thrown away when products, comments or orders change
+@cached_response
+# Only reads from the database so can be sent to a read replica
+@read_only
+def get_comments(product_id):
+    # queries the database to retrieve and display one page of the products comments, newest first
+    # the client can parse limit, after (the next_cursor of the previous page) and fields in the query string
+    page = paginate(Comment, product_comments_schema, Comment.product_id == product_id, graph = PRODUCT_COMMENTS_GRAPH, descending = True)
+    # The product is only looked up when there are no comments to tell an empty page apart from a product that doesnt exist
+    if not page['data'] and not db.session.get(Product, product_id):
+        return {'error': f'Product not found with id {product_id}.'}, 404
+    return page
 
 
 @comments_bp.route('/<int:comment_id>', methods = ['DELETE'])
@@ -87,17 +112,7 @@ def edit_comment(product_id, comment_id):
             return {'error': 'Only the user this comment belongs to can edit it.'}, 401
         comment.message = body_data.get('message') or comment.message
         db.session.commit()
-        return comment_schema.dump(comment)
+        return comment_schema.dump(load_comment(comment_id))
     # If the comment id is not found in the database return an error message
     else:
         return {'error': f'Comment with id {comment_id} not found.'}, 404
-    
-
-def authorise_as_admin():
-    # Check web token to get the user associated to that token
-    user_id = get_jwt_identity()
-    # Query the database to find the user id detected by the web token in the users table 
-    # if the user has is_admin set as True then return that the user is admin
-    qry = db.select(User).filter_by(id = user_id)
-    user = db.session.scalar(qry)
-    return user.is_admin
\ No newline at end of file
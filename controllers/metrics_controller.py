@@ -0,0 +1,17 @@
+import os
+from flask import Blueprint, request
+from utils.metrics import render_metrics
+
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# If set, requests to /metrics must send this as a bearer token so the metrics arent public
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+
+@metrics_bp.route('/metrics')
+def get_metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return {'error': 'Not authorised to view metrics'}, 401
+    # Returns every metric in the Prometheus text format for scraping
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
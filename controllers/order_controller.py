@@ -1,50 +1,153 @@
+import json
+import time
 from init import db, jwt
-from flask import Blueprint, request
-from models.order import Order, order_schema, orders_schema
+from flask import Blueprint, request, Response, stream_with_context
+from models.order import Order, ArchivedOrder, OrderSchema, LocalDate, VALID_STATUSES, order_schema, orders_schema, product_key
+from models.product import Product
+from marshmallow.exceptions import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import make_transient_to_detached
+from utils.response_cache import invalidate_catalogue
+from utils.product_stats import count_inserted, count_updated
+from utils.capacity import reserve, reserve_order, order_weight, fully_booked
+from utils.order_events import get_broker, queue_order_event
+from controllers.capacity_controller import capacity_bp
+from utils.export import export_response
+from utils.routing import read_only
 from sqlalchemy.exc import IntegrityError, DataError
 from psycopg2 import errorcodes
-from flask_jwt_extended import get_jwt_identity, jwt_required
-from datetime import date, datetime
-from models.user import User
+from flask_jwt_extended import get_jwt, get_jwt_identity, jwt_required
+from utils.tokens import token_revoked
+from datetime import date
+from utils.identity import authorise_as_admin, current_user_id
+from utils.pagination import paginate
+from utils.loading import ORDER_GRAPH
+from utils.archive import include_archived
 
 
 orders_bp = Blueprint('orders', __name__, url_prefix = '/orders')
+orders_bp.register_blueprint(capacity_bp)
 
 
 @orders_bp.route('/')
 # JSON Web Token required from login to use this method
 @jwt_required()
+# Only reads from the database so can be sent to a read replica
+@read_only
 def get_orders():
     # Checks to see if the user trying to read orders has is_admin attribute in the database
     is_admin = authorise_as_admin()
     if is_admin:
-        # If the user is an admin queries the database to retrieve and display all orders with no filter
-        qry = db.select(Order)
-        orders = db.session.scalars(qry)
-        return orders_schema.dump(orders)
+        # If the user is an admin queries the database to retrieve and display a page of all orders with no filter
+        # the client can parse limit, after (the next_cursor of the previous page) and fields in the query string
+        # completed orders moved to the archive are only included with include_archived=true
+        archive = (ArchivedOrder, []) if include_archived() else None
+        return paginate(Order, orders_schema, graph = ORDER_GRAPH, archive = archive)
     else:
         # If the user is not an admin it will 
-        # query the database to retrieve and display only orders that match the user id of the user conducting the query
+        # query the database to retrieve and display a page of only orders that match the user id of the user conducting the query
         user_id = get_jwt_identity()
-        qry = db.select(Order).where(Order.user_id == user_id)
-        user_orders = db.session.scalars(qry)
-        return orders_schema.dump(user_orders)
+        archive = (ArchivedOrder, [ArchivedOrder.user_id == user_id]) if include_archived() else None
+        return paginate(Order, orders_schema, Order.user_id == user_id, graph = ORDER_GRAPH, archive = archive)
+
+
+@orders_bp.route('/export')
+# JSON Web Token required from login to use this method
+@jwt_required()
+# Only reads from the database so can be sent to a read replica
+@read_only
+def export_orders():
+    # Only an admin can export the order history
+    if not authorise_as_admin():
+        return {'error': 'Not authorised to export orders'}, 401
+    qry = db.select(Order).order_by(Order.id)
+    # Orders can be filtered by the date they were ordered, from and to are entered in DD/MM/YYYY format (Local format)
+    if request.args.get('from'):
+        qry = qry.where(Order.date_ordered >= LocalDate().deserialize(request.args.get('from')))
+    if request.args.get('to'):
+        qry = qry.where(Order.date_ordered <= LocalDate().deserialize(request.args.get('to')))
+    # and by their status
+    if request.args.get('status'):
+        if request.args.get('status') not in VALID_STATUSES:
+            return {'error': f'status must be one of {", ".join(VALID_STATUSES)}.'}, 400
+        qry = qry.where(Order.status == request.args.get('status'))
+    # Streams the orders as NDJSON or CSV (?format=csv) as they are read from the database
+    return export_response(qry, order_schema, 'orders')
+
+
+# Seconds between the comments sent to keep an order stream open while there are no events
+STREAM_HEARTBEAT = 15
+
+
+def sse(order_event):
+    # Formats an event in the Server-Sent Events format
+    return f'id: {order_event["id"]}\nevent: {order_event["type"]}\ndata: {json.dumps(order_event.get("order", {}))}\n\n'
+
+
+@orders_bp.route('/stream')
+# JSON Web Token required from login to use this method
+@jwt_required()
+def stream_orders():
+    # Streams the orders that are created, updated and deleted as Server-Sent Events instead of clients polling GET /orders/,
+    # admins get every order and other users only their own, a client reconnecting with Last-Event-ID gets the events
+    # it missed, or a reset event if they are too old to have been kept (it should then read its orders again)
+    is_admin = authorise_as_admin()
+    user_id = current_user_id()
+    claims = get_jwt()
+    broker = get_broker()
+    broker.start()
+    after, missed = broker.resume(request.headers.get('Last-Event-ID'))
+    # The stream stays open for a long time so the database connection is given back to the pool now
+    db.session.close()
+
+    def generate():
+        nonlocal after
+        if missed:
+            yield 'event: reset\ndata: {}\n\n'
+        while True:
+            # The token is checked again every time the stream wakes up, so the stream is closed once it expires
+            # or is revoked (e.g. logging out or a change to the users admin status) instead of running on with it,
+            # the client should reconnect with a new access token
+            if time.time() >= claims['exp'] or token_revoked(None, claims):
+                yield 'event: expired\ndata: {}\n\n'
+                return
+            events = broker.wait(after, min(STREAM_HEARTBEAT, max(claims['exp'] - time.time(), 0)))
+            if not events:
+                yield ': keep-alive\n\n'
+            for seq, order_event in events:
+                after = seq
+                if order_event['type'] == 'reset':
+                    yield 'event: reset\ndata: {}\n\n'
+                elif is_admin or order_event['user_id'] == user_id:
+                    yield sse(order_event)
+
+    return Response(stream_with_context(generate()), mimetype = 'text/event-stream', headers = {
+        'Cache-Control': 'no-cache',
+        # Stops proxies such as nginx holding the events back in a buffer
+        'X-Accel-Buffering': 'no',
+    })
 
 
 @orders_bp.route('/<int:id>')
 # JSON Web Token required from login to use this method
 @jwt_required()
+# Only reads from the database so can be sent to a read replica
+@read_only
 def get_one_order(id):
     # Checks to see if the user trying to read orders has is_admin attribute in the database
     is_admin = authorise_as_admin()
     # queries the database in the orders table where the order id is equal to id passed into the function as the argument
     qry = db.select(Order).where(Order.id == id)
     order = db.session.scalar(qry)
+    # Orders that have been archived are looked for in the archive when include_archived=true
+    if not order and include_archived():
+        order = db.session.scalar(db.select(ArchivedOrder).where(ArchivedOrder.id == id))
     # If the order id is found in the database 
     # the product will be displayed to the user so long as they are eiher an admin or the user that created the order
     if order:
         if is_admin or str(order.user_id) == get_jwt_identity():
-            return order_schema.dump(order)
+            # The ETag is parsed back in If-Match when editing the order
+            return order_schema.dump(order), 200, {'ETag': order_etag(order)}
         # if they are not an admin or the user that created the order they will recieve an error message
         else:
             return {'error': 'Only the user this order belongs to can veiw it.'}, 401
@@ -59,76 +162,237 @@ def create_order():
     try:
         # retrieve JSON data parsed into the body from the front end as a python object and store it in body_data
         # load product schema for validation of partially parsed data 
+        # the product being ordered is validated and returned with the body data so it is only queried once
         body_data = order_schema.load(request.get_json())
+        # Checks the kitchen has capacity left on the delivery/pick-up date and holds it until the order is committed
+        if body_data.get('product') and body_data.get('delivery_pup_date'):
+            reserve_order(db.session, body_data['product'], body_data.get('quantity'), body_data['delivery_pup_date'])
         order = Order(
             date_ordered = date.today(),
             # links the users web token granted from login credentials in the database
-            user_id = get_jwt_identity(),
-            product_id = body_data.get('product_id'),
+            user_id = current_user_id(),
+            product = body_data.get('product'),
             quantity = body_data.get('quantity'),
             status = 'In-queue',
             description = body_data.get('description'),
-            # get the user to enter their desired delivery/pick-up date in DD/MM/YYYY format (Local format)
-            delivery_pup_date = datetime.strptime(body_data.get('delivery_pup_date'),'%d/%m/%Y')
+            # the delivery/pick-up date entered in DD/MM/YYYY format is loaded as a date by the order schema
+            delivery_pup_date = body_data.get('delivery_pup_date')
         )
-        # Commit added order to the database
+        # Inserts the order and dumps it before committing, as committing expires the order and dumping it would query it again
         db.session.add(order)
+        db.session.flush()
+        order_data = order_schema.dump(order)
+        # Sends the new order to the order streams once it is committed
+        queue_order_event(db.session, 'created', order_data)
+        # Commit added order to the database
         db.session.commit()
         # Returns the order data to the user in JSON format 
-        return order_schema.dump(order), 201
+        return order_data, 201
     # Validates not null, data type and value constraints
     except IntegrityError as err:
         if err.orig.pgcode == errorcodes.NOT_NULL_VIOLATION:
             return {'error': f'{err.orig.diag.column_name} is required to order a product.'}, 409
-    except ValueError as err:
-        if err:
-            return {'error': 'Date needs to be in DD/MM/YYYY format.'}, 409
     except DataError as err:
         if err.orig.pgcode == errorcodes.INVALID_TEXT_REPRESENTATION:
             return {'error': 'Please enter product_id as a number.'}, 409
 
 
+# Most orders that can be placed in one bulk request
+MAX_BULK_ORDERS = 100
+# all: no orders are created unless every order is valid, best-effort: every valid order is created
+BULK_MODES = ('all', 'best-effort')
+# Fields the orders table needs that the order schema doesnt require when loading
+BULK_REQUIRED = ('product_id', 'description', 'delivery_pup_date')
+
+
+@orders_bp.route('/bulk', methods = ['POST'])
+# JSON Web Token required from login to use this method
+@jwt_required()
+def create_orders_bulk():
+    # retrieve the JSON array of orders parsed into the body from the front end
+    items = request.get_json()
+    if not isinstance(items, list) or not items:
+        return {'error': 'Please send a list of orders.'}, 400
+    if len(items) > MAX_BULK_ORDERS:
+        return {'error': f'A maximum of {MAX_BULK_ORDERS} orders can be placed at once.'}, 400
+    # The mode is parsed in the query string, e.g. /orders/bulk?mode=best-effort
+    mode = request.args.get('mode', 'all')
+    if mode not in BULK_MODES:
+        return {'error': f'mode must be one of {", ".join(BULK_MODES)}.'}, 400
+    # Loads every product being ordered with one query and parses them to the order schema
+    # so each order is validated with the same rules as a single order without querying its product again
+    product_ids = {product_key(item.get('product_id')) for item in items if isinstance(item, dict)}
+    qry = db.select(Product).where(Product.id.in_(product_ids - {None}))
+    products = {product.id: product for product in db.session.scalars(qry)}
+    schema = OrderSchema(context = {'products': products})
+
+    user_id = get_jwt_identity()
+    results = []
+    rows = []
+    for index, item in enumerate(items):
+        try:
+            body_data = schema.load(item)
+            missing = [field for field in BULK_REQUIRED if body_data.get(field) is None]
+            if missing:
+                raise ValidationError({field: ['Missing data for required field.'] for field in missing})
+        except ValidationError as err:
+            results.append({'index': index, 'status': 'failed', 'error': err.messages})
+            continue
+        results.append({'index': index, 'status': 'created'})
+        rows.append(dict(
+            date_ordered = date.today(),
+            user_id = user_id,
+            product_id = body_data['product'].id,
+            quantity = body_data.get('quantity'),
+            status = 'In-queue',
+            description = body_data.get('description'),
+            delivery_pup_date = body_data.get('delivery_pup_date')
+        ))
+
+    # Checks the kitchen capacity of every valid order together, in the order they were sent
+    # (not needed in all mode if an order has already failed, as none will be created)
+    if rows and not (mode == 'all' and len(rows) < len(items)):
+        created = [result for result in results if result['status'] == 'created']
+        fits = reserve(db.session, [(row['delivery_pup_date'], order_weight(products[row['product_id']].prep_days, row['quantity'])) for row in rows])
+        for result, row, fit in zip(created, rows, fits):
+            if not fit:
+                result['status'] = 'failed'
+                result['error'] = fully_booked(row['delivery_pup_date']).messages
+        rows = [row for row, fit in zip(rows, fits) if fit]
+    failed = len(items) - len(rows)
+
+    # In all mode a single invalid order means none are created
+    if failed and mode == 'all':
+        for result in results:
+            if result['status'] == 'created':
+                result['status'] = 'not created'
+        return {'created': 0, 'failed': failed, 'results': results}, 400
+
+    if rows:
+        # Inserts every valid order with one multi-row INSERT, returned in the same order they were sent
+        qry = insert(Order).returning(Order, sort_by_parameter_order = True)
+        orders = db.session.scalars(qry, rows).all()
+        # and adds them to their products stats
+        count_inserted(db.session, orders)
+        created = iter(orders_schema.dump(orders))
+        for result in results:
+            if result['status'] == 'created':
+                result['order'] = next(created)
+                queue_order_event(db.session, 'created', result['order'])
+        db.session.commit()
+        # The orders were inserted without the session tracking them so the cached catalogue is cleared here
+        invalidate_catalogue()
+
+    # 201 if every order was created, 207 if only some were and 400 if none were
+    if not rows:
+        status = 400
+    elif failed:
+        status = 207
+    else:
+        status = 201
+    return {'created': len(rows), 'failed': failed, 'results': results}, status
+
+
+# The order fields that can be edited
+EDITABLE = ('product_id', 'status', 'description', 'delivery_pup_date')
+
+
+def order_etag(order):
+    # The ETag of an order changes every time the order is edited
+    return f'"{order.id}-{order.version}"'
+
+
+def if_match_versions(id):
+    # The order versions the client parsed in its If-Match header, None if it didnt send one (or sent *)
+    # an ETag of another order or one that isnt ours matches no version
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    versions = set()
+    for etag in request.if_match.as_set():
+        order_id, _, version = etag.partition('-')
+        if order_id == str(id) and version.isdigit():
+            versions.add(int(version))
+    return versions
+
+
 @orders_bp.route('/<int:id>', methods = ['PUT','PATCH'])
 # JSON Web Token required from login to use this method
 @jwt_required()
 def edit_order(id):
-    try:
-        # Checks to see if the user trying to read orders has is_admin attribute in the database
-        is_admin = authorise_as_admin()
-        # retrieve JSON data parsed into the body from the front end as a python object and store it in body_data
-        # load product schema for validation of partially parsed data 
-        body_data = order_schema.load(request.get_json(), partial = True)
-        # queries the database in the orders table where the order id is equal to id passed into the function as the argument
-        qry = db.select(Order).where(Order.id == id)
-        # stores the query in order variable
-        order = db.session.scalar(qry)
-        # If the order id is found in the database continue
-        if order:
-            # If the current status of the order is either Preparing or Completed then its too late to edit the order and return error message
-            if order.status in ['Preparing', 'Completed']:
-                return {'error': 'This order has already began preparation or has been completed and can no longer be edited.'}, 403
-            # Only an admin or the user the order belongs too can edit it
-            if is_admin or str(order.user_id) == get_jwt_identity():
-                order.product_id = body_data.get('product_id') or order.product_id
-                order.status = body_data.get('status') or order.status
-                order.description = body_data.get('description') or order.description
-                # Formats the delivery/pick-up date back to a string so that if a new date isnt parsed it can parse the previous date
-                order.delivery_pup_date = datetime.strftime(order.delivery_pup_date, '%d/%m/%Y')
-                order.delivery_pup_date = datetime.strptime(body_data.get('delivery_pup_date') or order.delivery_pup_date ,'%d/%m/%Y')
-                # Commits the updates to the order
-                db.session.commit()
-                # Return the altered order schema for the order matching the id 
-                return order_schema.dump(order)
-            # If the user id doesnt match the user id that created the order or have is_admin then return error message
-            else:
-                return {'error': 'Only the user this order belongs to can edit it.'}, 401
-        # If an order by that id does not exist then return an error message    
-        else:
+    # Checks to see if the user trying to read orders has is_admin attribute in the database
+    is_admin = authorise_as_admin()
+    # retrieve JSON data parsed into the body from the front end as a python object and store it in body_data
+    # load product schema for validation of partially parsed data 
+    body_data = order_schema.load(request.get_json(), partial = True)
+    # Only the fields with a new value are changed, the product found by the order schema gives the new product id
+    changes = {field: body_data[field] for field in EDITABLE if body_data.get(field)}
+    if body_data.get('product'):
+        changes['product_id'] = body_data['product'].id
+
+    # The order is changed with one UPDATE that only matches it if it is still in the queue, belongs to the user
+    # (unless they are an admin) and is still the version in If-Match, so two edits at once cant overwrite each other
+    # and an order cant be edited after the kitchen has started on it
+    qry = db.update(Order.__table__).where(Order.id == id, Order.status == 'In-queue')
+    if not is_admin:
+        qry = qry.where(Order.user_id == current_user_id())
+    versions = if_match_versions(id)
+    if versions is not None:
+        qry = qry.where(Order.version.in_(versions))
+    # The product stats need the product the order is moving from, which is read (and the row locked) first
+    previous_product_id = None
+    if 'product_id' in changes:
+        previous_product_id = db.session.scalar(db.select(Order.product_id).where(Order.id == id).with_for_update())
+        qry = qry.where(Order.product_id == previous_product_id)
+    qry = qry.values(**changes, version = Order.version + 1).returning(*Order.__table__.columns)
+    row = db.session.execute(qry).first()
+
+    if row is None:
+        # Nothing was updated, the order is read once to tell the user why
+        order = db.session.scalar(db.select(Order).where(Order.id == id))
+        # If an order by that id does not exist then return an error message
+        if not order:
             return {'error': f'Order with id:{id} not found.'}, 404
-    # Validates value constraints    
-    except ValueError as err:
-        if err:
-            return {'error': 'Date needs to be in DD/MM/YYYY format.'}, 409
+        # If the current status of the order is either Preparing or Completed then its too late to edit the order and return error message
+        if order.status in ['Preparing', 'Completed']:
+            return {'error': 'This order has already began preparation or has been completed and can no longer be edited.'}, 403
+        # If the user id doesnt match the user id that created the order or have is_admin then return error message
+        if not is_admin and order.user_id != current_user_id():
+            return {'error': 'Only the user this order belongs to can edit it.'}, 401
+        # If the order has been edited since the client read it the client has to read it again before editing it
+        if versions is not None and order.version not in versions:
+            return {'error': 'This order has been changed since you last read it, please read it again before editing it.'}, 412, {'ETag': order_etag(order)}
+        return {'error': 'This order was changed while it was being edited, please try again.'}, 409
+
+    # The updated row is added to the session as an order without querying it again
+    order = Order(**row._asdict())
+    make_transient_to_detached(order)
+    db.session.add(order)
+    try:
+        # Moving the order to another date or product checks the kitchen has capacity for it,
+        # not counting the order itself against its new date
+        if 'delivery_pup_date' in changes or 'product_id' in changes:
+            reserve_order(
+                db.session,
+                body_data.get('product') or db.session.get(Product, order.product_id),
+                order.quantity,
+                order.delivery_pup_date,
+                exclude = order.id
+            )
+    except ValidationError:
+        db.session.rollback()
+        raise
+    # Only orders in the queue can be edited so that was the status it had before
+    count_updated(db.session, order, previous_product_id or order.product_id, 'In-queue')
+    # Dumps the order before committing, as committing expires the order and dumping it would query it again
+    order_data = order_schema.dump(order)
+    etag = order_etag(order)
+    queue_order_event(db.session, 'updated', order_data)
+    # Commits the updates to the order
+    db.session.commit()
+    # The order was updated without the session tracking it so the cached catalogue is cleared here
+    invalidate_catalogue()
+    # Return the altered order schema for the order matching the id with its new ETag
+    return order_data, 200, {'ETag': etag}
 
 
 
@@ -146,6 +410,7 @@ def delete_order(id):
     if order:
         # Only an admin or the user the order belongs too can delete it
         if is_admin or str(order.user_id) == get_jwt_identity():
+            queue_order_event(db.session, 'deleted', order_schema.dump(order))
             db.session.delete(order)
             # Commits the order deletion to the database
             db.session.commit()
@@ -156,13 +421,3 @@ def delete_order(id):
     # If an order by that id does not exist then return an error message     
     else:
         return {'error': f'Order with id {id} not found'}, 404
-
-
-def authorise_as_admin():
-    # Check web token to get the user associated to that token
-    user_id = get_jwt_identity()
-    # Query the database to find the user id detected by the web token in the users table 
-    # if the user has is_admin set as True then return that the user is admin
-    qry = db.select(User).filter_by(id = user_id)
-    user = db.session.scalar(qry)
-    return user.is_admin
\ No newline at end of file
@@ -1,11 +1,20 @@
 from init import db, jwt
 from flask import Blueprint, request
-from models.product import Product, product_schema, products_schema
-from models.user import User
+from models.product import Product, ProductSchema, product_schema, products_schema, product_results_schema, catalogue_schema
+from models.product_stats import product_stats_schema
+from utils.identity import authorise_as_admin
 from sqlalchemy.exc import IntegrityError, DataError
 from psycopg2 import errorcodes
 from flask_jwt_extended import get_jwt_identity, jwt_required
 from controllers.comment_controller import comments_bp
+from utils.pagination import paginate
+from utils.loading import PRODUCT_GRAPH, CATALOGUE_GRAPH, load_options
+from utils.comments import latest_comments_arg, latest_comments
+from utils.response_cache import cached_response
+from utils.export import export_response
+from utils.routing import read_only
+from sqlalchemy.orm import joinedload
+from utils.search import search_args_schema, search_products
 
 
 products_bp = Blueprint('products', __name__, url_prefix = '/products')
@@ -13,18 +22,70 @@ products_bp.register_blueprint(comments_bp)
 
 
 @products_bp.route('/')
+# The response is cached with an ETag and thrown away when products, comments or orders change
+@cached_response
+# Only reads from the database so can be sent to a read replica
+@read_only
 def get_products():
-    # queries the database to retrieve and display all products with no filter
-    qry = db.select(Product)
-    # stores the query in product variable
-    products = db.session.scalars(qry)
-    return products_schema.dump(products)
+    # queries the database to retrieve and display one page of products ordered by id
+    # the client can parse limit, after (the next_cursor of the previous page) and fields in the query string
+    # the comments and orders nested in each product are eager loaded for the whole page
+    count = latest_comments_arg(request.args)
+    if count is None:
+        return paginate(Product, products_schema, graph = PRODUCT_GRAPH)
+    # With latest_comments=N each product is listed with only its newest N comments instead of every comment,
+    # they are read for the whole page with one query, the number of comments is in each products stats
+    page = paginate(Product, catalogue_schema, graph = CATALOGUE_GRAPH)
+    comments = latest_comments(db.session, [product['id'] for product in page['data']], count)
+    for product in page['data']:
+        product['latest_comments'] = comments.get(product['id'], [])
+    return page
+
+
+@products_bp.route('/search')
+# The response is cached with an ETag and thrown away when products, comments or orders change
+@cached_response
+# Only reads from the database so can be sent to a read replica
+@read_only
+def search():
+    # Searches the product names and descriptions for q, filtered by min_price, max_price and max_prep_days
+    # sorted by relevance, price, -price, name or prep_days and paged with limit and offset
+    # the response also has the total number of matches and how many match each price range and prep days
+    args = search_args_schema.load(request.args)
+    products, total, facets, next_offset = search_products(db.session, args)
+    return {
+        'data': product_results_schema.dump(products),
+        'total': total,
+        'facets': facets,
+        'next_offset': next_offset
+    }
+
+
+@products_bp.route('/export')
+# JSON Web Token required from login to use this method
+@jwt_required()
+# Only reads from the database so can be sent to a read replica
+@read_only
+def export_products():
+    # Only an admin can export the products
+    if not authorise_as_admin():
+        return {'error': 'Not authorised to export products'}, 401
+    qry = db.select(Product).order_by(Product.id)
+    # Streams the product columns as NDJSON or CSV (?format=csv) as they are read from the database,
+    # without the nested comments and orders
+    schema = ProductSchema(only = ['id', 'name', 'description', 'price', 'prep_days'])
+    return export_response(qry, schema, 'products')
 
 
 @products_bp.route('/<int:id>')
+# The response is cached with an ETag and thrown away when products, comments or orders change
+@cached_response
+# Only reads from the database so can be sent to a read replica
+@read_only
 def get_one_product(id):
     # queries the database in the products table where the product id matches what was parsed as the arguement to the function
-    qry = db.select(Product).where(Product.id == id)
+    # eager loading the comments and orders that are nested in the product schema
+    qry = db.select(Product).where(Product.id == id).options(*load_options(PRODUCT_GRAPH))
     # stores the query in product variable
     product = db.session.scalar(qry)
     # If a product by that id exists then return it in JSON format 
@@ -35,6 +96,22 @@ def get_one_product(id):
         return {'error': f'Product with id {id} not found.'}, 404
     
 
+@products_bp.route('/<int:id>/stats')
+# The response is cached with an ETag and thrown away when products, comments or orders change
+@cached_response
+# Only reads from the database so can be sent to a read replica
+@read_only
+def get_product_stats(id):
+    # Reads the products order counts by status, comment count and revenue from its row of running totals
+    # with the product joined in, instead of loading and counting every order and comment
+    qry = db.select(Product).where(Product.id == id).options(joinedload(Product.stats))
+    product = db.session.scalar(qry)
+    if product and product.stats:
+        return product_stats_schema.dump(product.stats)
+    else:
+        return {'error': f'Product with id {id} not found.'}, 404
+
+
 @products_bp.route('/', methods = ['POST'])
 # JSON Web Token required from login to use this method
 @jwt_required()
@@ -130,13 +207,3 @@ def update_product(id):
     except DataError as err:
         if err.orig.pgcode == errorcodes.INVALID_TEXT_REPRESENTATION:
             return {'error': 'Please enter Price and/or Preperation days as a number.'}, 409
-
-
-def authorise_as_admin():
-    # Check web token to get the user associated to that token
-    user_id = get_jwt_identity()
-    # Query the database to find the user id detected by the web token in the users table 
-    # if the user has is_admin set as True then return that the user is admin
-    qry = db.select(User).filter_by(id = user_id)
-    user = db.session.scalar(qry)
-    return user.is_admin
\ No newline at end of file
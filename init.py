@@ -2,8 +2,10 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
+from utils.routing import RoutingSession
 
-db = SQLAlchemy()
+# The session sends the queries of handlers marked read_only to a read replica when DATABASE_REPLICA_URLS is set
+db = SQLAlchemy(session_options = {'class_': RoutingSession})
 ma = Marshmallow()
 jwt = JWTManager()
 bcrypt = Bcrypt()
@@ -1,34 +1,76 @@
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from init import db, bcrypt, jwt, ma
 import os
+from datetime import timedelta
 from controllers.cli_controller import db_commands
+from controllers.bench_controller import bench_commands
 from controllers.auth_controller import auth_bp
 from controllers.product_controller import products_bp
 from controllers.order_controller import orders_bp
+from controllers.metrics_controller import metrics_bp
 from marshmallow.exceptions import ValidationError
+from utils.passwords import HashingBusy
+from utils.instrumentation import init_instrumentation
+from utils.pool import engine_options, env_flag
+from utils.rate_limit import init_rate_limiting
+from utils.serializers import OrjsonProvider, compile_schemas
+from models.product import product_schema, products_schema, product_results_schema, catalogue_schema
+from models.comment import comment_schema, comments_schema, product_comments_schema
+from models.order import order_schema, orders_schema
+
+
+# Compiles the dump functions of the shared schemas once, instead of marshmallow walking their fields on every dump
+compile_schemas(product_schema, products_schema, product_results_schema, catalogue_schema, comment_schema, comments_schema, product_comments_schema, order_schema, orders_schema)
 
 
 
 def create_app():
     app = Flask(__name__)
 
+    # Responses are encoded with orjson
+    app.json = OrjsonProvider(app)
     app.json.sort_keys = False
 
     app.config["SQLALCHEMY_DATABASE_URI"]=os.environ.get("DATABASE_URL")
+    # Connection pool size, overflow, timeout, recycling and pre-ping, or PgBouncer mode, from the environment
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"]=engine_options()
     app.config["JWT_SECRET_KEY"]=os.environ.get("JWT_SECRET_KEY")
+    # Access tokens are short lived and renewed with a refresh token from /auth/refresh, see utils/tokens.py
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"]=timedelta(minutes=int(os.environ.get("ACCESS_TOKEN_MINUTES", 15)))
+    app.config["JWT_REFRESH_TOKEN_EXPIRES"]=timedelta(days=int(os.environ.get("REFRESH_TOKEN_DAYS", 30)))
+    # bcrypt cost factor used when hashing passwords, changing it rehashes passwords as users log in
+    app.config["BCRYPT_LOG_ROUNDS"]=int(os.environ.get("BCRYPT_LOG_ROUNDS", 12))
+    # Token bucket rate limits per IP address for /auth and per user for the other routes, see utils/rate_limit.py
+    app.config["RATE_LIMIT_ENABLED"]=env_flag("RATE_LIMIT_ENABLED", True)
+    # How many proxies (e.g. a load balancer) in front of the app add the clients address to X-Forwarded-For,
+    # 0 when clients connect to the app directly, otherwise every login would be counted against the proxys address
+    app.config["TRUSTED_PROXIES"]=int(os.environ.get("TRUSTED_PROXIES", 0))
+    if app.config["TRUSTED_PROXIES"]:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
 
     @app.errorhandler(ValidationError)
     def validation_error(err):
         return {'error': err.messages}, 400
 
+    @app.errorhandler(HashingBusy)
+    def hashing_busy(err):
+        return {'error': 'The server is busy, please try again shortly.'}, 503, {'Retry-After': '1'}
+
     db.init_app(app)
     bcrypt.init_app(app)
     jwt.init_app(app)
     ma.init_app(app)
+    # Times requests and counts their SQL for the access log and /metrics
+    init_instrumentation(app)
+    # Rejects requests over their rate limit with a 429 before they are handled
+    init_rate_limiting(app)
 
     app.register_blueprint(db_commands)
+    app.register_blueprint(bench_commands)
     app.register_blueprint(auth_bp)
     app.register_blueprint(products_bp)
     app.register_blueprint(orders_bp)
+    app.register_blueprint(metrics_bp)
 
     return app
\ No newline at end of file
@@ -0,0 +1,32 @@
+from alembic import context
+from flask import current_app
+from init import db
+
+
+# The metadata of every model imported by the app, used by flask db revision --autogenerate
+target_metadata = db.metadata
+
+
+def run_migrations_offline():
+    # Writes the SQL for the migrations out instead of running it against the database
+    context.configure(
+        url = current_app.config['SQLALCHEMY_DATABASE_URI'],
+        target_metadata = target_metadata,
+        literal_binds = True
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    # Runs the migrations on the same engine the app uses
+    with db.engine.connect() as connection:
+        context.configure(connection = connection, target_metadata = target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,36 @@
+"""Index the foreign keys and order status used by the hot query paths
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Orders are listed per user and loaded per product (relationship loading and cascade deletes)
+    # the composite index also covers lookups on user_id alone so a separate user_id index isnt needed
+    op.create_index('ix_orders_user_id_date_ordered', 'orders', ['user_id', 'date_ordered'])
+    op.create_index('ix_orders_product_id', 'orders', ['product_id'])
+    op.create_index('ix_orders_status', 'orders', ['status'])
+    # Comments are loaded per product and per user
+    op.create_index('ix_comments_product_id', 'comments', ['product_id'])
+    op.create_index('ix_comments_user_id', 'comments', ['user_id'])
+    # Order status can only be one of the statuses in models.order.VALID_STATUSES
+    op.create_check_constraint('ck_orders_status', 'orders', "status IN ('In-queue', 'Preparing', 'Completed')")
+
+
+def downgrade():
+    op.drop_constraint('ck_orders_status', 'orders', type_ = 'check')
+    op.drop_index('ix_comments_user_id', table_name = 'comments')
+    op.drop_index('ix_comments_product_id', table_name = 'comments')
+    op.drop_index('ix_orders_status', table_name = 'orders')
+    op.drop_index('ix_orders_product_id', table_name = 'orders')
+    op.drop_index('ix_orders_user_id_date_ordered', table_name = 'orders')
@@ -0,0 +1,42 @@
+"""Add the product_stats table of running order and comment totals per product
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'product_stats',
+        sa.Column('product_id', sa.Integer(), sa.ForeignKey('products.id', ondelete = 'CASCADE'), primary_key = True),
+        sa.Column('in_queue', sa.Integer(), nullable = False),
+        sa.Column('preparing', sa.Integer(), nullable = False),
+        sa.Column('completed', sa.Integer(), nullable = False),
+        sa.Column('units', sa.Integer(), nullable = False),
+        sa.Column('comment_count', sa.Integer(), nullable = False),
+    )
+    # Fills in the totals of the existing products from their orders and comments
+    op.execute("""
+        INSERT INTO product_stats (product_id, in_queue, preparing, completed, units, comment_count)
+        SELECT products.id,
+            (SELECT count(*) FROM orders WHERE orders.product_id = products.id AND status = 'In-queue'),
+            (SELECT count(*) FROM orders WHERE orders.product_id = products.id AND status = 'Preparing'),
+            (SELECT count(*) FROM orders WHERE orders.product_id = products.id AND status = 'Completed'),
+            (SELECT coalesce(sum(quantity), 0) FROM orders WHERE orders.product_id = products.id),
+            (SELECT count(*) FROM comments WHERE comments.product_id = products.id)
+        FROM products
+    """)
+
+
+def downgrade():
+    op.drop_table('product_stats')
@@ -0,0 +1,31 @@
+"""Add the capacity_days calendar and index orders by delivery/pick-up date
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Days with a different kitchen capacity than DAILY_CAPACITY
+    op.create_table(
+        'capacity_days',
+        sa.Column('day', sa.Date(), primary_key = True),
+        sa.Column('capacity', sa.Integer(), nullable = False),
+    )
+    # The orders due on each day are added up to check its capacity
+    op.create_index('ix_orders_delivery_pup_date', 'orders', ['delivery_pup_date'])
+
+
+def downgrade():
+    op.drop_index('ix_orders_delivery_pup_date', table_name = 'orders')
+    op.drop_table('capacity_days')
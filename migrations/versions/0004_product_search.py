@@ -0,0 +1,28 @@
+"""Add a generated full text search column with a GIN index to products
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The words in each products name and description, kept up to date by the database as products change
+    op.execute(
+        "ALTER TABLE products ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+        "(to_tsvector('english', coalesce(name, '') || ' ' || coalesce(description, ''))) STORED"
+    )
+    op.execute('CREATE INDEX ix_products_search_vector ON products USING gin (search_vector)')
+
+
+def downgrade():
+    op.drop_index('ix_products_search_vector', table_name = 'products')
+    op.drop_column('products', 'search_vector')
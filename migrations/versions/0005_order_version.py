@@ -0,0 +1,24 @@
+"""Add a version to orders for conditional edits with If-Match
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing orders start at version 1
+    op.add_column('orders', sa.Column('version', sa.Integer(), nullable = False, server_default = '1'))
+
+
+def downgrade():
+    op.drop_column('orders', 'version')
@@ -0,0 +1,39 @@
+"""Add the revoked_tokens list and its version counter
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'revoked_tokens',
+        sa.Column('id', sa.Integer(), primary_key = True),
+        sa.Column('key', sa.String(), nullable = False, unique = True),
+        sa.Column('revoked_at', sa.DateTime(), nullable = False),
+        sa.Column('expires_at', sa.DateTime(), nullable = False),
+        sa.Column('version', sa.Integer(), nullable = False),
+    )
+    op.create_index('ix_revoked_tokens_version', 'revoked_tokens', ['version'])
+    version = op.create_table(
+        'revocation_version',
+        sa.Column('id', sa.Integer(), primary_key = True),
+        sa.Column('version', sa.Integer(), nullable = False),
+    )
+    op.bulk_insert(version, [{'id': 1, 'version': 0}])
+
+
+def downgrade():
+    op.drop_table('revocation_version')
+    op.drop_index('ix_revoked_tokens_version', table_name = 'revoked_tokens')
+    op.drop_table('revoked_tokens')
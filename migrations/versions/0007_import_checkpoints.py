@@ -0,0 +1,34 @@
+"""Add the checkpoints and id map of flask db import
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'import_checkpoints',
+        sa.Column('source', sa.String(), primary_key = True),
+        sa.Column('rows', sa.Integer(), nullable = False),
+    )
+    op.create_table(
+        'import_ids',
+        sa.Column('kind', sa.String(), primary_key = True),
+        sa.Column('legacy_id', sa.String(), primary_key = True),
+        sa.Column('id', sa.Integer(), nullable = False),
+    )
+
+
+def downgrade():
+    op.drop_table('import_ids')
+    op.drop_table('import_checkpoints')
@@ -0,0 +1,40 @@
+"""Add orders_archive, partitioned by year on postgres, for old completed orders
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The yearly partitions are created by flask db archive-orders as orders are moved into them
+    op.create_table(
+        'orders_archive',
+        sa.Column('id', sa.Integer(), primary_key = True, autoincrement = False),
+        sa.Column('date_ordered', sa.Date(), primary_key = True),
+        sa.Column('quantity', sa.Integer(), nullable = False),
+        sa.Column('status', sa.String()),
+        sa.Column('description', sa.Text(), nullable = False),
+        sa.Column('delivery_pup_date', sa.Date(), nullable = False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete = 'CASCADE'), nullable = False),
+        sa.Column('product_id', sa.Integer(), sa.ForeignKey('products.id', ondelete = 'CASCADE'), nullable = False),
+        sa.Column('version', sa.Integer(), nullable = False, server_default = '1'),
+        postgresql_partition_by = 'RANGE (date_ordered)',
+    )
+    op.create_index('ix_orders_archive_user_id_id', 'orders_archive', ['user_id', 'id'])
+    op.create_index('ix_orders_archive_product_id', 'orders_archive', ['product_id'])
+
+
+def downgrade():
+    op.drop_index('ix_orders_archive_product_id', table_name = 'orders_archive')
+    op.drop_index('ix_orders_archive_user_id_id', table_name = 'orders_archive')
+    op.drop_table('orders_archive')
@@ -0,0 +1,25 @@
+"""Index comments by (product_id, id) for listing a products comments newest first
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+
+
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Also covers lookups on product_id alone so it replaces the product_id index
+    op.create_index('ix_comments_product_id_id', 'comments', ['product_id', 'id'])
+    op.drop_index('ix_comments_product_id', table_name = 'comments')
+
+
+def downgrade():
+    op.create_index('ix_comments_product_id', 'comments', ['product_id'])
+    op.drop_index('ix_comments_product_id_id', table_name = 'comments')
@@ -0,0 +1,31 @@
+"""Add token_families so refreshing doesnt write a revoked_tokens row
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'token_families',
+        sa.Column('id', sa.String(), primary_key = True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete = 'CASCADE'), nullable = False),
+        sa.Column('refresh_jti', sa.String(), nullable = False),
+        sa.Column('expires_at', sa.DateTime(), nullable = False),
+    )
+    op.create_index('ix_token_families_user_id', 'token_families', ['user_id'])
+
+
+def downgrade():
+    op.drop_index('ix_token_families_user_id', table_name = 'token_families')
+    op.drop_table('token_families')
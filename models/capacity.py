@@ -0,0 +1,25 @@
+from init import db, ma
+from utils.serializers import FastSchema
+from marshmallow import fields
+from marshmallow.validate import Range
+from models.order import LocalDate
+
+
+class CapacityDay(db.Model):
+    # The kitchen capacity of a day that differs from DAILY_CAPACITY, e.g. 0 for a day the kitchen is closed
+    __tablename__ = 'capacity_days'
+
+    day = db.Column(db.Date, primary_key = True)
+    capacity = db.Column(db.Integer, nullable = False)
+
+class CapacityDaySchema(FastSchema):
+    # get the admin to enter the day in DD/MM/YYYY format (Local format)
+    day = LocalDate(required = True)
+    # Validates that capacity cant be negative
+    capacity = fields.Integer(required = True, validate = Range(min = 0, error = 'Capacity cannot be negative.'))
+
+    class Meta:
+        fields = ('day', 'capacity')
+        ordered = True
+
+capacity_day_schema = CapacityDaySchema()
@@ -1,19 +1,24 @@
 from init import db, ma
+from utils.serializers import FastSchema
 from marshmallow import fields
 
 
 class Comment(db.Model):
     __tablename__ = 'comments'
+    __table_args__ = (
+        # A products comments are listed newest first, this index also covers lookups on product_id alone
+        db.Index('ix_comments_product_id_id', 'product_id', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key = True)
     message = db.Column(db.Text)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable = False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable = False, index = True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable = False)
 
     user = db.relationship('User', back_populates = 'comments')
     product = db.relationship('Product', back_populates = 'comments')
 
-class CommentSchema(ma.Schema):
+class CommentSchema(FastSchema):
     user = fields.Nested('UserSchema', only = ['first_name', 'last_name'])
     product = fields.Nested('ProductSchema', exclude = ['comments'])
 
@@ -22,4 +27,6 @@ class CommentSchema(ma.Schema):
         ordered = True
 
 comment_schema = CommentSchema()
-comments_schema = CommentSchema(many = True)
\ No newline at end of file
+comments_schema = CommentSchema(many = True)
+# The comments listed under a product leave the product out as the client already knows which one it is
+product_comments_schema = CommentSchema(many = True, exclude = ['product'])
\ No newline at end of file
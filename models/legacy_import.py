@@ -0,0 +1,19 @@
+from init import db
+
+
+class ImportCheckpoint(db.Model):
+    # How many rows of each file flask db import has read, committed with the rows loaded
+    # so an import that was stopped carries on from the last batch when it is run again
+    __tablename__ = 'import_checkpoints'
+
+    source = db.Column(db.String, primary_key = True)
+    rows = db.Column(db.Integer, nullable = False)
+
+class ImportId(db.Model):
+    # The id each imported user and product had in the old system and the id it was given here,
+    # imported orders, comments and products are pointed at their users and products through these
+    __tablename__ = 'import_ids'
+
+    kind = db.Column(db.String, primary_key = True)
+    legacy_id = db.Column(db.String, primary_key = True)
+    id = db.Column(db.Integer, nullable = False)
@@ -1,79 +1,123 @@
 from init import db, ma
-from marshmallow import fields, validates, ValidationError
+from utils.serializers import FastSchema
+from marshmallow import fields, validates_schema, ValidationError
 from marshmallow.validate import OneOf, Range
 from datetime import date, datetime, timedelta
 from models.product import Product
-from flask import request
 
 VALID_STATUSES = ('In-queue', 'Preparing', 'Completed')
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        # Orders are listed per user, this index also covers lookups on user_id alone
+        db.Index('ix_orders_user_id_date_ordered', 'user_id', 'date_ordered'),
+        # The status of an order can only be one of the statuses defined in VALID_STATUSES
+        db.CheckConstraint(f"status IN ({', '.join(repr(status) for status in VALID_STATUSES)})", name = 'ck_orders_status'),
+    )
 
     id = db.Column(db.Integer, primary_key = True)
     date_ordered = db.Column(db.Date)
     quantity = db.Column(db.Integer, nullable = False)
-    status = db.Column(db.String, default = 'In-queue')
+    status = db.Column(db.String, default = 'In-queue', index = True)
     description = db.Column(db.Text, nullable = False)
-    delivery_pup_date = db.Column(db.Date, nullable = False)
+    # Indexed as the orders due on each day are added up to check the kitchens capacity
+    delivery_pup_date = db.Column(db.Date, nullable = False, index = True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable = False)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable = False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable = False, index = True)
+    # Goes up by one every time the order is edited, sent to clients in the ETag header so an edit based on
+    # an old copy of the order (If-Match) is rejected instead of overwriting someone elses change
+    version = db.Column(db.Integer, nullable = False, default = 1, server_default = '1')
 
     user = db.relationship('User', back_populates = 'orders')
     product = db.relationship('Product', back_populates = 'orders')
 
-class OrderSchema(ma.Schema):
+class ArchivedOrder(db.Model):
+    # Completed orders moved out of the orders table by flask db archive-orders so the orders table only holds
+    # the orders still being worked on and recent history, they keep the id they had in the orders table
+    # on postgres the table is partitioned by the year the order was placed, see utils/archive.py
+    __tablename__ = 'orders_archive'
+    __table_args__ = (
+        db.Index('ix_orders_archive_user_id_id', 'user_id', 'id'),
+        {'postgresql_partition_by': 'RANGE (date_ordered)'},
+    )
+
+    id = db.Column(db.Integer, primary_key = True, autoincrement = False)
+    # Part of the primary key as postgres needs the partition key in it
+    date_ordered = db.Column(db.Date, primary_key = True)
+    quantity = db.Column(db.Integer, nullable = False)
+    status = db.Column(db.String)
+    description = db.Column(db.Text, nullable = False)
+    delivery_pup_date = db.Column(db.Date, nullable = False)
+    # Archived orders are deleted by the database with their user or product, as they are not loaded by the relationships
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete = 'CASCADE'), nullable = False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete = 'CASCADE'), nullable = False, index = True)
+    version = db.Column(db.Integer, nullable = False, server_default = '1')
+
+def product_key(value):
+    # Product ids can be parsed as numbers or strings, returns the id as a number or None if it isnt one
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+class LocalDate(fields.Date):
+    # Loads dates entered in DD/MM/YYYY format (Local format) into date objects
+    # dates are still dumped in ISO format like the rest of the API
+    def _deserialize(self, value, attr, data, **kwargs):
+        try:
+            return datetime.strptime(value, '%d/%m/%Y').date()
+        except (TypeError, ValueError):
+            raise ValidationError('Date needs to be in DD/MM/YYYY format.')
+
+class OrderSchema(FastSchema):
     user = fields.Nested('UserSchema', only = ['first_name', 'last_name', 'address'])
     product = fields.Nested('ProductSchema', exclude = ['comments'])
 
-    # Validates that a product id has been entered for ordering
-    @validates('product_id')
-    def is_product(self, value):
-        # Query the database to find the product id parsed as the arguement of the fuction in the products table
-        qry = db.select(Product).filter_by(id = value)
-        product = db.session.scalar(qry)
-        # If the product id is not found in the database an error message will be returned
-        if not product:
-            raise ValidationError(f'Product not found with id:{value}.')
-
     # Validates that the status field can only have one of the three statuses defined in VALID_STATUSES
     status = fields.String(validate = OneOf(VALID_STATUSES))
     # Validates that the quantity ordered cannot be more than 1, 
     # if for some reason a user would want more than one wedding or celebration cake, they can place multiple orders
     # if they want more cupcakes the products are sold in 6, 12, 18 etc. quantities with varying price points
     quantity = fields.Integer(required = True, validate = Range(min=1, max=1, error = "Can only order 1 of this Product."))
+    # get the user to enter their desired delivery/pick-up date in DD/MM/YYYY format (Local format)
+    delivery_pup_date = LocalDate()
 
-    @validates('delivery_pup_date')
-    def validate_delpup_to_prep(self, value):
-        # sets date ordered as date order was placed
-        date_ordered = date.today()
-        # formats date ordered so it can be used in a comparison 
-        todays_date = datetime.strftime(date_ordered, '%Y-%m-%d')
-        # takes the value entered from the JSON request in a DD/MM/YYYY format
-        # then formats it so it can be used in a comparison 
-        delpup_date = datetime.strptime(value, '%d/%m/%Y').strftime('%Y-%m-%d')
-        # checks to see if the delivery/pick-up date entered comes before the date ordered
-        if delpup_date < todays_date:
-            # if the delivery/pick-up date entered comes before the date ordered then raise an error and return message
-            raise ValidationError('Date cannot be in the past.')
-        # retrieve JSON data parsed into the posted order body from the front end as a python object and store it in body_data
-        body_data = request.get_json()
-        # find the id of the product being ordered
-        product_id = body_data.get('product_id')
-        # Query the database to find the preparation days attribute of the product being ordered from its id parsed into the body
-        qry = db.select(Product.prep_days).filter_by(id = product_id)
-        prep_days = db.session.scalar(qry)
-        # Validates that a product id has been entered for ordering and raises error if not
-        if product_id == None:
-            raise ValidationError('Please enter the product id you wish to edit.')
-        # sets the date that an order will be available for delivery/pick-up
-        # by adding the preparation days + 1 to the date the order was placed
-        available = date_ordered + timedelta(days = (prep_days + 1))
-        # formats date available so it can be used in a comparison 
-        date_available = datetime.strftime(available, '%Y-%m-%d')
-        # checks to see if the date entered in the body is too early for delivery/pick-up and raises an error message if it is
-        if delpup_date < date_available:
-            raise ValidationError(f'Order will not be ready by this date, please enter a date at least {prep_days + 1} days from today.')
+    # Validates the product being ordered and the delivery/pick-up date together so the product is only queried once
+    @validates_schema
+    def validate_order(self, data, **kwargs):
+        product = None
+        # Validates that the product id entered for ordering exists
+        if 'product_id' in data:
+            # When orders are validated in bulk the products have already been loaded together and are parsed in the context
+            if 'products' in self.context:
+                product = self.context['products'].get(product_key(data['product_id']))
+            else:
+                # Query the database to find the product id parsed in the body in the products table
+                qry = db.select(Product).filter_by(id = data['product_id'])
+                product = db.session.scalar(qry)
+            # If the product id is not found in the database an error message will be returned
+            if not product:
+                raise ValidationError(f'Product not found with id:{data["product_id"]}.', 'product_id')
+        if 'delivery_pup_date' in data:
+            # sets date ordered as date order was placed
+            date_ordered = date.today()
+            delpup_date = data['delivery_pup_date']
+            # checks to see if the delivery/pick-up date entered comes before the date ordered
+            if delpup_date < date_ordered:
+                raise ValidationError('Date cannot be in the past.', 'delivery_pup_date')
+            # Validates that a product id has been entered so its preparation days can be checked and raises error if not
+            if product is None:
+                raise ValidationError('Please enter the product id you wish to edit.', 'delivery_pup_date')
+            # sets the date that an order will be available for delivery/pick-up
+            # by adding the preparation days + 1 to the date the order was placed
+            available = date_ordered + timedelta(days = (product.prep_days + 1))
+            # checks to see if the date entered in the body is too early for delivery/pick-up and raises an error message if it is
+            if delpup_date < available:
+                raise ValidationError(f'Order will not be ready by this date, please enter a date at least {product.prep_days + 1} days from today.', 'delivery_pup_date')
+        # The product found is handed back with the loaded data so the controller doesnt have to query it again
+        if product is not None:
+            data['product'] = product
 
     class Meta:
         fields = ('id', 'user_id', 'date_ordered', 'product_id', 'quantity', 'status', 'description', 'delivery_pup_date')
@@ -1,6 +1,8 @@
 from init import db, ma 
+from utils.serializers import FastSchema
 from marshmallow import fields
 from marshmallow.validate import Range, Length
+from sqlalchemy import DDL, event
 
 class Product(db.Model):
     __tablename__ = "products"
@@ -16,12 +18,28 @@ class Product(db.Model):
     comments = db.relationship('Comment', back_populates = 'product', cascade = 'all, delete')
     orders = db.relationship('Order', back_populates = 'product', cascade = 'all, delete')
     user = db.relationship('User', back_populates = 'products')
-
-class ProductSchema(ma.Schema):
+    # One row of running totals per product
+    stats = db.relationship('ProductStats', back_populates = 'product', uselist = False, cascade = 'all, delete')
+
+# On postgres products have a search_vector column of the words in their name and description for GET /products/search,
+# generated by the database from the name and description so it is always kept up to date as products are created and updated
+# it isnt mapped on the model as only the search query uses it (and other databases dont have it)
+SEARCH_CONFIG = 'english'
+event.listen(Product.__table__, 'after_create', DDL(
+    "ALTER TABLE products ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+    f"(to_tsvector('{SEARCH_CONFIG}', coalesce(name, '') || ' ' || coalesce(description, ''))) STORED"
+).execute_if(dialect = 'postgresql'))
+# GIN index so matching a search query doesnt scan every product
+event.listen(Product.__table__, 'after_create', DDL(
+    'CREATE INDEX ix_products_search_vector ON products USING gin (search_vector)'
+).execute_if(dialect = 'postgresql'))
+
+class ProductSchema(FastSchema):
 
     comments = fields.List(fields.Nested('CommentSchema'), exclude = ['product'])
     orders = fields.List(fields.Nested('OrderSchema'), exclude = ['product'])
     user = fields.List(fields.Nested('UserSchema'), only = ['is_admin'], exclude = ['product'])
+    stats = fields.Nested('ProductStatsSchema', dump_only = True)
 
     # Validates that the name of the product is at least 4 letters long
     name = fields.String(required = True, validate = Length(min = 4, error = 'Product name must be at least the length of cake.'))
@@ -31,8 +49,12 @@ class ProductSchema(ma.Schema):
     prep_days = fields.Integer(required = True, validate = Range(max = 5, error = 'Preperation days cannot be longer than 5'))
 
     class Meta:
-        fields = ('id', 'name', 'description', 'price', 'prep_days','comments', 'orders')
+        fields = ('id', 'name', 'description', 'price', 'prep_days', 'stats', 'comments', 'orders')
         ordered = True
 
 product_schema = ProductSchema()
-products_schema = ProductSchema(many = True)
\ No newline at end of file
+products_schema = ProductSchema(many = True)
+# The products found by GET /products/search are returned with their stats but not every comment and order
+product_results_schema = ProductSchema(many = True, exclude = ['comments', 'orders'])
+# The catalogue listed with only the latest comments of each product (?latest_comments=N) and the comment count in its stats
+catalogue_schema = ProductSchema(many = True, exclude = ['comments'])
@@ -0,0 +1,36 @@
+from init import db, ma
+from utils.serializers import FastSchema
+
+
+class ProductStats(db.Model):
+    # Running totals for each product, kept up to date as orders and comments are added, changed and deleted
+    # (see utils/product_stats.py) so a products stats are read from one row instead of counting its orders
+    __tablename__ = 'product_stats'
+
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete = 'CASCADE'), primary_key = True)
+    # Number of orders with each status
+    in_queue = db.Column(db.Integer, nullable = False, default = 0)
+    preparing = db.Column(db.Integer, nullable = False, default = 0)
+    completed = db.Column(db.Integer, nullable = False, default = 0)
+    # Total quantity ordered, the revenue is this times the products price
+    units = db.Column(db.Integer, nullable = False, default = 0)
+    comment_count = db.Column(db.Integer, nullable = False, default = 0)
+
+    product = db.relationship('Product', back_populates = 'stats')
+
+    @property
+    def order_count(self):
+        return (self.in_queue or 0) + (self.preparing or 0) + (self.completed or 0)
+
+    @property
+    def revenue(self):
+        # The product is already loaded when its stats are so this doesnt query it again
+        return round((self.units or 0) * self.product.price, 2)
+
+class ProductStatsSchema(FastSchema):
+
+    class Meta:
+        fields = ('order_count', 'in_queue', 'preparing', 'completed', 'comment_count', 'revenue')
+        ordered = True
+
+product_stats_schema = ProductStatsSchema()
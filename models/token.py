@@ -0,0 +1,33 @@
+from init import db
+
+
+class RevokedToken(db.Model):
+    # Web tokens that can no longer be used, key is 'jti:<id>' for one token, 'family:<id>' for every token
+    # refreshed from one login or 'user:<id>' for every token a user was issued up to revoked_at
+    __tablename__ = 'revoked_tokens'
+
+    id = db.Column(db.Integer, primary_key = True)
+    key = db.Column(db.String, nullable = False, unique = True)
+    revoked_at = db.Column(db.DateTime, nullable = False)
+    # Once every token the row applies to has expired it is no longer needed and is deleted
+    expires_at = db.Column(db.DateTime, nullable = False)
+    # The revocation_version the row was written at, workers load the rows newer than the version they have
+    version = db.Column(db.Integer, nullable = False, index = True)
+
+class RevocationVersion(db.Model):
+    # A single row counting up with every revocation, its row lock makes revocations commit in version order
+    __tablename__ = 'revocation_version'
+
+    id = db.Column(db.Integer, primary_key = True)
+    version = db.Column(db.Integer, nullable = False)
+
+class TokenFamily(db.Model):
+    # One row per login, the refresh tokens swapped for new ones with /auth/refresh are a family of tokens
+    # only the refresh token issued last (refresh_jti) can be swapped, using an older one means someone else has a copy of it
+    __tablename__ = 'token_families'
+
+    id = db.Column(db.String, primary_key = True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete = 'CASCADE'), nullable = False, index = True)
+    refresh_jti = db.Column(db.String, nullable = False)
+    # When the last refresh token issued expires, the row is deleted when the user next logs in after that
+    expires_at = db.Column(db.DateTime, nullable = False)
@@ -1,4 +1,5 @@
 from init import db, ma
+from utils.serializers import FastSchema
 from marshmallow import fields
 from marshmallow.validate import Length, And, Regexp
 
@@ -17,7 +18,7 @@ class User(db.Model):
     orders = db.relationship('Order', back_populates = 'user', cascade = 'all, delete')
     products = db.relationship('Product', back_populates = 'user')
 
-class UserSchema(ma.Schema):
+class UserSchema(FastSchema):
 
     comments = fields.List(fields.Nested('CommentSchema', exclude = ['user']))
     orders = fields.List(fields.Nested('OrderSchema', exclude = ['user']))
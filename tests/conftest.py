@@ -0,0 +1,60 @@
+import os
+import tempfile
+import pytest
+
+# The app reads its settings from the environment when it is imported, so they are set before main is imported
+# TEST_DATABASE_URL runs the tests on another database (e.g. postgres), its tables are dropped and created again
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or f'sqlite:///{tempfile.mkdtemp()}/test.db'
+os.environ.setdefault('JWT_SECRET_KEY', 'secret-key-only-used-by-the-tests')
+# Fast password hashing in this process and no rate limits, the tests log in and send requests far faster than a user would
+os.environ['PASSWORD_WORKERS'] = '0'
+os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+os.environ['RATE_LIMIT_ENABLED'] = 'false'
+# Revocations made by the tests apply at once in this process, so the list is only loaded once at the start
+# and the periodic reload doesnt add to the SQL statements a test counts
+os.environ['REVOCATION_SYNC_SECONDS'] = '3600'
+
+from main import create_app
+from init import db
+from utils.tokens import revocation_list
+
+
+# Logins created by flask db seed
+ADMIN_LOGIN = {'email': 'admin@mail.com', 'password': 'password123'}
+USER_LOGIN = {'email': 'janedoe@mail.com', 'password': 'jane123'}
+
+
+@pytest.fixture(scope = 'session')
+def app():
+    # One app and database for the whole test run, seeded like flask db seed plus some comments and orders
+    app = create_app()
+    runner = app.test_cli_runner()
+    with app.app_context():
+        db.drop_all()
+    for args in (['db', 'create'], ['db', 'seed'], ['db', 'seed-scale', '--users', '5', '--orders', '50', '--comments', '50']):
+        result = runner.invoke(args = args)
+        assert result.exception is None, result.output
+    with app.app_context(), db.engine.connect() as connection:
+        revocation_list.sync(connection)
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, credentials):
+    response = client.post('/auth/login', json = credentials)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['token']
+
+
+@pytest.fixture
+def user_token(client):
+    return login(client, USER_LOGIN)
+
+
+@pytest.fixture
+def admin_token(client):
+    return login(client, ADMIN_LOGIN)
@@ -0,0 +1,46 @@
+from datetime import date, timedelta
+from init import db
+from models.order import Order
+
+
+def auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def order_count(app):
+    with app.app_context():
+        return db.session.scalar(db.select(db.func.count()).select_from(Order))
+
+
+def bulk_items(description):
+    # The second order has no description, the others are valid
+    delivery = (date.today() + timedelta(days = 310)).strftime('%d/%m/%Y')
+    item = {'product_id': 3, 'quantity': 1, 'delivery_pup_date': delivery}
+    return [dict(item, description = description), item, dict(item, description = description)]
+
+
+def test_all_mode_creates_nothing_if_one_order_is_invalid(app, client, user_token):
+    orders = order_count(app)
+    response = client.post('/orders/bulk?mode=all', json = bulk_items('All or nothing order'), headers = auth(user_token))
+    assert response.status_code == 400
+    body = response.get_json()
+    assert body['created'] == 0
+    assert body['failed'] == 1
+    assert [result['status'] for result in body['results']] == ['not created', 'failed', 'not created']
+    assert 'description' in body['results'][1]['error']
+    assert order_count(app) == orders
+
+
+def test_best_effort_mode_creates_the_valid_orders(app, client, user_token):
+    orders = order_count(app)
+    response = client.post('/orders/bulk?mode=best-effort', json = bulk_items('Best effort order'), headers = auth(user_token))
+    assert response.status_code == 207
+    body = response.get_json()
+    assert body['created'] == 2
+    assert body['failed'] == 1
+    results = body['results']
+    assert [result['index'] for result in results] == [0, 1, 2]
+    assert [result['status'] for result in results] == ['created', 'failed', 'created']
+    assert results[1]['error'] == {'description': ['Missing data for required field.']}
+    assert results[0]['order']['description'] == 'Best effort order'
+    assert order_count(app) == orders + 2
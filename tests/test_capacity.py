@@ -0,0 +1,43 @@
+from datetime import date, timedelta
+
+
+def auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+# A day no other test orders for, far enough ahead for any product to be ready
+DAY = date.today() + timedelta(days = 300)
+
+
+def order_body(description):
+    # Product 1 takes 2 prep days, so each order uses 2 of the days capacity
+    return {'product_id': 1, 'quantity': 1, 'description': description, 'delivery_pup_date': DAY.strftime('%d/%m/%Y')}
+
+
+def day_availability(client):
+    day = DAY.strftime('%d/%m/%Y')
+    return client.get(f'/orders/availability?from={day}&to={day}&product_id=1').get_json()['days'][0]
+
+
+def test_only_admins_can_set_capacity(client, user_token):
+    response = client.put('/orders/capacity', json = {'day': DAY.strftime('%d/%m/%Y'), 'capacity': 0}, headers = auth(user_token))
+    assert response.status_code == 401
+    assert day_availability(client)['capacity'] == 40
+
+
+def test_a_day_cant_be_overbooked(client, user_token, admin_token):
+    response = client.put('/orders/capacity', json = {'day': DAY.strftime('%d/%m/%Y'), 'capacity': 3}, headers = auth(admin_token))
+    assert response.status_code == 200
+    assert response.get_json() == {'day': DAY.isoformat(), 'capacity': 3}
+    assert day_availability(client) == {'date': DAY.isoformat(), 'capacity': 3, 'booked': 0, 'remaining': 3, 'available': True}
+    assert client.post('/orders/', json = order_body('First order of the day'), headers = auth(user_token)).status_code == 201
+    # The second order would need 4 of the 3 the kitchen can do that day
+    response = client.post('/orders/', json = order_body('One order too many'), headers = auth(user_token))
+    assert response.status_code == 400
+    assert 'fully booked' in response.get_json()['error']['delivery_pup_date'][0]
+    assert day_availability(client) == {'date': DAY.isoformat(), 'capacity': 3, 'booked': 2, 'remaining': 1, 'available': False}
+    # PUT changes the capacity of a day it has already set
+    response = client.put('/orders/capacity', json = {'day': DAY.strftime('%d/%m/%Y'), 'capacity': 4}, headers = auth(admin_token))
+    assert response.get_json()['capacity'] == 4
+    assert client.post('/orders/', json = order_body('Fits now'), headers = auth(user_token)).status_code == 201
+    assert day_availability(client)['remaining'] == 0
@@ -0,0 +1,16 @@
+import os
+import pytest
+from init import db
+from controllers.cli_controller import HOT_QUERIES, explain_plan
+
+
+# EXPLAIN plans are postgres only, run with TEST_DATABASE_URL set to a postgres database to check them
+pytestmark = pytest.mark.skipif(not os.environ['DATABASE_URL'].startswith('postgresql'), reason = 'needs TEST_DATABASE_URL set to a postgres database')
+
+
+@pytest.mark.parametrize('sql, index', HOT_QUERIES)
+def test_hot_query_uses_index(app, sql, index):
+    # The same check as flask db explain, each hot query has to be planned with its index
+    with app.app_context(), db.engine.connect() as connection:
+        plan = explain_plan(connection, sql)
+    assert index in plan, plan
@@ -0,0 +1,41 @@
+from datetime import date, timedelta
+
+
+def auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def place_order(client, token, description):
+    delivery = (date.today() + timedelta(days = 320)).strftime('%d/%m/%Y')
+    body = {'product_id': 3, 'quantity': 1, 'description': description, 'delivery_pup_date': delivery}
+    response = client.post('/orders/', json = body, headers = auth(token))
+    assert response.status_code == 201
+    order_id = response.get_json()['id']
+    return order_id, client.get(f'/orders/{order_id}', headers = auth(token)).headers['ETag']
+
+
+def test_stale_if_match_gets_412_with_the_current_etag(client, user_token):
+    order_id, etag = place_order(client, user_token, 'Order edited twice')
+    response = client.patch(f'/orders/{order_id}', json = {'description': 'First edit'}, headers = {**auth(user_token), 'If-Match': etag})
+    assert response.status_code == 200
+    current = response.headers['ETag']
+    assert current != etag
+    # A second client still holding the first ETag cant overwrite the first edit
+    response = client.patch(f'/orders/{order_id}', json = {'description': 'Second edit'}, headers = {**auth(user_token), 'If-Match': etag})
+    assert response.status_code == 412
+    assert response.headers['ETag'] == current
+    assert client.get(f'/orders/{order_id}', headers = auth(user_token)).get_json()['description'] == 'First edit'
+    # Reading it again gives the ETag to edit it with
+    response = client.patch(f'/orders/{order_id}', json = {'description': 'Second edit'}, headers = {**auth(user_token), 'If-Match': current})
+    assert response.status_code == 200
+
+
+def test_edit_racing_a_status_change_gets_403(client, user_token, admin_token):
+    order_id, etag = place_order(client, user_token, 'Order the kitchen starts on')
+    # The kitchen starts on the order after the user read it
+    assert client.patch(f'/orders/{order_id}', json = {'status': 'Preparing'}, headers = auth(admin_token)).status_code == 200
+    response = client.patch(f'/orders/{order_id}', json = {'description': 'Too late'}, headers = {**auth(user_token), 'If-Match': etag})
+    assert response.status_code == 403
+    order = client.get(f'/orders/{order_id}', headers = auth(user_token)).get_json()
+    assert order['status'] == 'Preparing'
+    assert order['description'] == 'Order the kitchen starts on'
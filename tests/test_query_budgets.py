@@ -0,0 +1,61 @@
+from datetime import date, timedelta
+import pytest
+from utils.sql_counter import assert_max_queries
+
+
+# Most SQL statements each endpoint can run, the relationships its schema dumps are eager loaded (see utils/loading.py)
+# so the budgets dont grow with the number of rows on the page, an endpoint going over its budget has started lazy loading again
+READ_BUDGETS = [
+    ('/products/', None, 3),
+    ('/products/1', None, 3),
+    ('/products/?latest_comments=3', None, 3),
+    ('/products/1/comments/', None, 1),
+    ('/orders/', 'user', 1),
+    ('/orders/', 'admin', 1),
+    ('/orders/?include_archived=true', 'admin', 2),
+]
+
+
+def auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.mark.parametrize('path, login, budget', READ_BUDGETS)
+def test_read_budgets(app, client, user_token, admin_token, path, login, budget):
+    headers = auth({'user': user_token, 'admin': admin_token}[login]) if login else {}
+    with app.app_context(), assert_max_queries(budget):
+        response = client.get(path, headers = headers)
+    assert response.status_code == 200
+    # The instrumentation reports the same count to clients and the benchmarks
+    assert int(response.headers['X-SQL-Statements']) <= budget
+
+
+def test_order_budgets(app, client, user_token):
+    delivery = (date.today() + timedelta(days = 200)).strftime('%d/%m/%Y')
+    body = {'product_id': 1, 'quantity': 1, 'description': 'Budget order', 'delivery_pup_date': delivery}
+    with app.app_context(), assert_max_queries(4):
+        response = client.post('/orders/', json = body, headers = auth(user_token))
+    assert response.status_code == 201
+    order_id = response.get_json()['id']
+    with app.app_context(), assert_max_queries(1):
+        response = client.get(f'/orders/{order_id}', headers = auth(user_token))
+    assert response.status_code == 200
+    with app.app_context(), assert_max_queries(1):
+        response = client.patch(f'/orders/{order_id}', json = {'description': 'Edited budget order'}, headers = {**auth(user_token), 'If-Match': response.headers['ETag']})
+    assert response.status_code == 200
+    with app.app_context(), assert_max_queries(3):
+        response = client.delete(f'/orders/{order_id}', headers = auth(user_token))
+    assert response.status_code == 200
+
+
+def test_comment_budgets(app, client, user_token):
+    # The comment is dumped with its user and its product with the products stats and orders
+    with app.app_context(), assert_max_queries(5):
+        response = client.post('/products/1/comments/', json = {'message': 'Budget comment'}, headers = auth(user_token))
+    assert response.status_code == 201
+    comment = response.get_json()
+    assert comment['user'] and comment['product']['id'] == 1
+    with app.app_context(), assert_max_queries(4):
+        response = client.patch(f'/products/1/comments/{comment["id"]}', json = {'message': 'Edited budget comment'}, headers = auth(user_token))
+    assert response.status_code == 200
+    assert response.get_json()['product']['orders'] == comment['product']['orders']
@@ -0,0 +1,35 @@
+import pytest
+from utils import rate_limit
+from conftest import USER_LOGIN
+
+
+@pytest.fixture
+def login_limit(app, monkeypatch):
+    # Turns the rate limits on for the test with 2 logins a minute per IP address and empty buckets
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setitem(rate_limit.RATE_LIMITS, 'auth.auth_login', (2, 60))
+    monkeypatch.setattr(rate_limit, '_store', rate_limit.MemoryStore(100))
+
+
+def test_too_many_logins_get_429_with_retry_after(client, login_limit):
+    for i in range(2):
+        assert client.post('/auth/login', json = USER_LOGIN).status_code == 200
+    response = client.post('/auth/login', json = USER_LOGIN)
+    assert response.status_code == 429
+    # One login drips back into the bucket every 30 seconds
+    assert response.headers['Retry-After'] == '30'
+    # Another address has its own bucket
+    assert client.post('/auth/login', json = USER_LOGIN, environ_base = {'REMOTE_ADDR': '10.0.0.2'}).status_code == 200
+
+
+@pytest.mark.parametrize('forwarded_for, trusted_proxies, address', [
+    ('203.0.113.5', 1, '203.0.113.5'),
+    # The client can send its own X-Forwarded-For, only the entry the trusted proxy added is used
+    ('1.2.3.4, 203.0.113.5', 1, '203.0.113.5'),
+    ('1.2.3.4, 203.0.113.5, 10.0.0.1', 2, '203.0.113.5'),
+    ('203.0.113.5', 2, '10.0.0.9'),
+    ('203.0.113.5', 0, '10.0.0.9'),
+    (None, 1, '10.0.0.9'),
+])
+def test_forwarded_address(forwarded_for, trusted_proxies, address):
+    assert rate_limit.forwarded_address(forwarded_for, '10.0.0.9', trusted_proxies) == address
@@ -0,0 +1,90 @@
+import os
+import shutil
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from init import db
+from utils import routing, response_cache
+
+
+# The replicas are SQLite files next to the test database, reads are only sent to replicas on SQLite here
+pytestmark = pytest.mark.skipif(not os.environ['DATABASE_URL'].startswith('sqlite'), reason = 'uses SQLite files as replicas')
+
+
+@pytest.fixture
+def use_replicas(app, monkeypatch):
+    # Swaps in replicas made from the given files for the test, each replica counts the statements it runs
+    # changes made by earlier tests are treated as already on the replicas
+    created = []
+    monkeypatch.setattr(response_cache.get_backend(), 'changed_at', 0)
+
+    def use(*paths):
+        replica_set = routing.ReplicaSet([f'sqlite:///{path}' for path in paths])
+        monkeypatch.setattr(routing, 'replicas', replica_set)
+        for i in range(len(paths)):
+            replica = replica_set.pick()
+            replica.statements = []
+            event.listen(replica.engine, 'before_cursor_execute', lambda conn, cursor, statement, *args, replica = replica: replica.statements.append(statement))
+            created.append(replica)
+        return replica_set.replicas
+
+    yield use
+    for replica in created:
+        replica.engine.dispose()
+
+
+def copy_database(app, tmp_path, name):
+    path = str(tmp_path / name)
+    with app.app_context():
+        shutil.copy(make_url(str(db.engine.url)).database, path)
+    return path
+
+
+def test_each_request_reads_from_one_replica(app, client, tmp_path, use_replicas):
+    first, second = use_replicas(copy_database(app, tmp_path, 'first.db'), copy_database(app, tmp_path, 'second.db'))
+    # Each request is pinned to the next replica and all of its reads go to that one
+    for path in ('/products/?limit=2', '/products/?limit=3'):
+        assert client.get(path).status_code == 200
+    assert len(first.statements) == 3
+    assert len(second.statements) == 3
+
+
+def test_failed_replica_falls_back_to_primary(app, client, tmp_path, use_replicas):
+    # The replica is up (its health check passes) but it doesnt have the tables, so its query fails
+    (replica,) = use_replicas(str(tmp_path / 'empty.db'))
+    response = client.get('/products/?limit=4')
+    assert response.status_code == 200
+    assert len(response.get_json()['data']) == 4
+    assert len(replica.statements) == 1
+    assert not replica.healthy
+
+
+def auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def test_cache_fill_after_a_change_reads_from_primary(app, client, user_token, tmp_path, use_replicas, monkeypatch):
+    # The replica is a copy from before the comment is posted, so it is behind the primary
+    (replica,) = use_replicas(copy_database(app, tmp_path, 'behind.db'))
+    comment = client.post('/products/2/comments/', json = {'message': 'Fresh comment'}, headers = auth(user_token)).get_json()
+    # An anonymous read just after the change fills the cache from the primary, not with the replicas old copy
+    response = client.get('/products/2/comments/?limit=5')
+    assert response.get_json()['data'][0]['id'] == comment['id']
+    assert replica.statements == []
+    # Once the replicas have had time to catch up cache fills go back to them
+    monkeypatch.setattr(response_cache.get_backend(), 'changed_at', 0)
+    assert client.get('/products/2/comments/?limit=6').status_code == 200
+    assert len(replica.statements) == 1
+
+
+def test_user_that_wrote_reads_from_primary_on_public_routes(app, client, user_token, tmp_path, use_replicas, monkeypatch):
+    (replica,) = use_replicas(copy_database(app, tmp_path, 'behind.db'))
+    comment = client.post('/products/3/comments/', json = {'message': 'My comment'}, headers = auth(user_token)).get_json()
+    monkeypatch.setattr(response_cache.get_backend(), 'changed_at', 0)
+    # The public route doesnt require a web token but the one sent is checked, so the user who wrote reads their own change
+    response = client.get('/products/3/comments/?limit=7', headers = auth(user_token))
+    assert response.get_json()['data'][0]['id'] == comment['id']
+    assert replica.statements == []
+    # Other users read from the replica
+    assert client.get('/products/3/comments/?limit=8').status_code == 200
+    assert len(replica.statements) == 1
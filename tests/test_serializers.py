@@ -0,0 +1,100 @@
+from datetime import date
+import pytest
+from marshmallow import Schema
+from init import db
+from models.product import Product, ProductSchema, product_schema, products_schema, product_results_schema, catalogue_schema
+from models.comment import Comment, CommentSchema, comment_schema, comments_schema, product_comments_schema
+from models.order import Order, OrderSchema, order_schema, orders_schema
+from utils.serializers import compile_dump
+
+
+# The schemas main.py compiles, with the model each one dumps
+COMPILED_SCHEMAS = [
+    ('product', product_schema, Product),
+    ('products', products_schema, Product),
+    ('product_results', product_results_schema, Product),
+    ('catalogue', catalogue_schema, Product),
+    ('comment', comment_schema, Comment),
+    ('comments', comments_schema, Comment),
+    ('product_comments', product_comments_schema, Comment),
+    ('order', order_schema, Order),
+    ('orders', orders_schema, Order),
+]
+
+# Schemas created with only, exclude and many the way a controller would, compiled on their own
+OPTION_SCHEMAS = [
+    ('product only', lambda: ProductSchema(only = ['id', 'name', 'stats']), Product),
+    ('products exclude', lambda: ProductSchema(many = True, exclude = ['orders', 'description']), Product),
+    ('products nested comments', lambda: ProductSchema(many = True, only = ['comments', 'id']), Product),
+    ('comment only', lambda: CommentSchema(only = ['message', 'user']), Comment),
+    ('comments exclude', lambda: CommentSchema(many = True, exclude = ['user']), Comment),
+    ('orders only dates', lambda: OrderSchema(many = True, only = ['delivery_pup_date', 'date_ordered', 'id']), Order),
+]
+
+
+def ordered(value):
+    # Dictionaries are turned into lists of (key, value) so comparing them checks the key order as well as the values
+    if isinstance(value, dict):
+        return [(key, ordered(item)) for key, item in value.items()]
+    if isinstance(value, list):
+        return [ordered(item) for item in value]
+    return value
+
+
+def assert_same(dump, schema, obj):
+    # dump is the compiled function, Schema.dump is marshmallow's own dump of the same schema
+    assert ordered(dump(obj)) == ordered(Schema.dump(schema, obj))
+
+
+def dump_arguments(schema, model):
+    # The rows of the model from the test database, all of them for a many schema or one at a time
+    rows = db.session.scalars(db.select(model).order_by(model.id)).all()
+    assert rows
+    return [rows] if schema.many else rows
+
+
+@pytest.mark.parametrize('name, schema, model', COMPILED_SCHEMAS)
+def test_compiled_schemas_match_marshmallow(app, name, schema, model):
+    assert 'compiled_dump' in schema.__dict__, f'{name} is not compiled'
+    with app.app_context():
+        for obj in dump_arguments(schema, model):
+            assert_same(schema.dump, schema, obj)
+
+
+@pytest.mark.parametrize('name, make_schema, model', OPTION_SCHEMAS)
+def test_only_exclude_and_many_match_marshmallow(app, name, make_schema, model):
+    schema = make_schema()
+    compiled = compile_dump(schema)
+    assert compiled is not None, f'{name} could not be compiled'
+    with app.app_context():
+        for obj in dump_arguments(schema, model):
+            assert_same(compiled, schema, obj)
+
+
+def test_none_values_match_marshmallow():
+    # Objects that havent been saved have no stats, comments, orders, user or product and every column is None
+    product = Product(id = 1)
+    comment = Comment(id = 1)
+    order = Order(id = 1)
+    for schema, obj in ((product_schema, product), (comment_schema, comment), (order_schema, order)):
+        assert_same(schema.dump, schema, obj)
+    assert_same(products_schema.dump, products_schema, [product, product])
+    assert_same(orders_schema.dump, orders_schema, [order])
+
+
+def test_dates_match_marshmallow():
+    # date_ordered is an inferred field and delivery_pup_date a declared one, both are dumped in ISO format
+    order = Order(
+        id = 1,
+        user_id = 1,
+        product_id = 1,
+        quantity = 1,
+        status = 'Completed',
+        description = 'Leap day order',
+        date_ordered = date(2024, 2, 29),
+        delivery_pup_date = date(2024, 3, 1),
+    )
+    assert_same(order_schema.dump, order_schema, order)
+    assert order_schema.dump(order)['date_ordered'] == '2024-02-29'
+    assert order_schema.dump(order)['delivery_pup_date'] == '2024-03-01'
+    assert list(order_schema.dump(order)) == list(OrderSchema.Meta.fields)
@@ -0,0 +1,47 @@
+from init import db
+from models.token import RevokedToken
+from conftest import USER_LOGIN
+
+
+def auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def revoked_rows(app):
+    with app.app_context():
+        return db.session.scalar(db.select(db.func.count()).select_from(RevokedToken))
+
+
+def test_refresh_reuse_revokes_the_family(app, client):
+    login = client.post('/auth/login', json = USER_LOGIN).get_json()
+    rows = revoked_rows(app)
+    # A normal refresh swaps the refresh token for new tokens without adding to revoked_tokens
+    response = client.post('/auth/refresh', headers = auth(login['refresh_token']))
+    assert response.status_code == 200
+    refreshed = response.get_json()
+    assert refreshed['refresh_token'] != login['refresh_token']
+    assert revoked_rows(app) == rows
+    assert client.get('/orders/', headers = auth(refreshed['token'])).status_code == 200
+    # Using the first refresh token again means someone else has a copy of it
+    response = client.post('/auth/refresh', headers = auth(login['refresh_token']))
+    assert response.status_code == 401
+    # so every token of the login is revoked, including the ones the real refresh handed out
+    assert client.post('/auth/refresh', headers = auth(refreshed['refresh_token'])).status_code == 401
+    assert client.get('/orders/', headers = auth(refreshed['token'])).status_code == 401
+    assert revoked_rows(app) == rows + 1
+
+
+def test_other_logins_keep_working(app, client):
+    first = client.post('/auth/login', json = USER_LOGIN).get_json()
+    second = client.post('/auth/login', json = USER_LOGIN).get_json()
+    client.post('/auth/refresh', headers = auth(first['refresh_token']))
+    client.post('/auth/refresh', headers = auth(first['refresh_token']))
+    # Only the family of the reused token is revoked
+    assert client.post('/auth/refresh', headers = auth(second['refresh_token'])).status_code == 200
+
+
+def test_logout_revokes_the_login(client):
+    login = client.post('/auth/login', json = USER_LOGIN).get_json()
+    assert client.post('/auth/logout', headers = auth(login['token'])).status_code == 200
+    assert client.get('/orders/', headers = auth(login['token'])).status_code == 401
+    assert client.post('/auth/refresh', headers = auth(login['refresh_token'])).status_code == 401
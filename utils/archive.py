@@ -0,0 +1,51 @@
+import os
+from flask import request
+from sqlalchemy import and_, delete, func, insert, select, text
+from models.order import Order, ArchivedOrder
+
+
+# Completed orders placed more than this many days ago are moved to orders_archive by flask db archive-orders
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+
+
+def include_archived():
+    # Archived orders are only read when the request asks for them with ?include_archived=true
+    return request.args.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+
+def create_partitions(session, first, last):
+    # Creates the yearly partitions of orders_archive for the years from first to last, on postgres only
+    if session.get_bind().dialect.name != 'postgresql':
+        return
+    for year in range(first.year, last.year + 1):
+        session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS orders_archive_{year} PARTITION OF orders_archive "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        ))
+
+
+def archive_orders(session, cutoff, batch_size):
+    # Moves the completed orders placed before the cutoff date to orders_archive, batch_size orders per transaction
+    # so the orders table is never locked for long, returns how many were moved
+    # the product stats keep counting them as the stats are only changed by the session, not by these statements
+    archivable = and_(Order.status == 'Completed', Order.date_ordered < cutoff)
+    oldest = session.scalar(select(func.min(Order.date_ordered)).where(archivable))
+    if oldest is None:
+        return 0
+    create_partitions(session, oldest, cutoff)
+    session.commit()
+    table = Order.__table__
+    columns = [column.name for column in ArchivedOrder.__table__.columns]
+    moved = 0
+    while True:
+        # Orders locked by a request (e.g. being deleted) are skipped
+        qry = select(Order.id).where(archivable).order_by(Order.id).limit(batch_size).with_for_update(skip_locked = True)
+        ids = session.scalars(qry).all()
+        if not ids:
+            break
+        session.execute(insert(ArchivedOrder.__table__).from_select(columns, select(*(table.c[column] for column in columns)).where(table.c.id.in_(ids))))
+        session.execute(delete(table).where(table.c.id.in_(ids)))
+        session.commit()
+        moved += len(ids)
+        print(f'orders: {moved} archived')
+    return moved
@@ -0,0 +1,91 @@
+import os
+from datetime import timedelta
+from marshmallow.exceptions import ValidationError
+from sqlalchemy import case, func, literal, null, select, union_all
+from models.order import Order
+from models.product import Product
+from models.capacity import CapacityDay
+
+
+# How much work the kitchen can have due on one day, measured in prep days (see order_weight)
+# days with a different capacity (e.g. closed days) are set in the capacity_days table with PUT /orders/capacity
+DAILY_CAPACITY = int(os.environ.get('DAILY_CAPACITY', 40))
+# Key of the postgres advisory locks held on a day while orders due that day are checked and placed
+CAPACITY_LOCK = 17
+
+
+def order_weight(prep_days, quantity):
+    # An order uses its products prep days (at least 1) times its quantity of a days capacity,
+    # so products that take longer to make fill up a day sooner
+    return max(prep_days or 0, 1) * int(quantity or 1)
+
+
+# order_weight worked out in SQL for each order
+ORDER_WEIGHT = case((Product.prep_days > 1, Product.prep_days), else_ = 1) * func.coalesce(Order.quantity, 1)
+
+
+def day_usage(session, start, end, exclude = None):
+    # Returns {day: (booked, capacity)} for the days from start to end that have orders due or a capacity set,
+    # the weight of the orders due each day and the capacity_days rows are added up by one grouped query
+    # exclude is the id of an order being edited, which shouldnt count against its own new date
+    booked = select(Order.delivery_pup_date.label('day'), ORDER_WEIGHT.label('booked'), null().label('capacity')) \
+        .join(Product, Order.product_id == Product.id).where(Order.delivery_pup_date.between(start, end))
+    if exclude is not None:
+        booked = booked.where(Order.id != exclude)
+    capacity = select(CapacityDay.day, literal(0).label('booked'), CapacityDay.capacity).where(CapacityDay.day.between(start, end))
+    days = union_all(booked, capacity).subquery()
+    qry = select(days.c.day, func.sum(days.c.booked), func.max(days.c.capacity)).group_by(days.c.day)
+    return {
+        day: (int(total or 0), DAILY_CAPACITY if day_capacity is None else day_capacity)
+        for day, total, day_capacity in session.execute(qry)
+    }
+
+
+def lock_days(session, days):
+    # Holds a postgres advisory lock on each day until the transaction ends so two orders for the same day
+    # cant both see the last of its capacity free, the days are locked in date order so requests cant deadlock
+    if session.get_bind().dialect.name != 'postgresql':
+        return
+    for day in sorted(set(days)):
+        session.execute(select(func.pg_advisory_xact_lock(CAPACITY_LOCK, day.toordinal())))
+
+
+def reserve(session, wanted, exclude = None):
+    # Checks a list of (day, weight) orders against each days capacity, in the order given,
+    # and returns a list of whether each one fits, the locks are held until the orders are committed
+    days = [day for day, weight in wanted]
+    lock_days(session, days)
+    usage = day_usage(session, min(days), max(days), exclude)
+    fits = []
+    for day, weight in wanted:
+        booked, capacity = usage.get(day, (0, DAILY_CAPACITY))
+        fits.append(booked + weight <= capacity)
+        if fits[-1]:
+            usage[day] = (booked + weight, capacity)
+    return fits
+
+
+def fully_booked(day):
+    return ValidationError({'delivery_pup_date': [f'The kitchen is fully booked on {day.strftime("%d/%m/%Y")}, please choose another date (see /orders/availability).']})
+
+
+def reserve_order(session, product, quantity, day, exclude = None):
+    # Reserves the capacity for one order or raises a validation error if its day is full
+    if not reserve(session, [(day, order_weight(product.prep_days, quantity))], exclude)[0]:
+        raise fully_booked(day)
+
+
+def availability(session, start, end, weight = None, earliest = None):
+    # The capacity, booked work and what is left on each day from start to end
+    # with a weight (of a product) each day also says whether an order of it can still be placed that day
+    usage = day_usage(session, start, end)
+    days = []
+    day = start
+    while day <= end:
+        booked, capacity = usage.get(day, (0, DAILY_CAPACITY))
+        result = {'date': day.isoformat(), 'capacity': capacity, 'booked': booked, 'remaining': max(capacity - booked, 0)}
+        if weight is not None:
+            result['available'] = booked + weight <= capacity and (earliest is None or day >= earliest)
+        days.append(result)
+        day += timedelta(days = 1)
+    return days
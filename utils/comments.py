@@ -0,0 +1,41 @@
+from collections import defaultdict
+from marshmallow.exceptions import ValidationError
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased, joinedload
+from models.comment import Comment, product_comments_schema
+
+
+# Most comments each product of the catalogue can be listed with in ?latest_comments=N
+MAX_LATEST_COMMENTS = 10
+
+
+def latest_comments_arg(args):
+    # How many of their latest comments to list the products with, None to list them with every comment
+    # args is the query string of the Flask request or the async one in asgi.py
+    value = args.get('latest_comments')
+    if value is None:
+        return None
+    try:
+        count = int(value)
+    except ValueError:
+        raise ValidationError('latest_comments needs to be entered as a whole number.')
+    if count < 0 or count > MAX_LATEST_COMMENTS:
+        raise ValidationError(f'latest_comments must be between 0 and {MAX_LATEST_COMMENTS}.')
+    if args.get('fields'):
+        raise ValidationError('fields cannot be used with latest_comments.')
+    return count
+
+
+def latest_comments(session, product_ids, count):
+    # Returns {product id: [its newest count comments dumped]} for a page of products with one query,
+    # the comments of each product are numbered newest first with row_number() and only the first count are read
+    if not product_ids or not count:
+        return {}
+    rank = func.row_number().over(partition_by = Comment.product_id, order_by = Comment.id.desc()).label('rank')
+    ranked = select(Comment, rank).where(Comment.product_id.in_(product_ids)).subquery()
+    latest = aliased(Comment, ranked)
+    qry = select(latest).where(ranked.c.rank <= count).options(joinedload(latest.user)).order_by(latest.product_id, latest.id.desc())
+    comments = defaultdict(list)
+    for comment in session.scalars(qry):
+        comments[comment.product_id].append(comment)
+    return {product_id: product_comments_schema.dump(rows) for product_id, rows in comments.items()}
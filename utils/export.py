@@ -0,0 +1,46 @@
+import io
+import csv
+import json
+from init import db
+from flask import request, Response, stream_with_context
+from marshmallow.exceptions import ValidationError
+
+
+# Rows read from the database at a time, through a server side cursor so memory stays the same for any size of export
+EXPORT_BATCH_SIZE = 1000
+# The formats an export can be downloaded in, e.g. ?format=csv
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def export_response(qry, schema, filename):
+    # Streams every row of the query to the client as it is read, one JSON object per line or one CSV row per line
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        raise ValidationError(f'format must be one of {", ".join(EXPORT_FORMATS)}.')
+    # yield_per reads the rows in batches from a server side cursor instead of loading them all at once
+    rows = db.session.scalars(qry.execution_options(yield_per = EXPORT_BATCH_SIZE))
+
+    def generate_ndjson():
+        for row in rows:
+            yield json.dumps(schema.dump(row)) + '\n'
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames = list(schema.fields))
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(schema.dump(row))
+            # Sends what has been written so far and empties the buffer for the next row
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+        # The header is still in the buffer if there were no rows
+        yield buffer.getvalue()
+
+    generate = generate_csv if export_format == 'csv' else generate_ndjson
+    # stream_with_context keeps the request and database session open while the response is being sent
+    return Response(
+        stream_with_context(generate()),
+        mimetype = EXPORT_FORMATS[export_format],
+        headers = {'Content-Disposition': f'attachment; filename={filename}.{export_format}'}
+    )
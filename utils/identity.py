@@ -0,0 +1,78 @@
+import os
+import time
+from init import db
+from flask import g
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from models.user import User
+from utils.ttl_cache import TTLCache
+
+
+# Admin status of users looked up from the database or committed by this worker, keyed by user id, as (is_admin, time cached)
+# bounded so it cannot grow with the number of users and entries expire so changes made elsewhere are picked up
+admin_cache = TTLCache(
+    maxsize = int(os.environ.get('ADMIN_CACHE_SIZE', 1024)),
+    ttl = int(os.environ.get('ADMIN_CACHE_TTL', 300))
+)
+
+
+def admin_claims(user):
+    # Claims signed into the web token at login so admin checks can be done without querying the database
+    return {'is_admin': bool(user.is_admin)}
+
+
+def current_user_id():
+    # Check web token to get the user associated to that token, only decoded once per request
+    if 'user_id' not in g:
+        g.user_id = int(get_jwt_identity())
+    return g.user_id
+
+
+def authorise_as_admin():
+    # Returns whether the user in the web token is an admin, worked out once per request
+    if 'is_admin' not in g:
+        g.is_admin = lookup_admin(current_user_id())
+    return g.is_admin
+
+
+def cached_admin(user_id, claims):
+    # Returns the admin status from the tokens is_admin claim or the cache, whichever was worked out last,
+    # or None if neither has it, a token issued after the cache entry (e.g. a new login) always wins over the entry
+    entry = admin_cache.get(user_id)
+    if 'is_admin' in claims and (entry is None or entry[1] <= claims.get('iat', 0)):
+        return claims['is_admin']
+    return None if entry is None else entry[0]
+
+
+def lookup_admin(user_id):
+    # Tokens issued at login carry the is_admin claim so usually no database query is needed
+    is_admin = cached_admin(user_id, get_jwt())
+    if is_admin is not None:
+        return is_admin
+    # Older tokens without the claim fall back to querying the users table, then the answer is cached
+    qry = db.select(User.is_admin).filter_by(id = user_id)
+    is_admin = bool(db.session.scalar(qry))
+    admin_cache.set(user_id, (is_admin, time.time()))
+    return is_admin
+
+
+@event.listens_for(User.is_admin, 'set')
+def admin_status_changed(user, value, oldvalue, initiator):
+    # Remembers the change until it is committed, a change that is rolled back never reaches the cache
+    session = Session.object_session(user)
+    if session is not None and user.id is not None and value != oldvalue:
+        session.info.setdefault('admin_changes', {})[user.id] = bool(value)
+
+
+@event.listens_for(Session, 'after_commit')
+def cache_admin_changes(session):
+    # Once committed the new status overrides the claim in the users existing tokens on this worker,
+    # other workers stop accepting those tokens when they are revoked (see revoke_changed_admins in utils/tokens.py)
+    for user_id, is_admin in session.info.pop('admin_changes', {}).items():
+        admin_cache.set(user_id, (is_admin, time.time()))
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_admin_changes(session):
+    session.info.pop('admin_changes', None)
@@ -0,0 +1,255 @@
+import io
+import os
+import csv
+import json
+import time
+import click
+from itertools import islice
+from datetime import date, datetime
+from sqlalchemy import func, insert, select
+from models.user import User
+from models.product import Product
+from models.order import Order, VALID_STATUSES
+from models.comment import Comment
+from models.legacy_import import ImportCheckpoint, ImportId
+from utils.passwords import hash_passwords
+
+
+# The order files are imported in, each one can point at the rows of the ones before it
+IMPORT_KINDS = ('users', 'products', 'orders', 'comments')
+# Most bad rows printed, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+# Marks a NULL in the CSV sent to COPY so empty strings stay empty strings
+COPY_NULL = '\\N'
+# Passwords from the old system that are already bcrypt hashes are kept as they are
+BCRYPT_PREFIXES = ('$2a$', '$2b$', '$2y$')
+
+
+class ImportRowError(Exception):
+    # A row that cant be imported, it is reported with its line number and skipped
+    pass
+
+
+def read_rows(path):
+    # Streams the rows of a CSV file with a header line or an NDJSON file (one JSON object per line) as dictionaries,
+    # the same formats GET /orders/export and /products/export write
+    with open(path, newline = '', encoding = 'utf-8') as file:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def required(row, name):
+    value = row.get(name)
+    if value is None or value == '':
+        raise ImportRowError(f'{name} is required')
+    return value
+
+
+def optional(row, name, default = None):
+    value = row.get(name)
+    return default if value is None or value == '' else value
+
+
+def parse_number(value, name, kind):
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise ImportRowError(f'{name} must be a number, not {value!r}')
+
+
+def parse_date(value, name):
+    # Dates can be in ISO format (YYYY-MM-DD) or the local format of the API (DD/MM/YYYY)
+    if value is None or isinstance(value, date):
+        return value
+    for pattern in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(value, pattern).date()
+        except ValueError:
+            pass
+    raise ImportRowError(f'{name} must be a date, not {value!r}')
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 't', 'yes', 'y')
+
+
+def copy_value(value):
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return value
+
+
+def copy_rows(session, table, rows):
+    # Loads the rows with COPY on postgres, which is much faster than INSERT statements for large numbers of rows,
+    # other databases (e.g. SQLite) get one multi-row INSERT instead
+    if not rows:
+        return
+    if session.get_bind().dialect.name != 'postgresql':
+        session.execute(insert(table), rows)
+        return
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([copy_value(row[column]) for column in columns])
+    buffer.seek(0)
+    # COPY runs on the sessions connection so it is part of the same transaction as the checkpoint
+    cursor = session.connection().connection.cursor()
+    cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')", buffer)
+
+
+def allocate_ids(session, table, count):
+    # COPY cant return the ids it creates, so they are taken from the tables sequence first and sent with the rows
+    if session.get_bind().dialect.name == 'postgresql':
+        sequence = func.pg_get_serial_sequence(table.name, 'id')
+        return session.scalars(select(func.nextval(sequence)).select_from(func.generate_series(1, count))).all()
+    first = (session.scalar(select(func.max(table.c.id))) or 0) + 1
+    return list(range(first, first + count))
+
+
+class LegacyImport:
+    # Loads users, products, orders and comments exported from the old system batch_size rows at a time,
+    # each batch is committed with a checkpoint of how far through its file the import is
+    def __init__(self, session, batch_size, executor, rounds):
+        self.session = session
+        self.batch_size = batch_size
+        self.executor = executor
+        self.rounds = rounds
+        self.errors = 0
+        # Old id -> new id of the users and products imported so far, including by earlier runs
+        self.ids = {'users': {}, 'products': {}}
+        for kind, legacy_id, new_id in session.execute(select(ImportId.kind, ImportId.legacy_id, ImportId.id)):
+            self.ids[kind][legacy_id] = new_id
+        # Emails and product names have to be unique, rows repeating one are skipped instead of failing a whole batch
+        self.emails = set(session.scalars(select(User.email)))
+        self.product_names = set(session.scalars(select(Product.name)))
+
+    def lookup(self, row, name, kind):
+        legacy_id = str(required(row, name))
+        if legacy_id not in self.ids[kind]:
+            raise ImportRowError(f'{name} {legacy_id} was not imported')
+        return self.ids[kind][legacy_id]
+
+    def user_row(self, row):
+        # NDJSON rows can hold numbers where a string is expected, they are imported as text
+        email = str(required(row, 'email')).strip()
+        if email in self.emails:
+            raise ImportRowError(f'email {email} is already registered')
+        record = {
+            'first_name': required(row, 'first_name'),
+            'last_name': required(row, 'last_name'),
+            'address': optional(row, 'address'),
+            'email': email,
+            'password': str(required(row, 'password')),
+            'is_admin': parse_bool(row.get('is_admin')),
+        }
+        self.emails.add(email)
+        return record
+
+    def product_row(self, row):
+        name = required(row, 'name')
+        if name in self.product_names:
+            raise ImportRowError(f'product {name} already exists')
+        record = {
+            'name': name,
+            'description': required(row, 'description'),
+            'price': parse_number(required(row, 'price'), 'price', float),
+            'prep_days': parse_number(required(row, 'prep_days'), 'prep_days', int),
+            'user_id': self.lookup(row, 'user_id', 'users'),
+        }
+        self.product_names.add(name)
+        return record
+
+    def order_row(self, row):
+        status = optional(row, 'status', 'Completed')
+        if status not in VALID_STATUSES:
+            raise ImportRowError(f'status must be one of {", ".join(VALID_STATUSES)}')
+        return {
+            'date_ordered': parse_date(optional(row, 'date_ordered'), 'date_ordered'),
+            'quantity': parse_number(optional(row, 'quantity', 1), 'quantity', int),
+            'status': status,
+            'description': required(row, 'description'),
+            'delivery_pup_date': parse_date(required(row, 'delivery_pup_date'), 'delivery_pup_date'),
+            'user_id': self.lookup(row, 'user_id', 'users'),
+            'product_id': self.lookup(row, 'product_id', 'products'),
+            'version': 1,
+        }
+
+    def comment_row(self, row):
+        return {
+            'message': optional(row, 'message'),
+            'user_id': self.lookup(row, 'user_id', 'users'),
+            'product_id': self.lookup(row, 'product_id', 'products'),
+        }
+
+    def report(self, kind, line, err):
+        self.errors += 1
+        if self.errors <= MAX_REPORTED_ERRORS:
+            click.echo(f'{kind} row {line} skipped: {err}', err = True)
+        elif self.errors == MAX_REPORTED_ERRORS + 1:
+            click.echo(f'More than {MAX_REPORTED_ERRORS} rows skipped, only counting the rest', err = True)
+
+    def run(self, kind, path):
+        model = {'users': User, 'products': Product, 'orders': Order, 'comments': Comment}[kind]
+        convert = getattr(self, f'{kind[:-1]}_row')
+        # The full path of the file so files with the same name in different folders have their own checkpoints
+        source = f'{kind}:{os.path.abspath(path)}'
+        checkpoint = self.session.get(ImportCheckpoint, source)
+        done = checkpoint.rows if checkpoint else 0
+        if done:
+            print(f'{kind}: carrying on after row {done}')
+        started = time.monotonic()
+        imported = 0
+        rows = enumerate(islice(read_rows(path), done, None), done + 1)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            imported += self.load(model, kind, source, convert, batch)
+            rate = imported / max(time.monotonic() - started, 0.001)
+            print(f'{kind}: {batch[-1][0]} rows read, {imported} imported ({rate:.0f} rows/s)')
+        print(f'{kind}: done')
+
+    def load(self, model, kind, source, convert, batch):
+        table = model.__table__
+        records, legacy_ids = [], []
+        # The legacy ids in this batch, kept in a set as well as the list so checking for a repeated id is quick
+        batch_ids = set()
+        for line, row in batch:
+            try:
+                legacy_id = optional(row, 'id')
+                legacy_id = None if legacy_id is None or kind not in self.ids else str(legacy_id)
+                if legacy_id is not None and (legacy_id in self.ids[kind] or legacy_id in batch_ids):
+                    raise ImportRowError(f'id {legacy_id} was already imported')
+                records.append(convert(row))
+                legacy_ids.append(legacy_id)
+                batch_ids.add(legacy_id)
+            except ImportRowError as err:
+                self.report(kind, line, err)
+        if kind == 'users':
+            # bcrypt is the slow part of importing users, so the batches passwords are hashed in parallel
+            plain = [record for record in records if not record['password'].startswith(BCRYPT_PREFIXES)]
+            for record, hashed in zip(plain, hash_passwords(self.executor, [record['password'] for record in plain], self.rounds)):
+                record['password'] = hashed
+        mapped = {}
+        if kind in self.ids and records:
+            for record, new_id, legacy_id in zip(records, allocate_ids(self.session, table, len(records)), legacy_ids):
+                record['id'] = new_id
+                if legacy_id is not None:
+                    mapped[legacy_id] = new_id
+        copy_rows(self.session, table, records)
+        copy_rows(self.session, ImportId.__table__, [
+            {'kind': kind, 'legacy_id': legacy_id, 'id': new_id} for legacy_id, new_id in mapped.items()
+        ])
+        self.session.merge(ImportCheckpoint(source = source, rows = batch[-1][0]))
+        self.session.commit()
+        self.ids.get(kind, {}).update(mapped)
+        return len(records)
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import uuid
+import logging
+from contextvars import ContextVar
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from utils.metrics import Counter, Histogram
+
+
+# Statements slower than this many milliseconds are logged with the route that ran them, unset to turn the slow query log off
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 0))
+
+request_latency = Histogram('http_request_duration_seconds', 'Time taken to handle a request', labels = ('method', 'route', 'status'))
+request_sql_statements = Histogram('http_request_sql_statements', 'SQL statements run per request', labels = ('route',), buckets = (0, 1, 2, 3, 5, 10, 20, 50, 100))
+sql_duration = Histogram('sql_statement_duration_seconds', 'Time taken by each SQL statement', labels = ('route',))
+slow_queries = Counter('sql_slow_statements_total', 'SQL statements slower than SLOW_QUERY_MS', labels = ('route',))
+
+access_log = logging.getLogger('access')
+slow_query_log = logging.getLogger('slow_query')
+
+# The request being handled in async mode (asgi.py), which doesnt have a Flask request context
+async_request = ContextVar('async_request', default = None)
+
+
+class RequestStats:
+    # The same request_id, sql_statements and timings the Flask requests keep in g, for a request handled in async mode
+    def __init__(self, request_id, route):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.route = route
+        self.request_started = time.perf_counter()
+        self.sql_statements = 0
+        self.timings = {}
+
+
+def current_stats():
+    # g of the Flask request or the stats of the async request being handled, None outside a request
+    if has_request_context():
+        return g if 'sql_statements' in g else None
+    return async_request.get()
+
+
+def current_route():
+    # The url rule of the request (e.g. /orders/<int:id>) so requests for different ids are counted together
+    if has_request_context() and request.url_rule is not None:
+        return request.url_rule.rule
+    stats = async_request.get()
+    if stats is not None:
+        return stats.route
+    return 'none'
+
+
+def add_timing(name, seconds):
+    # Adds time spent on something (e.g. bcrypt) to the current request so it shows in its access log
+    stats = current_stats()
+    if stats is not None:
+        stats.timings[name] = stats.timings.get(name, 0) + seconds
+
+
+def record_request(stats, method, path, status):
+    # Adds a finished request to the metrics and the access log, returns the headers to send with its response
+    seconds = time.perf_counter() - stats.request_started
+    request_latency.observe(seconds, method = method, route = stats.route, status = status)
+    request_sql_statements.observe(stats.sql_statements, route = stats.route)
+    access_log.info(json.dumps({
+        'request_id': stats.request_id,
+        'method': method,
+        'path': path,
+        'route': stats.route,
+        'status': status,
+        'duration_ms': round(seconds * 1000, 2),
+        'sql_statements': stats.sql_statements,
+        **{f'{name}_ms': round(value * 1000, 2) for name, value in stats.timings.items()},
+    }))
+    return {'X-Request-ID': stats.request_id, 'X-SQL-Statements': str(stats.sql_statements)}
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # The start is kept on the execution context of the statement (as in the SQLAlchemy profiling recipe),
+    # so a statement that fails and never reaches after_cursor_execute leaves nothing behind
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Statements SQLAlchemy runs for itself without a context (e.g. when it first connects) arent timed
+    started = getattr(context, '_query_start', None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    route = current_route()
+    sql_duration.observe(seconds, route = route)
+    stats = current_stats()
+    if stats is not None:
+        stats.sql_statements += 1
+        add_timing('sql', seconds)
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        slow_queries.inc(route = route)
+        slow_query_log.warning(json.dumps({
+            'request_id': getattr(stats, 'request_id', None),
+            'route': route,
+            'duration_ms': round(seconds * 1000, 2),
+            'statement': statement,
+        }))
+
+
+def init_instrumentation(app):
+    # Times every request and counts the SQL it runs, adds them to the response headers, the metrics and the access log
+    if not access_log.handlers:
+        access_log.addHandler(logging.StreamHandler())
+        access_log.setLevel(logging.INFO)
+    if not slow_query_log.handlers:
+        slow_query_log.addHandler(logging.StreamHandler())
+
+    @app.before_request
+    def start_timer():
+        # Uses the request id sent by a proxy in front of the app if there is one
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        g.request_started = time.perf_counter()
+        g.sql_statements = 0
+        g.timings = {}
+
+    @app.after_request
+    def record_flask_request(response):
+        # Requests stopped before start_timer ran (e.g. by another before_request hook) have nothing to record
+        if 'request_started' not in g:
+            return response
+        g.route = current_route()
+        response.headers.update(record_request(g, request.method, request.full_path.rstrip('?'), response.status_code))
+        return response
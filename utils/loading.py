@@ -0,0 +1,41 @@
+from sqlalchemy.orm import selectinload, joinedload
+from models.product import Product
+from models.comment import Comment
+
+
+# Each endpoint that dumps nested relationships declares here the relationship graph its schema walks,
+# keyed by the schema field that needs it, so the query can eager load it instead of lazy loading one row at a time
+
+# ProductSchema dumps its stats row, comments (with each comments user and product, which is the same product already loaded)
+# and orders, the stats are joined into the products SELECT, comments and orders are loaded with one extra SELECT each
+# for the whole page of products and the comment users are joined into the comments SELECT
+PRODUCT_GRAPH = {
+    'stats': joinedload(Product.stats),
+    'comments': selectinload(Product.comments).joinedload(Comment.user),
+    'orders': selectinload(Product.orders),
+}
+
+# CommentSchema dumps the user that posted the comment and the product with its stats and orders
+COMMENT_GRAPH = {
+    'user': joinedload(Comment.user),
+    'product': joinedload(Comment.product).options(joinedload(Product.stats), selectinload(Product.orders)),
+}
+
+# The products of the catalogue listed with only their latest comments (?latest_comments=N) leave out the comments
+# relationship, the latest comments are read for the whole page by utils.comments.latest_comments
+CATALOGUE_GRAPH = {field: option for field, option in PRODUCT_GRAPH.items() if field != 'comments'}
+
+# The comments of one product are dumped with the user that posted them
+PRODUCT_COMMENTS_GRAPH = {
+    'user': joinedload(Comment.user),
+}
+
+# OrderSchema only dumps the order columns so there is nothing to eager load
+ORDER_GRAPH = {}
+
+
+def load_options(graph, fields = None):
+    # Returns the loader options for the fields being dumped, or for the whole graph if no fields were requested
+    if fields is None:
+        return list(graph.values())
+    return [option for field, option in graph.items() if field in fields]
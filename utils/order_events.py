@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import uuid
+import select
+import asyncio
+import logging
+from bisect import bisect_right
+from itertools import islice
+from collections import deque
+from threading import Condition, Lock, Thread
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+
+# memory keeps the order events in this process (a single worker or tests), postgres sends them between workers
+# with LISTEN/NOTIFY, by default postgres is used when DATABASE_URL is a postgres database
+ORDER_EVENTS_BACKEND = os.environ.get('ORDER_EVENTS_BACKEND', '')
+# LISTEN needs its own connection straight to postgres (not through PgBouncer in transaction mode), DATABASE_URL by default
+ORDER_EVENTS_DATABASE_URL = os.environ.get('ORDER_EVENTS_DATABASE_URL', '')
+# How many recent events each worker keeps for clients resuming with Last-Event-ID
+ORDER_EVENTS_BUFFER = int(os.environ.get('ORDER_EVENTS_BUFFER', 1000))
+# The postgres channel the events are sent on
+CHANNEL = 'order_events'
+# NOTIFY payloads have to be shorter than 8000 bytes, bigger events are sent without the order
+MAX_PAYLOAD = 7900
+
+logger = logging.getLogger('order_events')
+
+
+class MemoryBroker:
+    # Keeps the latest events in order with a number (seq) counting up in this process,
+    # streams wait on the condition until there are events after the last one they sent
+    def __init__(self, size):
+        self.events = deque(maxlen = size)
+        self.seq = 0
+        self.condition = Condition()
+        # The event loops and asyncio events of the streams in asgi.py waiting for events
+        self.waiters = set()
+
+    def before_commit(self, session, events):
+        pass
+
+    def after_commit(self, events):
+        # Events are only published once the change they describe is committed
+        for order_event in events:
+            self.publish(order_event)
+
+    def publish(self, order_event):
+        with self.condition:
+            self.seq += 1
+            self.events.append((self.seq, order_event))
+            self.condition.notify_all()
+            waiters = list(self.waiters)
+        # publish runs in the request thread or the listening thread, so the async streams are woken on their own loop
+        for loop, wake in waiters:
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                # The loop has been closed (e.g. the server is shutting down)
+                pass
+
+    def resume(self, last_event_id):
+        # Returns the seq to stream from and whether the client missed events that are no longer kept
+        with self.condition:
+            if last_event_id is None:
+                return self.seq, False
+            for seq, order_event in self.events:
+                if order_event['id'] == last_event_id:
+                    return seq, False
+            return self.seq, True
+
+    def events_after(self, after):
+        # The (seq, event) pairs after the seq, found with a binary search as the events are kept in seq order,
+        # then read from the newest end so only the new events are gone through
+        index = bisect_right(self.events, after, key = lambda item: item[0])
+        return list(islice(reversed(self.events), len(self.events) - index))[::-1]
+
+    def wait(self, after, timeout):
+        # Returns the (seq, event) pairs after the seq, waiting up to timeout seconds for one
+        with self.condition:
+            if self.seq <= after:
+                self.condition.wait(timeout)
+            return self.events_after(after)
+
+    async def wait_async(self, after, timeout):
+        # Same as wait for the streams served in async mode, waits on the event loop instead of holding a thread
+        wake = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), wake)
+        with self.condition:
+            if self.seq > after:
+                return self.events_after(after)
+            self.waiters.add(waiter)
+        try:
+            await asyncio.wait_for(wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.condition:
+                self.waiters.discard(waiter)
+        with self.condition:
+            return self.events_after(after)
+
+    def start(self):
+        pass
+
+
+class PostgresBroker(MemoryBroker):
+    # Sends the events with NOTIFY as part of the transaction making the change, postgres delivers them on commit
+    # to every worker LISTENing, in commit order, so each worker keeps the same events in the same order
+    def __init__(self, size, url):
+        super().__init__(size)
+        # psycopg2 takes the url without the sqlalchemy driver name
+        self.dsn = url.replace('postgresql+psycopg2://', 'postgresql://')
+        self.thread = None
+        self._lock = Lock()
+
+    def before_commit(self, session, events):
+        for order_event in events:
+            payload = json.dumps(order_event, default = str)
+            if len(payload) > MAX_PAYLOAD:
+                payload = json.dumps(dict(order_event, order = {'id': order_event['order']['id']}), default = str)
+            session.execute(func.pg_notify(CHANNEL, payload).select())
+
+    def after_commit(self, events):
+        pass
+
+    def start(self):
+        # The listening thread is started by the first stream so each web server worker process starts its own
+        with self._lock:
+            if self.thread is None:
+                self.thread = Thread(target = self.listen, daemon = True, name = 'order-events')
+                self.thread.start()
+
+    def listen(self):
+        import psycopg2
+        while True:
+            try:
+                connection = psycopg2.connect(self.dsn)
+                connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                connection.cursor().execute(f'LISTEN {CHANNEL}')
+                # Events sent while the connection was down are lost, so clients are told to read their orders again
+                self.publish({'id': uuid.uuid4().hex, 'type': 'reset'})
+                while True:
+                    if select.select([connection], [], [], 30) != ([], [], []):
+                        connection.poll()
+                        while connection.notifies:
+                            self.publish(json.loads(connection.notifies.pop(0).payload))
+            except psycopg2.Error:
+                logger.exception('Lost the order events connection, reconnecting')
+                time.sleep(1)
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        url = ORDER_EVENTS_DATABASE_URL or os.environ.get('DATABASE_URL', '')
+        backend = ORDER_EVENTS_BACKEND or ('postgres' if url.startswith('postgresql') else 'memory')
+        _broker = PostgresBroker(ORDER_EVENTS_BUFFER, url) if backend == 'postgres' else MemoryBroker(ORDER_EVENTS_BUFFER)
+    return _broker
+
+
+def queue_order_event(session, kind, order_data):
+    # Queues an event for an order that was created, updated or deleted, sent when the session commits
+    # order_data is the orders dump, admins get every event and users only the events of their own orders
+    session.info.setdefault('order_events', []).append({
+        'id': uuid.uuid4().hex,
+        'type': kind,
+        'user_id': order_data['user_id'],
+        'order': order_data,
+    })
+
+
+@event.listens_for(Session, 'before_commit')
+def send_order_events(session):
+    if session.info.get('order_events'):
+        get_broker().before_commit(session, session.info['order_events'])
+
+
+@event.listens_for(Session, 'after_commit')
+def publish_order_events(session):
+    events = session.info.pop('order_events', None)
+    if events:
+        get_broker().after_commit(events)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_order_events(session):
+    session.info.pop('order_events', None)
@@ -0,0 +1,96 @@
+from init import db
+from flask import request
+from marshmallow.exceptions import ValidationError
+from utils.loading import load_options
+
+
+# Number of rows returned when the request does not ask for a limit
+DEFAULT_LIMIT = 20
+# Largest page a client can ask for so a single request can never pull a whole table
+MAX_LIMIT = 100
+
+
+def page_args(schema, args = None):
+    # Reads the limit, after and fields arguments from the query string of the request (or the args parsed in)
+    # limit is how many rows to return, after is the id of the last row the client has already seen
+    args = request.args if args is None else args
+    try:
+        limit = int(args.get('limit', DEFAULT_LIMIT))
+        after = int(args.get('after', 0))
+    except ValueError:
+        raise ValidationError('limit and after need to be entered as whole numbers.')
+    if limit < 1 or limit > MAX_LIMIT:
+        raise ValidationError(f'limit must be between 1 and {MAX_LIMIT}.')
+    # fields is a comma separated list of the schema fields the client wants back, e.g. fields=id,name
+    fields = None
+    if args.get('fields'):
+        fields = [field.strip() for field in args.get('fields').split(',') if field.strip()]
+        # Only fields the schema would normally return can be asked for
+        unknown = [field for field in fields if field not in schema.fields]
+        if unknown:
+            raise ValidationError(f'Unknown fields requested: {", ".join(unknown)}.')
+    return limit, after, fields
+
+
+def page_query(model, limit, after, fields, criteria = (), graph = None, descending = False):
+    # Builds the query for one page, returns it with whether only some columns are selected
+    # descending lists the newest rows (highest ids) first
+    columns = model.__table__.columns.keys()
+    # If every field asked for is a column then only those columns are selected from the database,
+    # the id is always selected so the next cursor can be worked out
+    projected = bool(fields) and all(field in columns for field in fields)
+    if projected:
+        selected = [model.id] + [getattr(model, field) for field in fields if field != 'id']
+        qry = db.select(*selected)
+    else:
+        # Eager loads the relationships the schema will dump for the whole page instead of one row at a time
+        qry = db.select(model).options(*load_options(graph or {}, fields))
+    # Keyset pagination, only rows with an id greater than the cursor are read (or less than it when descending)
+    # one extra row is fetched to find out if there is another page after this one
+    if descending:
+        qry = qry.where(*([model.id < after] if after else []), *criteria).order_by(model.id.desc())
+    else:
+        qry = qry.where(model.id > after, *criteria).order_by(model.id)
+    return qry.limit(limit + 1), projected
+
+
+def page_result(rows, ids, schema, limit, fields):
+    # The next cursor is the id of the last row on this page, or None if this is the last page
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = ids[limit - 1]
+    # Dumps the rows through the schema, restricted to the requested fields if there were any
+    page_schema = type(schema)(many = True, only = fields) if fields else schema
+    return {'data': page_schema.dump(rows), 'next_cursor': next_cursor}
+
+
+def read_page(qry, projected):
+    # Runs the query of a page, returns the rows and their ids
+    if projected:
+        rows = [row._asdict() for row in db.session.execute(qry)]
+        return rows, [row['id'] for row in rows]
+    rows = db.session.scalars(qry).all()
+    return rows, [row.id for row in rows]
+
+
+def merge_pages(*pages):
+    # Merges the (rows, ids) read from more than one table, each ordered by id, into one list ordered by id
+    merged = sorted((pair for rows, ids in pages for pair in zip(ids, rows)), key = lambda pair: pair[0])
+    return [row for id, row in merged], [id for id, row in merged]
+
+
+def paginate(model, schema, *criteria, graph = None, archive = None, descending = False):
+    # Returns one page of rows from the models table ordered by id, starting after the cursor in the request
+    # any criteria parsed in (e.g. Order.user_id == user_id) are added to the where clause of the query
+    # graph is the relationship graph from utils.loading that the schema will walk when dumping the page
+    # archive is (model, criteria) of a table holding older rows with the same fields (e.g. archived orders),
+    # a page is read from it with the same cursor and merged in by id
+    limit, after, fields = page_args(schema)
+    qry, projected = page_query(model, limit, after, fields, criteria, graph, descending)
+    rows, ids = read_page(qry, projected)
+    if archive is not None:
+        archive_model, archive_criteria = archive
+        qry, projected = page_query(archive_model, limit, after, fields, archive_criteria, graph)
+        rows, ids = merge_pages((rows, ids), read_page(qry, projected))
+    return page_result(rows, ids, schema, limit, fields)
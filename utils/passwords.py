@@ -0,0 +1,105 @@
+import os
+import time
+import bcrypt
+from threading import BoundedSemaphore, Lock
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from utils.metrics import Counter, Histogram
+from utils.instrumentation import add_timing
+
+
+# Number of processes hashing passwords, defaults to one per core, 0 hashes on the request worker instead
+PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', os.cpu_count() or 1))
+# Most hashing jobs that can be running or waiting at once before new requests are turned away with a 503
+PASSWORD_QUEUE_LIMIT = int(os.environ.get('PASSWORD_QUEUE_LIMIT', PASSWORD_WORKERS * 4 or 1))
+
+hash_wait = Histogram('password_hash_queue_wait_seconds', 'Time password hashing jobs waited for a worker process', labels = ('operation',))
+hash_time = Histogram('password_hash_seconds', 'Time spent hashing or checking a password with bcrypt', labels = ('operation',))
+hash_rejected = Counter('password_hash_rejected_total', 'Password hashing jobs turned away because the queue was full')
+
+_executor = None
+_executor_lock = Lock()
+_slots = BoundedSemaphore(PASSWORD_QUEUE_LIMIT)
+
+
+class HashingBusy(Exception):
+    # Raised when the password hashing queue is full, returned to the user as a 503
+    pass
+
+
+def _run_hash(password, rounds):
+    # Runs in a worker process, returns the hash with when the job started and how long it took
+    started = time.time()
+    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+    return hashed, started, time.time() - started
+
+
+def _run_check(pw_hash, password):
+    # Runs in a worker process, returns whether the password matches with when the job started and how long it took
+    started = time.time()
+    matches = bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+    return matches, started, time.time() - started
+
+
+def get_executor():
+    # The pool is created on first use so each web server worker process gets its own after forking
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers = PASSWORD_WORKERS)
+    return _executor
+
+
+def _submit(operation, func, *args):
+    submitted = time.time()
+    if PASSWORD_WORKERS == 0:
+        result, started, seconds = func(*args)
+    else:
+        # If every slot is taken the request is turned away straight away instead of waiting behind the queue
+        if not _slots.acquire(blocking = False):
+            hash_rejected.inc()
+            raise HashingBusy()
+        try:
+            result, started, seconds = get_executor().submit(func, *args).result()
+        finally:
+            _slots.release()
+    hash_wait.observe(max(started - submitted, 0), operation = operation)
+    hash_time.observe(seconds, operation = operation)
+    # bcrypt time is shown separately in the access log of the request
+    add_timing('bcrypt', seconds)
+    return result
+
+
+def log_rounds():
+    # The bcrypt cost factor set by BCRYPT_LOG_ROUNDS in create_app
+    return current_app.config['BCRYPT_LOG_ROUNDS']
+
+
+def hash_password(password):
+    # Hashes the users password to be stored in the database as a hash
+    return _submit('hash', _run_hash, password, log_rounds())
+
+
+def hash_passwords(executor, passwords, rounds):
+    # Hashes a batch of passwords outside of a request (e.g. flask db import) spread over the executors processes,
+    # returns the hashes in the same order, without an executor they are hashed one after the other
+    if executor is None:
+        return [_run_hash(password, rounds)[0] for password in passwords]
+    # Each process is sent 16 passwords at a time so the overhead of passing them over is small next to bcrypt
+    results = executor.map(_run_hash, passwords, [rounds] * len(passwords), chunksize = 16)
+    return [hashed for hashed, started, seconds in results]
+
+
+def check_password(pw_hash, password):
+    # Checks a password entered against the hash stored in the database
+    return _submit('check', _run_check, pw_hash, password)
+
+
+def needs_rehash(pw_hash):
+    # A bcrypt hash looks like $2b$12$..., where 12 is the cost it was hashed with
+    # passwords hashed with a different cost to the current setting are hashed again when the user logs in
+    try:
+        return int(pw_hash.split('$')[2]) != log_rounds()
+    except (IndexError, ValueError):
+        return True
@@ -0,0 +1,86 @@
+import os
+import time
+import weakref
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool, NullPool
+from utils.metrics import Gauge, Histogram
+
+
+pool_wait = Histogram('db_pool_checkout_wait_seconds', 'Time spent waiting to check a connection out of the pool')
+
+# Every pool in use, so their utilisation can be reported (engine.dispose() replaces its pool with a new one)
+_pools = weakref.WeakSet()
+
+# When the checkout being made in this thread started waiting for a connection
+checkout_started = ContextVar('checkout_started', default = None)
+
+
+def end_wait():
+    # Records how long the checkout waited, only the first time it is called for each checkout
+    started = checkout_started.get()
+    if started is not None:
+        pool_wait.observe(time.perf_counter() - started)
+        checkout_started.set(None)
+
+
+@event.listens_for(Engine, 'do_connect')
+def connecting(dialect, connection_record, cargs, cparams):
+    # The pool is about to open a new connection, so the wait for a free one is over
+    # (the time taken to connect to the database isnt counted as waiting)
+    end_wait()
+
+
+class TimedQueuePool(QueuePool):
+    # The default SQLAlchemy pool, timing how long each checkout waits for a free connection
+    def __init__(self, creator, pool_size = 5, max_overflow = 10, **kwargs):
+        super().__init__(creator, pool_size = pool_size, max_overflow = max_overflow, **kwargs)
+        # Kept for pool_utilisation, the pool itself only reports how many overflow connections are open now
+        self.max_overflow = max_overflow
+        # A connection already open has been handed out when checkout runs (after its pre-ping if that is turned on)
+        event.listen(self, 'checkout', lambda dbapi_connection, connection_record, connection_proxy: end_wait())
+        _pools.add(self)
+
+    def connect(self):
+        checkout_started.set(time.perf_counter())
+        try:
+            return super().connect()
+        finally:
+            # A checkout that timed out or failed to connect is recorded here
+            end_wait()
+
+
+def pool_utilisation():
+    # Connections checked out as a fraction of the most the pools can hand out (pool size + overflow)
+    capacity = sum(pool.size() + max(pool.max_overflow, 0) for pool in _pools)
+    checked_out = sum(pool.checkedout() for pool in _pools)
+    return round(checked_out / capacity, 3) if capacity else 0
+
+Gauge('db_pool_checked_out', 'Connections currently checked out of the pool', lambda: sum(pool.checkedout() for pool in _pools))
+Gauge('db_pool_utilisation', 'Checked out connections as a fraction of pool size + overflow', pool_utilisation)
+
+
+def env_flag(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options():
+    # Builds the SQLALCHEMY_ENGINE_OPTIONS for create_app from the environment
+    # DB_POOL_MODE=pgbouncer opens a new connection for each checkout and closes it afterwards (NullPool),
+    # so PgBouncer in transaction pooling mode does the pooling instead of every web server worker holding its own pool
+    if os.environ.get('DB_POOL_MODE', 'queue') == 'pgbouncer':
+        return {'poolclass': NullPool}
+    # Otherwise each worker process keeps its own pool, so the database needs
+    # (web server workers) x (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections available at most
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        # Seconds to wait for a free connection before giving up
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        # Connections older than this many seconds are replaced, so connections to a failed over database dont linger
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        # Checks a connection is still alive before it is used
+        'pool_pre_ping': env_flag('DB_POOL_PRE_PING', True),
+    }
@@ -0,0 +1,123 @@
+from collections import Counter, defaultdict
+from sqlalchemy import event, func, insert, inspect, select, update, delete, union_all
+from sqlalchemy.orm import Session
+from models.product import Product
+from models.product_stats import ProductStats
+from models.order import Order, ArchivedOrder
+from models.comment import Comment
+
+
+# The product_stats column counting the orders with each status
+STATUS_COLUMNS = {'In-queue': 'in_queue', 'Preparing': 'preparing', 'Completed': 'completed'}
+
+
+def current(obj, name):
+    return getattr(obj, name)
+
+
+def committed(obj, name):
+    # The value the row had in the database before this flush changed it
+    history = inspect(obj).attrs[name].history
+    values = history.deleted or history.unchanged
+    return values[0] if values else getattr(obj, name)
+
+
+def counts(obj, value):
+    # The product an order or comment belongs to and what it adds to that products stats,
+    # value reads either the current or the previously committed values of the object
+    if isinstance(obj, Order):
+        added = Counter(units = int(value(obj, 'quantity') or 0))
+        column = STATUS_COLUMNS.get(value(obj, 'status'))
+        if column:
+            added[column] = 1
+        return value(obj, 'product_id'), added
+    return value(obj, 'product_id'), Counter(comment_count = 1)
+
+
+def add_counts(changes, obj, value, sign):
+    product_id, added = counts(obj, value)
+    for column, amount in added.items():
+        changes[product_id][column] += sign * amount
+
+
+def apply_counts(session, changes):
+    # Adds the changes to each products row with an UPDATE ... SET column = column + change,
+    # which the database applies atomically so concurrent orders dont overwrite each others counts
+    table = ProductStats.__table__
+    for product_id, columns in changes.items():
+        columns = {column: amount for column, amount in columns.items() if amount}
+        if product_id is not None and columns:
+            values = {column: table.c[column] + amount for column, amount in columns.items()}
+            session.connection().execute(update(table).where(table.c.product_id == product_id).values(values))
+
+
+def count_inserted(session, objs):
+    # Orders or comments inserted with an INSERT statement instead of session.add are added to the stats here
+    changes = defaultdict(Counter)
+    for obj in objs:
+        add_counts(changes, obj, current, 1)
+    apply_counts(session, changes)
+
+
+def count_updated(session, order, product_id, status):
+    # An order changed with an UPDATE statement instead of through the session is taken away from the stats
+    # of the product and status it had before (product_id and status) and added back as it is now
+    changes = defaultdict(Counter)
+    changes[product_id]['units'] -= int(order.quantity or 0)
+    if status in STATUS_COLUMNS:
+        changes[product_id][STATUS_COLUMNS[status]] -= 1
+    add_counts(changes, order, current, 1)
+    apply_counts(session, changes)
+
+
+def refresh_product_stats(session):
+    # Rebuilds every products stats from the orders and comments tables, e.g. after bulk loading rows
+    # archived orders are counted too as the stats cover every order a product has had
+    every_order = union_all(
+        select(Order.product_id, Order.status, Order.quantity),
+        select(ArchivedOrder.product_id, ArchivedOrder.status, ArchivedOrder.quantity)
+    ).subquery()
+    orders = select(
+        every_order.c.product_id,
+        *(func.count().filter(every_order.c.status == status).label(column) for status, column in STATUS_COLUMNS.items()),
+        func.coalesce(func.sum(every_order.c.quantity), 0).label('units')
+    ).group_by(every_order.c.product_id).subquery()
+    comments = select(Comment.product_id, func.count().label('comment_count')).group_by(Comment.product_id).subquery()
+    columns = list(STATUS_COLUMNS.values()) + ['units']
+    qry = select(
+        Product.id,
+        *(func.coalesce(orders.c[column], 0) for column in columns),
+        func.coalesce(comments.c.comment_count, 0)
+    ).outerjoin(orders, orders.c.product_id == Product.id).outerjoin(comments, comments.c.product_id == Product.id)
+    session.execute(delete(ProductStats))
+    session.execute(insert(ProductStats).from_select(['product_id'] + columns + ['comment_count'], qry))
+
+
+@event.listens_for(Session, 'before_flush')
+def create_stats_rows(session, flush_context, instances):
+    # Every new product starts with a row of zeros
+    for obj in session.new:
+        if isinstance(obj, Product) and obj.stats is None:
+            obj.stats = ProductStats(in_queue = 0, preparing = 0, completed = 0, units = 0, comment_count = 0)
+
+
+@event.listens_for(Session, 'after_flush')
+def update_stats(session, flush_context):
+    # Works out how the orders and comments added, changed and deleted in this flush change each products stats
+    changes = defaultdict(Counter)
+    for obj in session.new:
+        if isinstance(obj, (Order, Comment)):
+            add_counts(changes, obj, current, 1)
+    for obj in session.deleted:
+        if isinstance(obj, (Order, Comment)):
+            add_counts(changes, obj, committed, -1)
+    for obj in session.dirty:
+        # A changed order is taken away from the stats as it was and added back as it is now
+        if isinstance(obj, (Order, Comment)) and session.is_modified(obj):
+            add_counts(changes, obj, committed, -1)
+            add_counts(changes, obj, current, 1)
+    # The stats row of a deleted product is deleted with it
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            changes.pop(obj.id, None)
+    apply_counts(session, changes)
@@ -0,0 +1,171 @@
+import os
+import math
+import time
+from threading import Lock
+from flask import current_app, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from utils.metrics import Counter
+from utils.ttl_cache import TTLCache
+
+
+# Requests allowed per period for each blueprint (e.g. auth) or route (e.g. auth.auth_login), the most specific one is used
+# RATE_LIMITS in the environment adds to or overrides these, e.g. RATE_LIMITS=auth.auth_login=10/minute,orders=300/minute
+DEFAULT_RATE_LIMITS = {
+    'auth': '30/minute',
+    'auth.auth_login': '5/minute',
+    'orders': '120/minute',
+    'orders.create_orders_bulk': '10/minute',
+    'products.comments': '30/minute',
+    'products.comments.get_comments': '300/minute',
+}
+# Blueprints used before logging in are limited per IP address, everything else per user (or per IP without a web token)
+IP_BLUEPRINTS = {'auth'}
+# Empty to keep the token buckets in this process, or a redis:// url to share them between workers
+RATE_LIMIT_URL = os.environ.get('RATE_LIMIT_URL', '')
+# Most clients the in-process store keeps buckets for
+RATE_LIMIT_SIZE = int(os.environ.get('RATE_LIMIT_SIZE', 100000))
+# Seconds in each period a limit can be given in
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+rate_limited = Counter('rate_limited_total', 'Requests rejected with 429 by the rate limiter', labels = ('route',))
+
+
+def parse_limit(limit):
+    # '5/minute' is a bucket of 5 tokens that refills 5 tokens every 60 seconds, returns (5, 60)
+    count, period = limit.split('/')
+    return int(count), PERIODS[period.strip().rstrip('s')]
+
+
+def parse_limits(text):
+    limits = {}
+    for item in text.split(','):
+        if item.strip():
+            name, limit = item.split('=')
+            limits[name.strip()] = parse_limit(limit)
+    return limits
+
+
+RATE_LIMITS = {name: parse_limit(limit) for name, limit in DEFAULT_RATE_LIMITS.items()}
+RATE_LIMITS.update(parse_limits(os.environ.get('RATE_LIMITS', '')))
+
+
+class MemoryStore:
+    # Token buckets kept in this process, each worker limits the requests it handles on its own
+    def __init__(self, maxsize):
+        self.buckets = TTLCache(maxsize = maxsize, ttl = 0)
+        self._lock = Lock()
+
+    def take(self, key, capacity, period):
+        # Takes a token from the bucket, returns 0 if there was one or the seconds until there will be
+        now = time.monotonic()
+        rate = capacity / period
+        with self._lock:
+            tokens, updated = self.buckets.get(key) or (capacity, now)
+            # Tokens drip back into the bucket at the rate of the limit, up to its capacity
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self.buckets.set(key, (tokens - 1, now), ttl = period)
+                return 0
+            self.buckets.set(key, (tokens, now), ttl = period)
+            return (1 - tokens) / rate
+
+
+# The same token bucket run inside Redis so the check and update happen atomically for every worker
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local rate = capacity / period
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(period))
+return tostring(wait)
+"""
+
+
+class RedisStore:
+    # Token buckets kept in Redis (or anything that speaks its protocol) so the limits apply across every worker
+    def __init__(self, url):
+        # redis is an optional dependency only needed when RATE_LIMIT_URL is set
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.take_script = self.client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, capacity, period):
+        return float(self.take_script(keys = [key], args = [capacity, period, time.time()]))
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = RedisStore(RATE_LIMIT_URL) if RATE_LIMIT_URL else MemoryStore(RATE_LIMIT_SIZE)
+    return _store
+
+
+def find_limit(endpoint):
+    # The limit of the route if it has one, otherwise of its blueprint (or the blueprint it is nested in)
+    name = endpoint
+    while name:
+        if name in RATE_LIMITS:
+            return name, RATE_LIMITS[name]
+        name = name.rpartition('.')[0]
+    return None, None
+
+
+def forwarded_address(forwarded_for, remote_addr, trusted_proxies):
+    # The clients address the same way werkzeug's ProxyFix works it out for the Flask app, the entry of X-Forwarded-For
+    # added by the furthest of the trusted proxies, or the address that connected if the header doesnt have that many
+    if trusted_proxies and forwarded_for:
+        addresses = [address.strip() for address in forwarded_for.split(',')]
+        if len(addresses) >= trusted_proxies:
+            return addresses[-trusted_proxies]
+    return remote_addr
+
+
+def client_key(scope):
+    # Who a request is counted against, the IP address for the auth routes, otherwise the user in the web token
+    if scope.split('.')[0] not in IP_BLUEPRINTS:
+        # An invalid or expired web token is rejected here the same way @jwt_required() would reject it
+        verify_jwt_in_request(optional = True)
+        identity = get_jwt_identity()
+        if identity is not None:
+            return f'user:{identity}'
+    # Behind TRUSTED_PROXIES proxies create_app sets remote_addr to the address they forwarded (ProxyFix)
+    return f'ip:{request.remote_addr}'
+
+
+def take_token(scope, limit, client):
+    # Returns the 429 response if the client has used up the limit, otherwise None so the request is handled,
+    # used by the Flask app and the async routes in asgi.py so both count against the same buckets
+    wait = get_store().take(f'ratelimit:{scope}:{client}', *limit)
+    if wait > 0:
+        rate_limited.inc(route = scope)
+        retry_after = math.ceil(wait)
+        return {'error': f'Too many requests, please try again in {retry_after} seconds.'}, 429, {'Retry-After': str(retry_after)}
+    return None
+
+
+def check_rate_limit():
+    if not current_app.config['RATE_LIMIT_ENABLED'] or request.endpoint is None:
+        return None
+    scope, limit = find_limit(request.endpoint)
+    if limit is None:
+        return None
+    return take_token(scope, limit, client_key(scope))
+
+
+def init_rate_limiting(app):
+    # Every request is checked against its limit before it is handled
+    app.before_request(check_rate_limit)
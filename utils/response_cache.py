@@ -0,0 +1,150 @@
+import os
+import time
+import hashlib
+from functools import wraps
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from utils.ttl_cache import TTLCache
+from utils.routing import REPLICA_STICKY_SECONDS, read_from_primary
+
+
+# Where cached responses are kept, empty for an in-process LRU or a redis:// url to share the cache between workers
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL', '')
+# How long a cached response is kept in seconds and how many the in-process cache holds
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 60))
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 512))
+
+
+class LRUBackend:
+    # Keeps responses in this process only, other workers find out about changes when their entries expire
+    def __init__(self, maxsize, ttl):
+        self.entries = TTLCache(maxsize = maxsize, ttl = ttl)
+        self.version = 0
+        self.changed_at = 0
+
+    def get_version(self):
+        return self.version
+
+    def get_state(self):
+        # The version and the time it was last bumped
+        return self.version, self.changed_at
+
+    def bump_version(self):
+        self.version += 1
+        self.changed_at = time.time()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, etag, body):
+        self.entries.set(key, (etag, body))
+
+
+class RedisBackend:
+    # Keeps responses in Redis (or anything that speaks its protocol) so every worker shares them
+    def __init__(self, url, ttl):
+        # redis is an optional dependency only needed when RESPONSE_CACHE_URL is set
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get_version(self):
+        return int(self.client.get('catalogue:version') or 0)
+
+    def get_state(self):
+        version, changed_at = self.client.mget('catalogue:version', 'catalogue:changed_at')
+        return int(version or 0), float(changed_at or 0)
+
+    def bump_version(self):
+        pipeline = self.client.pipeline()
+        pipeline.incr('catalogue:version')
+        pipeline.set('catalogue:changed_at', time.time())
+        pipeline.execute()
+
+    def get(self, key):
+        value = self.client.get(key)
+        if value is None:
+            return None
+        # Entries are stored as the etag then a new line then the response body
+        etag, body = value.split(b'\n', 1)
+        return etag.decode('utf-8'), body
+
+    def set(self, key, etag, body):
+        self.client.set(key, etag.encode('utf-8') + b'\n' + body, ex = self.ttl)
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if RESPONSE_CACHE_URL:
+            _backend = RedisBackend(RESPONSE_CACHE_URL, RESPONSE_CACHE_TTL)
+        else:
+            _backend = LRUBackend(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+    return _backend
+
+
+def invalidate_catalogue():
+    # Every cached catalogue response includes the version in its key, so bumping it makes them all miss
+    get_backend().bump_version()
+
+
+def response_entry(body):
+    # The strong ETag and body kept for a cached response
+    return hashlib.sha256(body).hexdigest(), body
+
+
+def cached_response(view):
+    # Caches the JSON response of a public GET endpoint, keyed by its path and query string,
+    # and gives it a strong ETag so clients sending If-None-Match get a 304 without a query or serialization
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        backend = get_backend()
+        version, changed_at = backend.get_state()
+        key = f'catalogue:{version}:{request.full_path}'
+        entry = backend.get(key)
+        if entry is None:
+            # Just after a change a read replica might not have it yet, so the response is read from the primary
+            # instead of caching an old copy under the new version for every worker
+            if time.time() - changed_at < REPLICA_STICKY_SECONDS:
+                read_from_primary()
+            response = current_app.make_response(view(*args, **kwargs))
+            # Only successful responses are cached, errors such as a 404 are returned as they are
+            if response.status_code != 200:
+                return response
+            entry = response_entry(response.get_data())
+            backend.set(key, *entry)
+        etag, body = entry
+        response = current_app.response_class(body, mimetype = 'application/json')
+        response.set_etag(etag)
+        # Turns the response into a 304 Not Modified if the etag matches the If-None-Match header
+        return response.make_conditional(request)
+    return wrapper
+
+
+# The models whose changes show up in the catalogue responses, products nest their comments and orders
+CATALOGUE_TABLES = {'products', 'comments', 'orders'}
+
+
+@event.listens_for(Session, 'after_flush')
+def record_catalogue_changes(session, flush_context):
+    # Remembers if anything in the catalogue was added, changed or deleted in this transaction
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if getattr(obj, '__tablename__', None) in CATALOGUE_TABLES:
+            session.info['catalogue_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_after_commit(session):
+    # Once the changes are committed the cached catalogue responses are thrown away
+    if session.info.pop('catalogue_changed', False):
+        invalidate_catalogue()
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_rolled_back_changes(session):
+    session.info.pop('catalogue_changed', None)
@@ -0,0 +1,203 @@
+import os
+import time
+import itertools
+from functools import wraps
+from threading import Lock
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+from utils.pool import engine_options
+from utils.ttl_cache import TTLCache
+
+
+# Comma separated urls of read replicas of DATABASE_URL, reads stay on the primary if there are none
+REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+# Seconds between health checks of each replica, and seconds a replica that failed is left out before being checked again
+REPLICA_CHECK_INTERVAL = int(os.environ.get('REPLICA_CHECK_INTERVAL', 10))
+# Seconds after a user writes that their reads stay on the primary, so they see their own changes despite replica lag
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+# Empty to remember the users that just wrote in each worker, or a redis:// url so every worker keeps their reads on the primary
+REPLICA_STICKY_URL = os.environ.get('REPLICA_STICKY_URL', '')
+# Seconds to wait for a connection to a replica, so one that is down fails quickly instead of holding up the request
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('REPLICA_CONNECT_TIMEOUT', 2))
+
+
+def replica_engine_options(url):
+    options = engine_options()
+    if url.startswith('postgresql'):
+        options['connect_args'] = {'connect_timeout': REPLICA_CONNECT_TIMEOUT}
+    return options
+
+
+class Replica:
+    def __init__(self, url):
+        self.engine = create_engine(url, **replica_engine_options(url))
+        self.healthy = True
+        self.checked_at = 0
+
+    def failed(self):
+        # A replica that couldnt be used is left out until its next health check
+        self.healthy = False
+        self.checked_at = time.monotonic()
+
+    def is_healthy(self):
+        # Runs a SELECT 1 on the replica at most every REPLICA_CHECK_INTERVAL seconds
+        if time.monotonic() - self.checked_at >= REPLICA_CHECK_INTERVAL:
+            self.checked_at = time.monotonic()
+            try:
+                with self.engine.connect() as connection:
+                    connection.execute(text('SELECT 1'))
+                self.healthy = True
+            except SQLAlchemyError:
+                self.failed()
+        return self.healthy
+
+
+class ReplicaSet:
+    # Hands out the replicas in turn (round robin), skipping any that failed their last health check
+    def __init__(self, urls):
+        self.urls = urls
+        self.replicas = None
+        self._lock = Lock()
+
+    def pick(self):
+        # The engines are created on first use so each web server worker process gets its own after forking
+        if self.replicas is None:
+            with self._lock:
+                if self.replicas is None:
+                    self.replicas = [Replica(url) for url in self.urls]
+                    self._turns = itertools.cycle(self.replicas)
+        for i in range(len(self.replicas)):
+            with self._lock:
+                replica = next(self._turns)
+            if replica.is_healthy():
+                return replica
+        return None
+
+
+class RedisWriters:
+    # The users that just wrote kept in Redis (same get and set as TTLCache) so the workers share them
+    def __init__(self, url, ttl):
+        # redis is an optional dependency only needed when REPLICA_STICKY_URL is set
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, user_id):
+        return self.client.get(f'replica:writer:{user_id}')
+
+    def set(self, user_id, value):
+        self.client.set(f'replica:writer:{user_id}', 1, ex = self.ttl)
+
+
+replicas = ReplicaSet(REPLICA_URLS)
+# Users that wrote something in the last REPLICA_STICKY_SECONDS, keyed by user id
+if REPLICA_STICKY_URL:
+    recent_writers = RedisWriters(REPLICA_STICKY_URL, REPLICA_STICKY_SECONDS)
+else:
+    recent_writers = TTLCache(maxsize = 10000, ttl = REPLICA_STICKY_SECONDS)
+
+
+def read_only(view):
+    # Marks a handler as only reading from the database so its queries can be sent to a read replica
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def jwt_user():
+    # The user id in the web token of the request, public handlers dont check the token so it is checked here,
+    # a missing or invalid token on a public handler is the same as an anonymous request
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        pass
+    try:
+        verify_jwt_in_request(optional = True)
+        return get_jwt_identity()
+    except (JWTExtendedException, PyJWTError):
+        return None
+
+
+def read_from_primary():
+    # Keeps the rest of the request on the primary, e.g. to fill the response cache just after a change
+    # that the replicas might not have yet
+    g.primary_only = True
+
+
+def request_replica():
+    # The replica picked for this request, every read of the request goes to the same one so they all see the same data
+    # None once there is no healthy replica (or the one picked failed) and the reads go to the primary
+    if 'replica' not in g:
+        g.replica = replicas.pick()
+    return g.replica
+
+
+def use_replica(session):
+    # Only handlers marked read_only go to a replica, and never once the session has written something
+    # or if the user has just written something the replica might not have yet
+    if not replicas.urls or not has_request_context() or not g.get('read_only') or g.get('primary_only'):
+        return False
+    if session._flushing or session.info.get('wrote'):
+        return False
+    user_id = jwt_user()
+    return user_id is None or recent_writers.get(user_id) is None
+
+
+class RoutingSession(Session):
+    # The database session used by db.session, sends the queries of read only handlers to a replica
+    def get_bind(self, mapper = None, clause = None, bind = None, **kwargs):
+        if bind is None and use_replica(self):
+            replica = request_replica()
+            if replica is not None:
+                return replica.engine
+        return super().get_bind(mapper = mapper, clause = clause, bind = bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def record_write(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def record_statement_write(orm_execute_state):
+    # INSERT, UPDATE and DELETE statements run directly on the session (e.g. bulk orders) are writes too
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def fall_back_to_primary(orm_execute_state):
+    # If the replica cant be reached (or cancels the query) it is marked unhealthy and the query is run again on the primary,
+    # the rest of the request reads from the primary too
+    session = orm_execute_state.session
+    if orm_execute_state.bind_arguments.get('bind') is not None or not use_replica(session) or request_replica() is None:
+        return None
+    try:
+        return orm_execute_state.invoke_statement()
+    except OperationalError:
+        g.replica.failed()
+        g.replica = None
+        # The session hasnt written anything (or it wouldnt be reading from a replica) so only the failed read is thrown away
+        session.rollback()
+        return orm_execute_state.invoke_statement()
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def remember_writer(session):
+    # After a user commits a change their reads stay on the primary for a few seconds
+    if session.info.pop('wrote', False) and has_request_context() and REPLICA_STICKY_SECONDS:
+        user_id = jwt_user()
+        if user_id is not None:
+            recent_writers.set(user_id, True)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_write(session):
+    session.info.pop('wrote', None)
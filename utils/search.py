@@ -0,0 +1,139 @@
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from threading import Lock
+from marshmallow import Schema, fields, EXCLUDE
+from marshmallow.validate import OneOf, Range
+from sqlalchemy import and_, case, false, func, literal_column, select, true
+from sqlalchemy.orm import joinedload
+from models.product import Product, SEARCH_CONFIG
+from utils.pagination import MAX_LIMIT, DEFAULT_LIMIT
+from utils.response_cache import get_backend
+
+
+# Price ranges counted in the search facets, (lowest, highest) with highest not included, None for no upper limit
+PRICE_BUCKETS = [(15, 50), (50, 100), (100, 200), (200, None)]
+# Prep days counted in the search facets, products can take at most 5 days to prepare
+PREP_DAYS = range(0, 6)
+# How results can be sorted, relevance is the best match first (or by id if there is no search text)
+SORTS = {
+    'relevance': [],
+    'price': [Product.price.asc()],
+    '-price': [Product.price.desc()],
+    'name': [Product.name.asc()],
+    'prep_days': [Product.prep_days.asc()],
+}
+
+# Most seconds the in-process index is kept before it is rebuilt, so products changed without bumping the catalogue version
+# (e.g. by flask db import or straight in the database) are found within this many seconds
+SEARCH_INDEX_TTL = float(os.environ.get('SEARCH_INDEX_TTL', 60))
+
+# The generated search column on postgres, see models/product.py
+SEARCH_VECTOR = literal_column('products.search_vector')
+
+
+class SearchArgsSchema(Schema):
+    # The query string arguments of GET /products/search, anything else in the query string is ignored
+    q = fields.String()
+    min_price = fields.Float()
+    max_price = fields.Float()
+    max_prep_days = fields.Integer()
+    sort = fields.String(load_default = 'relevance', validate = OneOf(list(SORTS)))
+    limit = fields.Integer(load_default = DEFAULT_LIMIT, validate = Range(min = 1, max = MAX_LIMIT))
+    offset = fields.Integer(load_default = 0, validate = Range(min = 0))
+
+    class Meta:
+        unknown = EXCLUDE
+
+search_args_schema = SearchArgsSchema()
+
+
+def tokenize(text):
+    return re.findall(r'[a-z0-9]+', (text or '').lower())
+
+
+class InvertedIndex:
+    # In-process index of the words in each products name and description, used instead of the search_vector column
+    # on databases other than postgres (e.g. SQLite), it is rebuilt whenever the catalogue version changes
+    # so every worker sees product changes the same way the cached catalogue responses do, and every SEARCH_INDEX_TTL seconds
+    def __init__(self):
+        self.postings = defaultdict(Counter)
+        self.version = None
+        self.built_at = None
+        self._lock = Lock()
+
+    def refresh(self, session):
+        version = get_backend().get_version()
+        if version == self.version and time.monotonic() - self.built_at < SEARCH_INDEX_TTL:
+            return
+        postings = defaultdict(Counter)
+        for product_id, name, description in session.execute(select(Product.id, Product.name, Product.description)):
+            for token in tokenize(name) + tokenize(description):
+                postings[token][product_id] += 1
+        with self._lock:
+            self.postings, self.version, self.built_at = postings, version, time.monotonic()
+
+    def search(self, session, text):
+        # Returns {product id: score} of the products matching every word of the text, a word matches any word
+        # it is the start of (e.g. choc matches chocolate), the score is how many times the words appear
+        self.refresh(session)
+        postings = self.postings
+        scores = None
+        for term in tokenize(text):
+            matches = Counter()
+            for token, counts in postings.items():
+                if token.startswith(term):
+                    matches.update(counts)
+            scores = matches if scores is None else Counter({id: scores[id] + count for id, count in matches.items() if id in scores})
+        return dict(scores or {})
+
+
+index = InvertedIndex()
+
+
+def text_match(session, text):
+    # Returns the condition matching products to the search text and an expression ranking how well they match
+    if not text or not tokenize(text):
+        return true(), None
+    if session.get_bind().dialect.name == 'postgresql':
+        query = func.websearch_to_tsquery(SEARCH_CONFIG, text)
+        return SEARCH_VECTOR.op('@@')(query), func.ts_rank(SEARCH_VECTOR, query)
+    scores = index.search(session, text)
+    if not scores:
+        return false(), None
+    return Product.id.in_(scores), case(scores, value = Product.id, else_ = 0)
+
+
+def search_products(session, args):
+    # Finds one page of products and counts of the matches in each price range and prep days facet,
+    # each facet is counted with every filter except its own so the client can see what changing it would find
+    matched, rank = text_match(session, args.get('q'))
+    price_filter = and_(
+        true(),
+        *([Product.price >= args['min_price']] if 'min_price' in args else []),
+        *([Product.price <= args['max_price']] if 'max_price' in args else [])
+    )
+    prep_filter = Product.prep_days <= args['max_prep_days'] if 'max_prep_days' in args else true()
+
+    # Every count is worked out by one query over the products matching the text
+    buckets = [and_(Product.price >= low, *([Product.price < high] if high else [])) for low, high in PRICE_BUCKETS]
+    counts = select(
+        func.count().filter(and_(price_filter, prep_filter)),
+        *(func.count().filter(and_(prep_filter, bucket)) for bucket in buckets),
+        *(func.count().filter(and_(price_filter, Product.prep_days == days)) for days in PREP_DAYS)
+    ).select_from(Product).where(matched)
+    total, *counts = session.execute(counts).one()
+    facets = {
+        'price': {f'{low}-{high}' if high else f'{low}+': count for (low, high), count in zip(PRICE_BUCKETS, counts)},
+        'prep_days': {str(days): count for days, count in zip(PREP_DAYS, counts[len(PRICE_BUCKETS):])},
+    }
+
+    order = SORTS[args['sort']]
+    if args['sort'] == 'relevance' and rank is not None:
+        order = [rank.desc()]
+    qry = select(Product).options(joinedload(Product.stats)).where(matched, price_filter, prep_filter) \
+        .order_by(*order, Product.id).limit(args['limit']).offset(args['offset'])
+    products = session.scalars(qry).all()
+    next_offset = args['offset'] + args['limit'] if args['offset'] + args['limit'] < total else None
+    return products, total, facets, next_offset
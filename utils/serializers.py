@@ -0,0 +1,126 @@
+import orjson
+from flask.json.provider import DefaultJSONProvider
+from marshmallow import Schema, fields
+
+
+# Value types the fields inferred from Meta.fields dump unchanged, anything else (e.g. dates) goes through infer
+PLAIN_TYPES = {int, float, str, bool}
+# Declared fields that dump a value of the given type unchanged
+PASS_THROUGH = {fields.Integer: int, fields.Float: float, fields.String: str, fields.Boolean: bool}
+# One field per value type, used exactly like marshmallow's Inferred field picks a field for each value
+INFERRED_FIELDS = {value_type: field_class() for value_type, field_class in Schema.TYPE_MAPPING.items()}
+
+
+def infer(value):
+    field = INFERRED_FIELDS.get(type(value))
+    return field._serialize(value, None, None) if field else value
+
+
+class FastSchema(Schema):
+    # Base class of the model schemas, dump uses the function compiled for the schema by compile_schemas if there is one
+    # schemas created while handling a request (e.g. with only = fields) dont have one and dump as normal
+    def dump(self, obj, *, many = None):
+        compiled = self.__dict__.get('compiled_dump')
+        if compiled is not None and many is None:
+            return compiled(obj)
+        return super().dump(obj, many = many)
+
+
+def compile_schemas(*schemas):
+    # Compiles a dump function for each schema instance, called once when the app is imported
+    for schema in schemas:
+        compiled = compile_dump(schema)
+        if compiled is not None:
+            schema.compiled_dump = compiled
+
+
+def compile_dump(schema):
+    # Builds the source of a function that dumps one object the same way the schema does, walking the schemas fields
+    # (Meta.fields, only and exclude already applied) once here instead of on every dump
+    # returns None if the schema uses something the compiler doesnt handle, so it keeps dumping with marshmallow
+    namespace = {'PLAIN_TYPES': PLAIN_TYPES, 'infer': infer}
+    lines = []
+    if not compile_into(schema, namespace, lines, 'dump'):
+        return None
+    exec('\n'.join(lines), namespace)
+    dump_one = namespace['dump']
+    if schema.many:
+        return lambda objs: [dump_one(obj) for obj in objs]
+    return dump_one
+
+
+def compile_into(schema, namespace, lines, name, depth = 0):
+    # pre_dump and post_dump hooks can change the output so those schemas arent compiled
+    if depth > 10 or any(tag[0] in ('pre_dump', 'post_dump') for tag in schema._hooks if schema._hooks[tag]):
+        return False
+    body = [f'def {name}(obj):']
+    keys = []
+    for i, (field_name, field) in enumerate(schema.dump_fields.items()):
+        attribute = field.attribute or field_name
+        if '.' in attribute:
+            return False
+        value = f'v{i}'
+        body.append(f'    {value} = obj.{attribute}')
+        nested = None
+        try:
+            if isinstance(field, fields.Nested):
+                nested, many = field.schema, field.many
+            elif isinstance(field, fields.List) and isinstance(field.inner, fields.Nested) and not field.inner.many:
+                nested, many = field.inner.schema, True
+        # A nested schema that cant be created (e.g. it excludes a field it doesnt have) is left to marshmallow to raise
+        except ValueError:
+            return False
+        if nested is not None:
+            # Nested schemas are compiled into their own function, a list of them is dumped item by item
+            nested_name = f'{name}_{field_name}'
+            if not compile_into(nested, namespace, lines, nested_name, depth + 1):
+                return False
+            if many:
+                expression = f'[{nested_name}(x) if x is not None else None for x in {value}] if {value} is not None else None'
+            else:
+                expression = f'{nested_name}({value}) if {value} is not None else None'
+        elif type(field) is fields.Inferred:
+            expression = f'{value} if {value} is None or type({value}) in PLAIN_TYPES else infer({value})'
+        elif type(field) in PASS_THROUGH or isinstance(field, (fields.Date, fields.DateTime)):
+            # Other declared fields call the fields own _serialize unless the value already has the type it dumps as
+            field_ref = f'{name}_field{i}'
+            namespace[field_ref] = field
+            passed = None if getattr(field, 'as_string', False) else PASS_THROUGH.get(type(field))
+            if passed is not None:
+                namespace[f'{field_ref}_type'] = passed
+                expression = f'{value} if {value} is None or type({value}) is {field_ref}_type else {field_ref}._serialize({value}, {field_name!r}, obj)'
+            else:
+                expression = f'{field_ref}._serialize({value}, {field_name!r}, obj)'
+        else:
+            return False
+        body.append(f'    r{i} = {expression}')
+        keys.append(f'{(field.data_key or field_name)!r}: r{i}')
+    body.append('    return {' + ', '.join(keys) + '}')
+    lines.extend(body)
+    return True
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    # Encodes JSON responses with orjson, which is much faster than the standard library encoder
+    # dates are passed to Flask's default function so they are encoded the same as before
+    options = orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(self, obj, **kwargs):
+        # Anything asking for options orjson doesnt have (e.g. sort_keys) uses the standard encoder
+        if kwargs or self.sort_keys:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default = self.default, option = self.options).decode('utf-8')
+
+    def encode(self, obj):
+        # The body of a JSON response, asgi.py uses it so its responses are the same bytes as the Flask ones
+        options = self.options
+        # Pretty printed in debug mode like Flask does
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            options |= orjson.OPT_INDENT_2
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default = self.default, option = options) + b'\n'
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj), mimetype = self.mimetype)
@@ -0,0 +1,31 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from init import db
+
+
+@contextmanager
+def count_queries():
+    # Counts every SQL statement sent to the database while inside the with block
+    # the statements are stored in a list so the count and the SQL that was run can both be checked afterwards
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@contextmanager
+def assert_max_queries(maximum):
+    # Fails if more than the maximum number of SQL statements are run inside the with block, e.g.
+    #   with assert_max_queries(3):
+    #       client.get('/products/')
+    # so an endpoint that starts lazy loading relationships again is caught
+    with count_queries() as statements:
+        yield statements
+    if len(statements) > maximum:
+        raise AssertionError(f'Expected at most {maximum} SQL statements but {len(statements)} were run:\n' + '\n'.join(statements))
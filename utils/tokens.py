@@ -0,0 +1,199 @@
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from threading import Lock
+from flask import current_app
+from flask_jwt_extended import create_access_token, create_refresh_token
+from sqlalchemy import event, inspect, insert, select, update, delete
+from sqlalchemy.orm import Session
+from init import db, jwt
+from models.user import User
+from models.token import RevokedToken, RevocationVersion, TokenFamily
+from utils.identity import admin_claims
+
+
+# Most seconds a worker goes without loading new revocations from the database, so a token revoked
+# by another worker stops working within this many seconds (revocations made by this worker apply at once)
+REVOCATION_SYNC_SECONDS = float(os.environ.get('REVOCATION_SYNC_SECONDS', 2))
+
+
+def utcnow():
+    # Times are stored in the database as UTC without a timezone
+    return datetime.now(timezone.utc).replace(tzinfo = None)
+
+
+def timestamp(value):
+    return value.replace(tzinfo = timezone.utc).timestamp()
+
+
+class RevocationList:
+    # The revoked_tokens rows that havent expired, kept in each worker as {key: (revoked_at, expires_at)}
+    # so checking a token is a few dictionary lookups, new rows are loaded by their version every REVOCATION_SYNC_SECONDS
+    def __init__(self):
+        self.entries = {}
+        self.version = 0
+        self.synced_at = None
+        self._lock = Lock()
+
+    def due(self):
+        return self.synced_at is None or time.monotonic() - self.synced_at >= REVOCATION_SYNC_SECONDS
+
+    def sync(self, connection):
+        # Only one request in a worker loads the new rows, the others carry on with the list as it is
+        if not self._lock.acquire(blocking = False):
+            return
+        try:
+            if not self.due():
+                return
+            qry = select(RevokedToken.key, RevokedToken.revoked_at, RevokedToken.expires_at, RevokedToken.version) \
+                .where(RevokedToken.version > self.version, RevokedToken.expires_at > utcnow())
+            for key, revoked_at, expires_at, version in connection.execute(qry):
+                self.remember(key, revoked_at, expires_at)
+                self.version = max(self.version, version)
+            # Entries for tokens that have all expired are dropped
+            now = time.time()
+            self.entries = {key: entry for key, entry in self.entries.items() if entry[1] > now}
+            self.synced_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def remember(self, key, revoked_at, expires_at):
+        self.entries[key] = (timestamp(revoked_at), timestamp(expires_at))
+
+    def revoked_by(self, key, claims):
+        # A key revokes the tokens issued up to when it was revoked, iat is in whole seconds
+        # so a token issued in the same second as the revocation is revoked too
+        entry = self.entries.get(key)
+        return entry is not None and claims.get('iat', 0) <= entry[0]
+
+    def is_revoked(self, claims):
+        return any(self.revoked_by(key, claims) for key in token_keys(claims))
+
+
+revocation_list = RevocationList()
+
+
+def token_keys(claims):
+    # The keys that can revoke a token, the token itself, the login it was refreshed from and its user
+    keys = [f'jti:{claims["jti"]}', f'user:{claims["sub"]}']
+    if claims.get('fam'):
+        keys.append(f'family:{claims["fam"]}')
+    return keys
+
+
+def issue_tokens(user, family, refresh_jti):
+    # A short lived access token and a refresh token to get new ones with, both carry the family id of the login
+    # so logging out (or a stolen refresh token being used twice) revokes every token refreshed from it
+    return {
+        'token': create_access_token(identity = str(user.id), additional_claims = {**admin_claims(user), 'fam': family}),
+        'refresh_token': create_refresh_token(identity = str(user.id), additional_claims = {'fam': family, 'jti': refresh_jti}),
+    }
+
+
+def login_tokens(session, user):
+    # Each login starts a new token family, expired families of the user are deleted as they log in
+    table = TokenFamily.__table__
+    session.execute(delete(table).where(table.c.user_id == user.id, table.c.expires_at < utcnow()))
+    family, refresh_jti = uuid.uuid4().hex, uuid.uuid4().hex
+    session.add(TokenFamily(id = family, user_id = user.id, refresh_jti = refresh_jti, expires_at = refresh_expiry()))
+    return issue_tokens(user, family, refresh_jti)
+
+
+def refresh_tokens(session, user, claims):
+    # Swaps the refresh token for new tokens if it is still the last one issued to its family, returns None if it isnt
+    # the UPDATE only matches the token it was issued for, so of two requests refreshing with the same token only one succeeds
+    # and a normal refresh only changes its own family row, nothing is added to revoked_tokens
+    table = TokenFamily.__table__
+    refresh_jti = uuid.uuid4().hex
+    swapped = session.execute(
+        update(table).where(table.c.id == claims['fam'], table.c.refresh_jti == claims['jti'])
+        .values(refresh_jti = refresh_jti, expires_at = refresh_expiry())
+    ).rowcount
+    if not swapped:
+        return None
+    return issue_tokens(user, claims['fam'], refresh_jti)
+
+
+def revoke(session, key, expires_at):
+    # Adds or updates a revoked_tokens row at the next version, returns whether the key was already revoked
+    # the version row stays locked until the commit so revocations commit in the order of their versions
+    # and a worker that has loaded a version can never miss a row with a lower one
+    connection = session.connection()
+    version_table = RevocationVersion.__table__
+    table = RevokedToken.__table__
+    version = connection.execute(
+        update(version_table).values(version = version_table.c.version + 1).returning(version_table.c.version)
+    ).scalar()
+    if version is None:
+        # Databases made with flask db create dont have the row yet
+        version = 1
+        connection.execute(insert(version_table).values(id = 1, version = version))
+    now = utcnow()
+    values = {'revoked_at': now, 'expires_at': expires_at, 'version': version}
+    existing = connection.execute(update(table).where(table.c.key == key).values(values)).rowcount
+    if not existing:
+        connection.execute(insert(table).values(key = key, **values))
+    # Rows for tokens that have all expired are no longer needed
+    connection.execute(delete(table).where(table.c.expires_at < now))
+    # This worker applies the revocation as soon as it is committed, the others on their next sync
+    session.info.setdefault('revoked_tokens', []).append((key, now, expires_at))
+    return existing > 0
+
+
+def refresh_expiry():
+    # Every token of a login or user has expired once the refresh token lifetime has passed
+    return utcnow() + current_app.config['JWT_REFRESH_TOKEN_EXPIRES']
+
+
+def revoke_token(session, claims):
+    expires_at = datetime.fromtimestamp(claims['exp'], timezone.utc).replace(tzinfo = None)
+    return revoke(session, f'jti:{claims["jti"]}', expires_at)
+
+
+def revoke_family(session, family):
+    return revoke(session, f'family:{family}', refresh_expiry())
+
+
+def revoke_user(session, user_id):
+    return revoke(session, f'user:{user_id}', refresh_expiry())
+
+
+@jwt.token_in_blocklist_loader
+def token_revoked(jwt_header, jwt_payload):
+    # Checked for every access and refresh token, only queries the database every REVOCATION_SYNC_SECONDS
+    if revocation_list.due():
+        with db.engine.connect() as connection:
+            revocation_list.sync(connection)
+    return revocation_list.is_revoked(jwt_payload)
+
+
+@jwt.revoked_token_loader
+def revoked_token_response(jwt_header, jwt_payload):
+    # A refresh token is revoked once it is swapped for new tokens, if it is used again someone else has a copy
+    # of it so every token refreshed from the same login is revoked
+    family = jwt_payload.get('fam')
+    if jwt_payload['type'] == 'refresh' and family and not revocation_list.revoked_by(f'family:{family}', jwt_payload):
+        revoke_family(db.session, family)
+        db.session.commit()
+    return {'msg': 'Token has been revoked'}, 401
+
+
+@event.listens_for(Session, 'after_flush')
+def revoke_changed_admins(session, flush_context):
+    # Tokens carry the is_admin claim, so when a users admin status changes their tokens are revoked
+    # and every worker stops accepting the old claim within seconds instead of when the token expires
+    for obj in session.dirty:
+        if isinstance(obj, User) and inspect(obj).attrs.is_admin.history.has_changes():
+            revoke_user(session, obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def remember_revoked_tokens(session):
+    for key, revoked_at, expires_at in session.info.pop('revoked_tokens', []):
+        revocation_list.remember(key, revoked_at, expires_at)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_revoked_tokens(session):
+    session.info.pop('revoked_tokens', None)
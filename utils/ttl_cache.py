@@ -0,0 +1,48 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class TTLCache:
+    # A bounded in-process cache, entries expire after ttl seconds
+    # and once maxsize entries are stored the least recently used entry is dropped to make room
+    def __init__(self, maxsize = 1024, ttl = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default = None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            # Expired entries are removed as they are found
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return default
+            # Marks the entry as the most recently used
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl = None):
+        # ttl defaults to the caches ttl, a ttl of 0 keeps the entry until it is deleted or pushed out by newer entries
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last = False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)